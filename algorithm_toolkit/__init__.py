@@ -48,7 +48,8 @@ app.config['CORS_ORIGIN_WHITELIST'].append('https://mytiledriver.com')
 app.config['CORS_ORIGIN_WHITELIST'].append('https://tdprocess.com')
 app.config['TILEDRIVER_URL'] = 'https://app.tiledriver.com/'
 
-from .views.home import home, main, run_chain, chain_run_status
+from .views.home import (
+    home, main, run_chain, chain_resume, chain_run_status, chain_result)
 from .views.manage import manage
 
 app.register_blueprint(home)
@@ -59,9 +60,16 @@ app.jinja_loader.searchpath.insert(0, app.config['ATK_PATH'] + '/templates')
 csrf = CSRFProtect(app)
 csrf.exempt(main)
 csrf.exempt(run_chain)
+csrf.exempt(chain_resume)
 csrf.exempt(chain_run_status)
+csrf.exempt(chain_result)
 
 
 @app.context_processor
 def inject_date():
     return dict(date=datetime.datetime.now())
+
+
+if app.config['PRELOAD_ALGORITHMS']:
+    from .utils.module_utils import preload_algorithms
+    preload_algorithms(app.config['ATK_PATH'])
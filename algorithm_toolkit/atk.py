@@ -1,28 +1,79 @@
 from __future__ import division
 
 import copy
-import glob
-import importlib
 import json
-import numpy as np
 import os
-import re
+import threading
+import time
 import traceback
 
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+    wait
+)
+from itertools import islice
+
 from . import app
 
-from .utils.data_utils import find_in_dict, text2int, test_json_serialize
+from .utils.array_utils import (
+    create_array_file,
+    is_array_ref,
+    open_array_ref
+)
+from .utils.batch_utils import (
+    BatchLedgerWriter,
+    BatchStage,
+    get_batch_values,
+    get_sweep_values
+)
+from .utils.cache_utils import (
+    get_result_cache,
+    get_source_hash,
+    replace_in_strings
+)
+from .utils.checkpoint_utils import (
+    append_checkpoint,
+    load_checkpoint,
+    save_checkpoint
+)
+from .utils.data_utils import (
+    SidecarWriter,
+    find_in_dict,
+    is_released_value,
+    summarize_value,
+    text2int,
+    to_json_value
+)
 from .utils.file_utils import (
+    copy_folder,
     get_json_path,
     get_algorithm,
+    get_definition_entry,
     make_dir_if_not_exists,
     get_chain_def,
     remove_folder
 )
+from .utils.module_utils import get_algorithm_module
+from .utils.status_utils import (
+    add_status_message,
+    get_run_state,
+    set_chain_status
+)
+from .utils.validation_utils import (
+    compile_parameter,
+    compile_validator,
+    get_entry_validator
+)
 
 from markupsafe import escape
 
 
+_status_lock = threading.Lock()
+
+
 class AlgorithmException(Exception):
     """Raise ATK-specific errors"""
 
@@ -39,14 +90,44 @@ class Algorithm:
     def set_up(self, name, json_path):
         self.name = name
 
-        with open(json_path) as json_file:
-            definition = json.load(json_file)
+        entry = get_definition_entry(json_path)
+        validator = get_entry_validator(entry)
 
-        if self.check_params(definition):
+        if self.check_params(entry.data, validator):
+            if entry.data.get('cacheable') and app.config['RESULT_CACHE']:
+                return self.run_cached(entry, os.path.dirname(json_path))
             return self.run()
         else:
             self.raise_parameter_errors(self.errors)
 
+    def run_cached(self, entry, folder):
+        # Reuses the metadata (and produced files) of an earlier run with
+        # the same algorithm source and resolved parameters
+        cl = self.cl
+        cache = get_result_cache()
+        key = cache.get_key(
+            self.name,
+            entry.data.get('version'),
+            get_source_hash(folder),
+            self.params,
+            cl.get_working_folder()
+        )
+        if key is None:
+            return self.run()
+
+        if cache.restore(key, cl):
+            cl.set_status('Using cached result for ' + self.name, 100)
+            return cl
+
+        before = dict(cl.metadata)
+        response = self.run()
+        produced = dict(
+            (k, v) for k, v in cl.metadata.items()
+            if k not in before or before[k] is not v
+        )
+        cache.put(key, produced, cl.get_working_folder())
+        return response
+
     def custom_check(self, val, val2, check):
         if check == 'greaterthan' and val <= val2:
             return False
@@ -62,171 +143,59 @@ class Algorithm:
         })
 
     def check_param(self, p, required, is_valid):
-        p_type = p['data_type'].lower()
-        params = self.params
-
-        """
-        Data type validation
-        """
-        if required:
-            if p['name'] not in params:
-                self.add_error_message(p['name'], 'Parameter missing')
-                is_valid = False
+        return compile_parameter(p, required).check(
+            self, self.params, is_valid)
 
-        if p_type == 'string' and type(params[p['name']]) != str:
-            try:
-                str(params[p['name']])
-            except ValueError:  # pragma: no cover
-                self.add_error_message(p['name'], 'Not a valid string')
-                is_valid = False
-        elif p_type == 'integer' and type(params[p['name']]) != int:
-            try:
-                params[p['name']] = int(params[p['name']])
-            except ValueError:
-                if not required and params[p['name']] == '':
-                    pass
-                else:
-                    self.add_error_message(p['name'], 'Not a valid integer')
-                    is_valid = False
-        elif p_type == 'float' and type(params[p['name']]) != float:
-            try:
-                params[p['name']] = float(params[p['name']])
-            except ValueError:
-                if not required and params[p['name']] == '':
-                    pass
-                else:
-                    self.add_error_message(p['name'], 'Not a valid float')
-                    is_valid = False
-        elif p_type == 'array' and type(
-                params[p['name']]) != list and type(
-                params[p['name']]) != np.ndarray:
-            try:
-                if params[p['name']][0] == '[':
-                    [item for item in params[p['name']][1:-1].split(",")]
-                else:
-                    [item for item in params[p['name']].split(",")]
-            except (ValueError, TypeError):
-                self.add_error_message(p['name'], 'Not a valid array')
-                is_valid = False
+    def check_params(self, definition, validator=None):
+        if validator is None:
+            validator = compile_validator(definition)
 
-        """
-        Parameter value validation: numeric parameters
-        """
-        if is_valid and (p_type == 'integer' or p_type == 'float'):
-            if 'min_value' in p and p['min_value']:
-                if params[p['name']] < p['min_value']:
-                    self.add_error_message(p['name'], 'Value too small')
-                    is_valid = False
-            if 'max_value' in p and p['max_value']:
-                if params[p['name']] > p['max_value']:
-                    self.add_error_message(p['name'], 'Value too large')
-                    is_valid = False
-            if 'custom_validation' in p:
-                p_cv = p['custom_validation']
-                if p_cv:
-                    p_cv = p_cv.lower().replace(' ', '')
-                    if (
-                            p_cv[:11] == 'greaterthan' or
-                            p_cv[:8] == 'lessthan'
-                    ):
-                        p_check = p_cv.split('.')[0]
-                        p_param = params[p_cv.split('.')[1]]
-                        if p_type == 'integer':
-                            p_param = int(p_param)
-                        else:
-                            p_param = float(p_param)
-                        if not self.custom_check(
-                                params[p['name']], p_param, p_check):
-                            if p_check == 'greaterthan':
-                                self.add_error_message(
-                                    p['name'],
-                                    'Value must be greater than ' + str(
-                                        p_param)
-                                )
-                            else:
-                                self.add_error_message(
-                                    p['name'],
-                                    'Value must be less than ' + str(
-                                        p_param)
-                                )
-                            is_valid = False
-                if p_type == 'integer':
-                    if p_cv == 'evenonly' and params[p['name']] % 2 != 0:
-                        self.add_error_message(
-                            p['name'], 'Value must be an even number')
-                        is_valid = False
-                    elif p_cv == 'oddonly' and params[p['name']] % 2 == 0:
-                        self.add_error_message(
-                            p['name'], 'Value must be an odd number')
-                        is_valid = False
-
-        """
-        Parameter value validation: value in list
-        """
-        if 'parameter_choices' in p:
-            p_c = p['parameter_choices']
-            if is_valid and p_c is not None:
-                if len(p_c) > 0 and params[p['name']] not in p_c:
-                    self.add_error_message(
-                        p['name'],
-                        'Value not in list of valid choices: ' + str(
-                            p_c
-                        )
-                    )
-                    is_valid = False
-
-        """
-        Parameter value validation: Regular Expression
-        """
-        if 'custom_validation' in p:
-            p_cv = p['custom_validation']
-            if is_valid and p_cv and p_cv[0] == '^':
-                if not re.match(p_cv, params[p['name']]):
-                    self.add_error_message(
-                        p['name'],
-                        'Value does not match expression: "' + p_cv + '"'
-                    )
-                    is_valid = False
-
-        return is_valid
-
-    def check_params(self, definition):
-        rps = definition['required_parameters']
-        ops = definition['optional_parameters']
         is_valid = True
-        for rp in rps:
+        for rp in validator.required:
             try:
-                is_valid = self.check_param(rp, True, is_valid)
+                is_valid = rp.check(self, self.params, is_valid)
             except Exception as e:
                 if hasattr(e, 'message'):
                     msg = e.message
                 else:
                     msg = e.args[0]
 
-                self.add_error_message(rp['name'], msg)
+                self.add_error_message(rp.name, msg)
                 is_valid = False
 
-        for op in ops:
-            if op['name'] in self.params:
-                if self.params[op['name']] != '' and self.params[op['name']] is not None:
+        for op in validator.optional:
+            if op.name in self.params:
+                if self.params[op.name] != '' and self.params[op.name] is not None:
                     try:
-                        is_valid = self.check_param(op, False, is_valid)
+                        is_valid = op.check(self, self.params, is_valid)
                     except Exception as e:
                         if hasattr(e, 'message'):
                             msg = e.message
                         else:
                             msg = e.args[0]
 
-                        self.add_error_message(op['name'], msg)
+                        self.add_error_message(op.name, msg)
                         is_valid = False
                 else:
-                    del self.params[op['name']]
+                    del self.params[op.name]
 
         return is_valid
 
     def run(self):  # pragma: no cover
         pass
 
+    def run_batch(self, params_list):  # pragma: no cover
+        # Optional hook for batch runs: receives a chunk of validated
+        # parameter dicts and returns one dict of metadata per item, in
+        # order, to add to that item's ledger. self.cl is the batch's own
+        # ledger (for status updates) and self.params is None. Only called
+        # for algorithms that override it (see has_batch_hook).
+        pass
+
+    @classmethod
+    def has_batch_hook(cls):
+        return cls.run_batch is not Algorithm.run_batch
+
     def raise_parameter_errors(self, err):
         raise ValueError(err)
 
@@ -234,14 +203,196 @@ class Algorithm:
         raise AlgorithmException(err)
 
 
+class HistoryIndex(object):
+    '''
+    Positions of ChainLedger history entries by algorithm name and by
+    metadata key. Shared between a ledger and its views; entries are
+    indexed as they are archived (or lazily, if the history list was
+    appended to directly).
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.names = {}
+        self.keys = {}
+        self.size = 0
+
+    def update(self, history):
+        with self.lock:
+            if len(history) < self.size:
+                # the history was cut short in place: index it again
+                self.names = {}
+                self.keys = {}
+                self.size = 0
+            for ind in range(self.size, len(history)):
+                item = history[ind]
+                self.names.setdefault(item['algorithm_name'], []).append(ind)
+                for k in item:
+                    self.keys.setdefault(k, []).append(ind)
+            self.size = len(history)
+
+    def get_positions(self, history, algorithm_name):
+        if self.size != len(history):
+            self.update(history)
+        return self.names.get(algorithm_name, [])
+
+    def get_key_positions(self, history, key):
+        if self.size != len(history):
+            self.update(history)
+        return self.keys.get(key, [])
+
+
+def get_ledger_sources(names, chain_definition, idx):
+    # (parameter, history position, key) for each chain_ledger parameter
+    # of algorithm idx. History positions match algorithm positions in the
+    # chain; the position is None if no earlier algorithm matches.
+    sources = []
+    if idx >= len(chain_definition):
+        return sources
+    temp_params = chain_definition[idx].get('parameters', {})
+    for p in temp_params:
+        p_items = temp_params[p]
+        if (
+            p_items.get('source') != 'chain_ledger' or
+            'source_algorithm' not in p_items
+        ):
+            continue
+        positions = [
+            j for j in range(idx) if names[j] == p_items['source_algorithm']]
+        index = -1
+        if 'occurrence' in p_items:
+            index = text2int(p_items['occurrence'])
+        try:
+            source = positions[index]
+        except IndexError:
+            source = None
+        sources.append((p, source, p_items['key']))
+    return sources
+
+
+class HistoryLiveness(object):
+    '''
+    Which ChainLedger history values the rest of a chain can still read,
+    worked out from the chain_ledger parameters in the chain definition.
+    Once the last algorithm reading a value has been archived, the value is
+    replaced with a summary (see summarize_value). Keys listed in
+    "pinned_keys" are kept: in algorithm.json, for keys the algorithm looks
+    up in the history itself; on a chain definition entry, for that
+    algorithm's results.
+    '''
+
+    def __init__(self, names, chain_definition, algorithm_pins):
+        # History positions match algorithm positions in the chain, so
+        # each chain_ledger parameter reads one known position
+        self.size = len(names)
+        self.last_read = {}
+        self.last_read_any = {}
+        self.pinned = set()
+        self.ledger_params = []
+        for idx, name in enumerate(names):
+            this_def = {}
+            if idx < len(chain_definition):
+                this_def = chain_definition[idx]
+            for key in this_def.get('pinned_keys', []):
+                self.pinned.add((idx, key))
+            for key in algorithm_pins[idx]:
+                self.last_read_any[key] = idx
+
+            params = []
+            for p, source, key in get_ledger_sources(
+                    names, chain_definition, idx):
+                params.append(p)
+                if source is not None:
+                    self.last_read[(source, key)] = idx
+            self.ledger_params.append(params)
+
+    def is_live(self, source, key, position):
+        # can an algorithm after position still read key from the history
+        # entry at source?
+        if (source, key) in self.pinned:
+            return True
+        last_read = max(
+            self.last_read.get((source, key), -1),
+            self.last_read_any.get(key, -1)
+        )
+        return last_read > position
+
+    def release(self, history, position, pinned_keys):
+        # Called once the algorithm at position has been archived. Entries
+        # are replaced rather than changed, as forked ledgers share them;
+        # the last algorithm's results are always kept.
+        if position >= self.size:
+            return
+        for ind in range(min(position + 1, self.size - 1)):
+            entry = history[ind]
+            released = None
+            for k, v in entry.items():
+                if k in ('algorithm_name', 'algorithm_params',
+                         'chain_output_value') or k in pinned_keys:
+                    continue
+                if self.is_live(ind, k, position):
+                    continue
+                summary = summarize_value(v)
+                if summary is not None:
+                    if released is None:
+                        released = dict(entry)
+                    released[k] = summary
+            if released is not None:
+                history[ind] = released
+
+        # The values the algorithm was given from the ledger are set again
+        # by every run, so they are released in place
+        params = history[position]['algorithm_params']
+        for p in self.ledger_params[position]:
+            summary = summarize_value(params.get(p))
+            if summary is not None:
+                params[p] = summary
+
+
+def run_batch_iteration(
+        path, chain_name, algs, status_key, idx, batch_percent):
+    # Entry point for batch iterations running in a worker process
+    c_obj = AlgorithmChain(
+        path, {'chain_name': chain_name, 'algorithms': algs})
+    c_obj.create_ledger(status_key).batch_percent = batch_percent
+    return c_obj.run_batch_iteration(idx)
+
+
+# the chain history a map worker process was started with
+_map_history = []
+
+
+def init_map_worker(history):
+    # Runs once in each map worker process, so the history is pickled once
+    # per worker rather than once per element
+    global _map_history
+    _map_history = history
+
+
+def run_map_element(
+        path, chain_name, algorithm, params, status_key, working_subfolder):
+    # Entry point for map elements running in a worker process
+    c_obj = AlgorithmChain(
+        path, {'chain_name': chain_name, 'algorithms': []})
+    cl = c_obj.ChainLedger(status_key, working_subfolder)
+    cl.history = _map_history
+    return c_obj.run_map_element(algorithm, params, cl)
+
+
 class AlgorithmChain(object):
 
     def __init__(self, path, passed_chain):
         self.atk_path = path
         self.chain_name = passed_chain['chain_name']
         self.algs = passed_chain['algorithms']
+        # the parameters as requested: running the chain validates and
+        # converts self.algs in place
+        self.request_algs = copy.deepcopy(self.algs)
         self.chain_ledger = None
-        self.chain_definition = get_chain_def(path, self.chain_name)
+        # history entries in each checkpoint this object saved
+        self.checkpoint_sizes = {}
+        self.chain_definition = get_chain_def(
+            path, self.chain_name, shared=True)
 
     class ChainLedger(object):
         '''
@@ -258,12 +409,26 @@ class AlgorithmChain(object):
         executes.
         '''
 
-        def __init__(self, status_key):
+        def __init__(self, status_key, working_subfolder=None):
             self.status_key = status_key
+            self.working_subfolder = working_subfolder
             self.metadata = {}
             self.history = []
             self.chain_percent = 0
             self.batch_percent = 0
+            self.batch_ledger = None
+            self.batch_stages = None
+            self.liveness = None
+            self.pinned_keys = set()
+            self.checkpoint = None
+            self._deferred_folders = False
+            self._pending_msg = None
+            self._pending_percent = 0
+            self._status_dirty = False
+            self._published_at = 0
+            self._published_percent = 0
+            self._latest_msg = ''
+            self._last_seq = 0
 
         def add_to_metadata(self, key, value):
             self.metadata[key] = value
@@ -275,95 +440,187 @@ class AlgorithmChain(object):
             self.metadata['algorithm_name'] = algorithm_name
             self.metadata['algorithm_params'] = algorithm_params
             self.history.append(self.metadata)
+            self._history_index.update(self._history)
+            if self.liveness is not None:
+                self.liveness.release(
+                    self._history, len(self._history) - 1, self.pinned_keys)
+            if self.checkpoint is not None:
+                self.checkpoint(self)
+
+        def pin_key(self, key):
+            # keep key in the history when RELEASE_LEDGER_VALUES is on
+            self.pinned_keys.add(key)
 
         def clear_current_metadata(self):
             self.metadata = {}
 
+        def create_view(self):
+            # A ledger sharing this one's history, status and folders but
+            # with its own metadata, for algorithms running concurrently
+            view = copy.copy(self)
+            view.metadata = {}
+            return view
+
+        def fork(self, working_subfolder):
+            # A ledger continuing from this one's history, with its own
+            # metadata and working folder, for one branch of a sweep
+            branch = copy.copy(self)
+            branch.working_subfolder = working_subfolder
+            branch.metadata = {}
+            branch.history = list(self.history)
+            if self.batch_ledger is None:
+                branch.batch_ledger = self
+            branch.make_working_folders()
+            return branch
+
+        @property
+        def history(self):
+            return self._history
+
+        @history.setter
+        def history(self, value):
+            # replacing the list starts a fresh index
+            self._history = value
+            self._history_index = HistoryIndex()
+
         def get_history_size(self):
             return len(self.history)
 
         def get_from_history(self, history_index, key):
             return self.history[history_index][key]
 
-        def search_all_history(self, key):
-            names = list(set(
-                [item['algorithm_name'] for item in self.history]))
-            items = []
-            for name in names:
-                items.extend(self.search_history(key, name))
-            return [item for item in items if item]
+        def get_history_positions(self, algorithm_name):
+            return self._history_index.get_positions(
+                self._history, algorithm_name)
 
-        def search_history(self, key, algorithm_name):
+        def search_all_history(self, key):
+            history = self._history
             items = []
-            for item in self.history:
-                if item['algorithm_name'] == algorithm_name:
-                    value = find_in_dict(key, item)
+            for ind in self._history_index.get_key_positions(history, key):
+                value = find_in_dict(key, history[ind])
+                if value:
                     items.append(value)
             return items
 
-        def is_algo_in_history(self, algorithm_name):
-            for item in self.history:
-                if item['algorithm_name'] == algorithm_name:
-                    return True
+        def search_history(self, key, algorithm_name):
+            history = self._history
+            return [
+                find_in_dict(key, history[ind])
+                for ind in self.get_history_positions(algorithm_name)
+            ]
+
+        def search_history_occurrence(self, key, algorithm_name, occurrence):
+            # Same as search_history(key, algorithm_name)[occurrence], without
+            # building the intermediate list
+            ind = self.get_history_positions(algorithm_name)[occurrence]
+            return find_in_dict(key, self._history[ind])
 
-            return False
+        def is_algo_in_history(self, algorithm_name):
+            return len(self.get_history_positions(algorithm_name)) > 0
+
+        def set_status(self, status, percent=0, force=False):
+            # Updates are coalesced: the latest one is published at most
+            # every STATUS_UPDATE_INTERVAL seconds, or sooner when the
+            # percentage moves by STATUS_PERCENT_STEP. force publishes now.
+            if force and self._pending_msg is not None:
+                self.flush_status()
+            self._pending_msg = status
+            self._pending_percent = percent
+            self._status_dirty = True
+            if force or self.is_status_due(percent):
+                self.flush_status()
+
+        def progress(self, done, total):
+            # algorithm progress without a status message
+            if total:
+                percent = int(done / total * 100)
+            else:
+                percent = 100
+            if percent != self._pending_percent:
+                self._pending_percent = percent
+                self._status_dirty = True
+                if self.is_status_due(percent):
+                    self.flush_status()
+
+        def is_status_due(self, percent):
+            return (
+                time.time() - self._published_at >=
+                app.config['STATUS_UPDATE_INTERVAL'] or
+                abs(percent - self._published_percent) >=
+                app.config['STATUS_PERCENT_STEP']
+            )
+
+        def flush_status(self):
+            if not self._status_dirty:
+                return
+            self._status_dirty = False
+            self._published_at = time.time()
+            self._published_percent = self._pending_percent
 
-        def set_status(self, status, percent=0):
             chain_status = {}
-            status = escape(str(status))
-            chain_status['latest_msg'] = status
-            try:
-                all_msg = app.config[self.status_key]['all_msg'] + '  \n'
-                all_msg += status
-            except KeyError:
-                all_msg = status
-            chain_status['all_msg'] = all_msg
-            chain_status['algorithm_percent_complete'] = percent
+            chain_status['algorithm_percent_complete'] = self._pending_percent
             chain_status['chain_percent_complete'] = self.chain_percent
+            if self.batch_ledger is not None:
+                self.batch_percent = self.batch_ledger.batch_percent
+                self.batch_stages = self.batch_ledger.batch_stages
             chain_status['batch_percent_complete'] = self.batch_percent
-            app.config[self.status_key] = chain_status
+            if self.batch_stages is not None:
+                chain_status['batch_stages'] = [
+                    stage.get_stats() for stage in self.batch_stages]
+            with _status_lock:
+                if self._pending_msg is not None:
+                    self._latest_msg = escape(str(self._pending_msg))
+                    self._pending_msg = None
+                    self._last_seq = add_status_message(
+                        self.status_key, self._latest_msg)
+                chain_status['latest_msg'] = self._latest_msg
+                chain_status['last_seq'] = self._last_seq
+                set_chain_status(self.status_key, chain_status)
 
         def get_run_state(self):
-            # set run_state for the chain or batch job
+            # run_state for the chain or batch job
             # 0 = cancel
             # 1 = running
-            if self.status_key + '_run_state' in app.config:
-                return app.config[self.status_key + '_run_state']
-            return 1
+            return get_run_state(self.status_key)
 
-        def history_to_json(self):
-            alg_param_history = self.params_to_json()
+        def history_to_json(self, sidecars=None):
+            # Builds new dicts; the history itself is never modified
+            alg_param_history = self.params_to_json(sidecars)
+            inline_size = app.config['HISTORY_INLINE_ARRAY_SIZE']
             for ind in range(self.get_history_size()):
                 metadata = self.history[ind]
+                json_metadata = alg_param_history['atk_chain_metadata'][ind]
                 for k, v in metadata.items():
                     if (
                         k != 'algorithm_params' and
                         k != 'algorithm_name' and
                         k != 'chain_output_value'
                     ):
-                        if not test_json_serialize(v):
-                            v = 'Value not JSON serializable'
-                        alg_param_history['atk_chain_metadata'][ind][k] = v
+                        json_metadata[k] = to_json_value(
+                            v, sidecars, inline_size)
 
             return alg_param_history
 
         def save_history_to_json(self, filename, pretty=False):
-            json_dict = self.history_to_json()
+            # large arrays and binary values are written to .npy files in a
+            # folder next to the history file
+            sidecars = SidecarWriter(os.path.splitext(filename)[0] + '_arrays')
+            json_dict = self.history_to_json(sidecars)
             self.save_json_to_file(json_dict, filename, pretty)
 
-        def params_to_json(self):
+        def params_to_json(self, sidecars=None):
+            inline_size = app.config['HISTORY_INLINE_ARRAY_SIZE']
             alg_chain_info = []
             for ind in range(self.get_history_size()):
                 params = self.get_from_history(ind, 'algorithm_params')
-                for k, v in params.items():
-                    if not test_json_serialize(v):
-                        params[k] = 'Value not JSON serializable'
-
                 alg_chain_info.append(
                     {
                         'algorithm_name': self.get_from_history(
                             ind, 'algorithm_name'),
-                        'algorithm_params': params
+                        'algorithm_params': dict(
+                            (k, to_json_value(v, sidecars, inline_size))
+                            for k, v in params.items()
+                        )
                     }
                 )
             return {'atk_chain_metadata': alg_chain_info}
@@ -381,137 +638,810 @@ class AlgorithmChain(object):
                 fp.write(json.dumps(content))
             fp.close()
 
-        def make_working_folders(self):
+        def get_working_folder(self):
             base_path = os.path.join(
                 app.config['DEFAULT_WORKING_ROOT'], self.status_key)
-            temp_path = os.path.join(base_path, 'temp')
+            if self.working_subfolder:
+                base_path = os.path.join(base_path, self.working_subfolder)
+            if self._deferred_folders:
+                self._deferred_folders = False
+                make_dir_if_not_exists(os.path.join(base_path, 'temp'))
+            return base_path
+
+        def make_working_folders(self, deferred=False):
+            # deferred: made the first time a folder is asked for
+            if deferred:
+                self._deferred_folders = True
+                return
+            temp_path = os.path.join(self.get_working_folder(), 'temp')
             make_dir_if_not_exists(temp_path)
 
         def get_temp_folder(self):
-            return os.path.join(
-                app.config['DEFAULT_WORKING_ROOT'], self.status_key, 'temp')
+            return os.path.join(self.get_working_folder(), 'temp')
 
         def clear_temp_folder(self):
             remove_folder(self.get_temp_folder())
             self.make_working_folders()
 
+        def create_array(self, key, shape, dtype='float32'):
+            # Allocates a memory-mapped array in the temp folder and adds a
+            # reference to it (path, shape and dtype) to metadata under key
+            array, ref = create_array_file(
+                os.path.join(self.get_temp_folder(), 'arrays'),
+                key, shape, dtype
+            )
+            self.add_to_metadata(key, ref)
+            return array
+
+        def open_array(self, ref, mode='r'):
+            # ref is an array reference (e.g.: a chain_ledger parameter) or
+            # the metadata key it was created under
+            if not is_array_ref(ref):
+                ref = self.get_from_metadata(ref)
+            return open_array_ref(ref, mode)
+
         def remove_working_folders(self):
-            base_path = os.path.join(
-                app.config['DEFAULT_WORKING_ROOT'], self.status_key)
-            remove_folder(base_path)
+            self._deferred_folders = False
+            remove_folder(self.get_working_folder())
 
     def create_ledger(self, status_key):
         self.chain_ledger = self.ChainLedger(status_key)
+        self.chain_ledger.liveness = self.get_liveness()
         return self.chain_ledger
 
+    def start_checkpoints(self):
+        # With CHAIN_CHECKPOINTS on, the chain and its ledger history are
+        # saved after every algorithm, so that a failed or interrupted run
+        # can be resumed (see resume_checkpoint)
+        if app.config['CHAIN_CHECKPOINTS']:
+            self.chain_ledger.checkpoint = self.save_checkpoint
+
+    def save_checkpoint(self, cl, kind='checkpoint'):
+        # The first save writes the whole checkpoint; later ones only add
+        # the entries archived since, so a long chain does not rewrite its
+        # history after every algorithm
+        saved_key = (cl.status_key, kind)
+        saved = self.checkpoint_sizes.get(saved_key)
+        try:
+            if saved is not None and saved <= len(cl.history):
+                append_checkpoint(
+                    self.atk_path, cl.status_key, cl.history[saved:], kind)
+            else:
+                checkpoint = {
+                    'chain': {
+                        'chain_name': self.chain_name,
+                        'algorithms': self.request_algs
+                    },
+                    'history': cl.history
+                }
+                save_checkpoint(
+                    self.atk_path, cl.status_key, checkpoint, kind)
+            self.checkpoint_sizes[saved_key] = len(cl.history)
+        except Exception as e:
+            # the run goes on without a checkpoint; the next save writes
+            # it whole
+            self.checkpoint_sizes.pop(saved_key, None)
+            app.logger.warning(
+                'Could not save checkpoint for ' + cl.status_key + ': ' +
+                str(type(e).__name__) + ':' + str(e.args)
+            )
+
+    def resume_checkpoint(self):
+        # Restores the ledger history of the chain ledger's last checkpoint;
+        # returns the index of the first algorithm still to run, or None
+        checkpoint = load_checkpoint(
+            self.atk_path, self.chain_ledger.status_key)
+        if checkpoint is None:
+            return None
+        self.chain_ledger.history = checkpoint['history']
+        return len(checkpoint['history'])
+
+    def rerun_checkpoint(self, previous_key):
+        # Starts the chain ledger from a previous run of the chain (kept
+        # for RERUN_HISTORY_LENGTH, or a failed run's checkpoint): its
+        # history up to the first algorithm that has to run again, and a
+        # copy of its working folder. Returns the index of that algorithm;
+        # 0 if the previous run is not available.
+        checkpoint = load_checkpoint(self.atk_path, previous_key, 'rerun')
+        if checkpoint is None:
+            checkpoint = load_checkpoint(self.atk_path, previous_key)
+        if checkpoint is None:
+            app.logger.info('Previous run not found: ' + previous_key)
+            return 0
+
+        cl = self.chain_ledger
+        start_idx = self.get_rerun_index(checkpoint)
+        history = checkpoint['history'][:start_idx]
+        if start_idx and previous_key != cl.status_key:
+            previous_folder = self.ChainLedger(
+                previous_key).get_working_folder()
+            copy_folder(previous_folder, cl.get_working_folder())
+            history = replace_in_strings(
+                history,
+                os.path.join(previous_folder, ''),
+                os.path.join(cl.get_working_folder(), '')
+            )
+        cl.history = history
+        return start_idx
+
+    def get_rerun_index(self, checkpoint):
+        # The first algorithm whose name or user parameters differ from the
+        # previous run; at least the last algorithm runs again. If it or a
+        # later algorithm reads a ledger value the previous run released
+        # (RELEASE_LEDGER_VALUES), the algorithm that made it runs again.
+        if checkpoint['chain']['chain_name'] != self.chain_name:
+            return 0
+        old_algs = checkpoint['chain']['algorithms']
+        history = checkpoint['history']
+        names = [a['name'] for a in self.algs]
+
+        start_idx = min(len(history), len(old_algs), len(self.algs) - 1)
+        for idx in range(start_idx):
+            if (
+                old_algs[idx]['name'] != names[idx] or
+                self.get_user_params(idx, old_algs[idx]) !=
+                self.get_user_params(idx, self.request_algs[idx])
+            ):
+                start_idx = idx
+                break
+
+        changed = True
+        while changed:
+            changed = False
+            for idx in range(start_idx, len(self.algs)):
+                for p, source, key in get_ledger_sources(
+                        names, self.chain_definition, idx):
+                    if source is not None and source < start_idx and (
+                            is_released_value(history[source].get(key))):
+                        start_idx = source
+                        changed = True
+        return start_idx
+
+    def get_user_params(self, idx, alg):
+        # the parameters of alg that do not come from the chain ledger
+        ledger_params = [
+            p for p, source, key in get_ledger_sources(
+                [a['name'] for a in self.algs], self.chain_definition, idx)
+        ]
+        return dict(
+            (k, v) for k, v in alg.get('parameters', {}).items()
+            if k not in ledger_params
+        )
+
+    def get_liveness(self):
+        if not app.config['RELEASE_LEDGER_VALUES']:
+            return None
+        names = [a['name'] for a in self.algs]
+        algorithm_pins = []
+        for name in names:
+            json_path = get_json_path(self.atk_path, name)
+            algorithm_pins.append(
+                get_algorithm(json_path, shared=True).get('pinned_keys', []))
+        return HistoryLiveness(
+            names, self.chain_definition, algorithm_pins)
+
     def check_licenses(self):  # pragma: no cover
         pass
 
-    def call_batch(self, iter_param, iter_type, iter_value):
-        alg, param = iter_param.split('__')
-        batch_has_error = False
-        msg = ''
-        iter_list = []
+    def get_batch_list(self, iter_param, iter_type, iter_value):
+        # Returns (values, error message); values are produced lazily
+        return get_batch_values(
+            self.atk_path, iter_param, iter_type, iter_value)
 
-        if iter_type == 'files':
-            iter_list = glob.glob(str(iter_value))
-        elif iter_type == 'range':
-            try:
-                ranges = [int(x.strip()) for x in iter_value.split(',')]
-                if len(ranges) == 3:
-                    iter_list = range(ranges[0], ranges[1] + 1, ranges[2])
-                elif len(ranges) == 2:
-                    iter_list = range(ranges[0], ranges[1] + 1)
-                else:
-                    batch_has_error = True
-                    msg = 'Invalid iterator'
-            except ValueError:
-                batch_has_error = True
-                msg = 'Invalid iterator'
-
-        if len(iter_list) == 0:
-            batch_has_error = True
-            if msg == '':
-                msg = 'Empty batch'
-
-        if batch_has_error:
+    def call_batch(
+            self, iter_param, iter_type, iter_value, batch_workers=None):
+        iter_list, msg = self.get_batch_list(
+            iter_param, iter_type, iter_value)
+        if msg:
             response = {
                 'output_type': 'error',
                 'message': msg
             }
             return response
 
-        batch_result = []
-        batch_output = {}
-        original_algs = self.algs
-        temp_alg = [x for x in original_algs if x['name'] == alg][0]
-        batch_length = len(iter_list)
+        return self.collect_batch_results(self.iter_batch_results(
+            iter_param, iter_type, iter_value, iter_list, batch_workers))
 
-        self.chain_ledger.set_status('Starting batch job...', 0)
-
-        for idx, i in enumerate(iter_list):
-            if self.chain_ledger.get_run_state() == 0:
+    def collect_batch_results(self, results):
+        # With BATCH_INLINE_RESULTS off, nothing accumulates in memory
+        inline_results = app.config['BATCH_INLINE_RESULTS']
+        batch_result = []
+        for idx, value, response in results:
+            if response is None:
                 response = {
                     'output_type': 'error',
                     'message': 'Batch job cancelled'
                 }
                 return response
-            temp_alg['parameters'][param] = i
-            self.algs = copy.deepcopy(original_algs)
-            try:
-                response = self.call_chain_algorithms()
-            except Exception as e:
-                message = str(type(e).__name__) + ':' + str(e.args)
-                app.logger.error(str(traceback.format_exc()))
-                response = {
-                    'output_type': 'error',
-                    'error_message': str(message)
-                }
+            if inline_results:
+                batch_result.append(response)
 
-            batch_result.append(response)
-            batch_output[idx] = self.chain_ledger.history_to_json()
+        if inline_results:
+            response = {
+                'output_type': 'batch_result',
+                'output_value': batch_result
+            }
+        else:
+            response = {
+                'output_type': 'batch_ledger',
+                'output_value': self.batch_manifest
+            }
+        return response
 
-            self.chain_ledger.history = []
-            self.chain_ledger.metadata = {}
-            self.chain_ledger.batch_percent = int(
-                (idx + 1) / batch_length * 100)
+    def iter_batch_results(
+            self, iter_param, iter_type, iter_value, iter_list,
+            batch_workers=None):
+        # Runs a batch; see record_batch_results. iter_list is a
+        # BatchValues and is never materialized.
+        alg, param = iter_param.split('__')
+        if batch_workers is None:
+            batch_workers = app.config['BATCH_WORKERS']
+
+        chunk_size = app.config['BATCH_CHUNK_SIZE']
+        use_pipeline = app.config['BATCH_EXECUTOR'] == 'pipeline'
+        if use_pipeline and len(self.algs) > 1:
+            iterations = self.iter_batch_pipeline(iter_list, iter_param)
+        elif batch_workers > 1:
+            iterations = self.iter_batch_parallel(
+                iter_list, alg, param, batch_workers)
+        elif chunk_size > 1 and self.has_batch_hooks():
+            iterations = self.iter_batch_chunked(
+                iter_list, iter_param, chunk_size)
+        else:
+            iterations = self.iter_batch_sequential(iter_list, alg, param)
+
+        manifest = {
+            'batch_type': iter_type,
+            'batch_iterator': iter_param,
+            'batch_iteration_value': iter_value,
+            'iterations': iter_list.total
+        }
+        return self.record_batch_results(manifest, iter_list, iterations)
+
+    def record_batch_results(self, manifest, values, iterations):
+        # Yields (idx, value, response) in iteration order as iterations
+        # finish, writing each one to the batch ledger; response is None if
+        # the job was cancelled. The ledger manifest is left in
+        # self.batch_manifest. Progress is only reported once the total
+        # number of values is known.
+        original_algs = self.algs
+        values.start_count()
+        batch_ledger = BatchLedgerWriter(
+            self.atk_path, self.chain_ledger.status_key, manifest)
+        self.batch_manifest = batch_ledger.manifest
+
+        self.chain_ledger.set_status('Starting batch job...', 0, force=True)
+
+        try:
+            for idx, value, response, history in iterations:
+                if response is None:
+                    batch_ledger.close('cancelled')
+                    yield idx, value, None
+                    return
+
+                batch_ledger.write(idx, value, response, history)
+                if values.total:
+                    self.chain_ledger.batch_percent = min(
+                        int((idx + 1) / values.total * 100), 100)
+                yield idx, value, response
+        except GeneratorExit:
+            # a streaming client went away
+            batch_ledger.close('cancelled')
+            raise
+        except Exception:
+            batch_ledger.close('error')
+            raise
+        finally:
+            iterations.close()
+            values.stop()
+            self.algs = original_algs
+
+        batch_ledger.close('complete')
+        self.chain_ledger.batch_percent = 100
+        self.chain_ledger.set_status('Batch complete', 100, force=True)
+
+    def get_sweep_list(self, sweep, sweep_mode='product'):
+        # Returns (segments, values, error message). Each segment is
+        # (start, stop, combinations): the algorithms from start up to stop
+        # run once per combination of the parameters varied at start.
+        names = [a['name'] for a in self.algs]
+        dims = []
+        for d in sweep:
+            alg = d['iter_param'].split('__')[0]
+            if alg not in names or '__' not in d['iter_param']:
+                return None, None, 'Invalid iterator'
+            values, msg = get_batch_values(
+                self.atk_path, d['iter_param'], d['iter_type'],
+                d['iter_value']
+            )
+            if msg:
+                return None, None, msg
+            dims.append((names.index(alg), d['iter_param'], values))
+        dims.sort(key=lambda d: d[0])
+
+        values = get_sweep_values(
+            [(d[1], d[2]) for d in dims], sweep_mode)
+        if values.total == 0:
+            return None, None, 'Empty batch'
+
+        if sweep_mode == 'zip':
+            return [(dims[0][0], len(self.algs), values)], values, ''
+
+        starts = sorted(set(d[0] for d in dims))
+        segments = []
+        for n, start in enumerate(starts):
+            stop = starts[n + 1] if n + 1 < len(starts) else len(self.algs)
+            combinations = get_sweep_values(
+                [(d[1], d[2]) for d in dims if d[0] == start])
+            segments.append((start, stop, list(combinations)))
+        return segments, values, ''
+
+    def call_sweep(self, sweep, sweep_mode='product'):
+        segments, values, msg = self.get_sweep_list(sweep, sweep_mode)
+        if msg:
+            response = {
+                'output_type': 'error',
+                'message': msg
+            }
+            return response
+
+        return self.collect_batch_results(
+            self.iter_sweep_results(sweep, sweep_mode, segments, values))
 
+    def iter_sweep_results(self, sweep, sweep_mode, segments, values):
+        # Runs a sweep; see record_batch_results
+        manifest = {
+            'batch_type': 'sweep',
+            'sweep': sweep,
+            'sweep_mode': sweep_mode,
+            'iterations': values.total
+        }
+        return self.record_batch_results(
+            manifest, values, self.iter_sweep(segments))
+
+    def iter_sweep(self, segments):
+        # Algorithms upstream of every varied parameter run once, in the
+        # chain's own ledger; each segment after that runs in a fork of
+        # the ledger it continues from, so shared upstream work is done
+        # once per distinct combination rather than once per iteration.
+        # Iterations are numbered in depth-first order.
+        cl = self.chain_ledger
+        self.sweep_branches = 0
+        error = self.run_chain_segment(cl, self.algs, 0, segments[0][0])
+        leaves = self.iter_sweep_tree(cl, self.algs, segments, 0, {}, error)
+        for idx, (value, response, history) in enumerate(leaves):
+            yield idx, value, response, history
+
+    def iter_sweep_tree(self, cl, algs, segments, level, value, error):
+        # Yields (value, response, history) for every combination below
+        # this branch; response is None if the job was cancelled. Once a
+        # segment fails, every combination below it gets its error.
+        start, stop, combinations = segments[level]
+        last = level == len(segments) - 1
+        for combination in combinations:
+            if self.chain_ledger.get_run_state() == 0:
+                yield value, None, None
+                return
+
+            branch_value = dict(value)
+            branch_value.update(combination)
+            branch_cl = cl
+            branch_algs = algs
+            branch_error = error
+            if error is None:
+                self.sweep_branches += 1
+                branch_cl = cl.fork('sweep_' + str(self.sweep_branches))
+                branch_algs = self.get_sweep_algs(algs, combination)
+                branch_error = self.run_chain_segment(
+                    branch_cl, branch_algs, start, stop)
+
+            try:
+                if last:
+                    response = branch_error
+                    if response is None:
+                        response = self.finish_chain_run(branch_cl)
+                    yield branch_value, response, branch_cl.history_to_json()
+                    continue
+
+                for leaf in self.iter_sweep_tree(
+                        branch_cl, branch_algs, segments, level + 1,
+                        branch_value, branch_error):
+                    yield leaf
+                    if leaf[1] is None:
+                        return
+            finally:
+                if branch_cl is not cl:
+                    branch_cl.remove_working_folders()
+
+    def get_sweep_algs(self, algs, combination):
+        # Only the parameter dicts are copied: call_algorithm writes
+        # chain_ledger sources into them, and values may be large
+        algs = [
+            dict(a, parameters=dict(a.get('parameters', {}))) for a in algs]
+        for iter_param, value in combination.items():
+            alg, param = iter_param.split('__')
+            temp_alg = [x for x in algs if x['name'] == alg][0]
+            temp_alg['parameters'][param] = value
+        return algs
+
+    def run_chain_segment(self, cl, algs, start, stop):
+        # Runs algs[start:stop] on the ledger cl; returns an error response,
+        # or None if they all succeed
+        chain_length = len(algs)
+        try:
+            for idx in range(start, stop):
+                a = algs[idx]
+                cl.chain_percent = int(idx / chain_length * 100)
+                cl.set_status('Running algorithm: ' + a['name'], force=True)
+                temp_params = a.setdefault('parameters', {})
+                cl = self.call_algorithm(a['name'], temp_params, idx, cl)
+                cl.archive_metadata(a['name'], temp_params)
+                if idx != chain_length - 1:
+                    cl.clear_current_metadata()
+        except (ValueError, AlgorithmException) as e:
+            return self.get_error_response(e)
+        except Exception as e:
+            return self.get_exception_response(e)
+        return None
+
+    def get_batch_algs(self, alg, param, value):
+        algs = copy.deepcopy(self.algs)
+        temp_alg = [x for x in algs if x['name'] == alg][0]
+        temp_alg['parameters'][param] = value
+        return algs
+
+    def get_exception_response(self, e):
+        message = str(type(e).__name__) + ':' + str(e.args)
+        app.logger.error(str(traceback.format_exc()))
+        self.chain_ledger.flush_status()
         response = {
-            'output_type': 'batch_result',
-            'output_value': batch_result
+            'output_type': 'error',
+            'error_message': str(message)
         }
+        return response
 
-        batch_output['batch_type'] = iter_type
-        batch_output['batch_iterator'] = iter_param
-        batch_output['batch_iteration_value'] = iter_value
+    def run_chain_safely(self):
+        try:
+            response = self.call_chain_algorithms()
+        except Exception as e:
+            response = self.get_exception_response(e)
+        return response
 
-        save_fname = 'batch_' + self.chain_ledger.status_key + '.json'
-        if 'CHAIN_LEDGER_HISTORY_PATH' in app.config:
-            save_path = os.path.join(
-                app.config['CHAIN_LEDGER_HISTORY_PATH'], save_fname)
+    def iter_batch_sequential(self, iter_list, alg, param):
+        # Every iteration reuses the chain's own ledger and working folder
+        original_algs = self.algs
+        for idx, i in enumerate(iter_list):
+            if self.chain_ledger.get_run_state() == 0:
+                yield idx, i, None, None
+                return
+
+            self.algs = self.get_batch_algs(alg, param, i)
+            response = self.run_chain_safely()
+            history = self.chain_ledger.history_to_json()
+
+            self.chain_ledger.history = []
+            self.chain_ledger.metadata = {}
+            self.algs = original_algs
+
+            yield idx, i, response, history
+
+    def has_batch_hooks(self):
+        for a in self.algs:
+            m = get_algorithm_module(self.atk_path, a['name'])
+            if m.Main.has_batch_hook():
+                return True
+        return False
+
+    def iter_batch_chunked(self, iter_list, iter_param, chunk_size):
+        # Runs chunk_size iterations at a time, one algorithm at a time
+        # across the whole chunk, so that algorithms with a run_batch hook
+        # get every iteration's parameters in a single call. Each position
+        # in the chunk has its own ledger and working folder (made only if
+        # an algorithm uses it); like a sequential batch, later iterations
+        # reuse the folder.
+        status_key = self.chain_ledger.status_key
+        iterator = enumerate(iter_list)
+        slots = 0
+        try:
+            while True:
+                chunk = list(islice(iterator, chunk_size))
+                if not chunk:
+                    return
+                if self.chain_ledger.get_run_state() == 0:
+                    yield chunk[0][0], chunk[0][1], None, None
+                    return
+
+                items = []
+                for n, (idx, value) in enumerate(chunk):
+                    cl = self.ChainLedger(status_key, 'batch_' + str(n))
+                    cl.batch_ledger = self.chain_ledger
+                    cl.liveness = self.chain_ledger.liveness
+                    cl.make_working_folders(deferred=True)
+                    algs = self.get_sweep_algs(self.algs, {iter_param: value})
+                    items.append([idx, value, cl, algs, None])
+                slots = max(slots, len(chunk))
+
+                for stage in range(len(self.algs)):
+                    self.run_batch_stage(
+                        stage, [item for item in items if item[4] is None])
+
+                for idx, value, cl, algs, response in items:
+                    if response is None:
+                        response = self.get_chain_output(cl)
+                    yield idx, value, response, cl.history_to_json()
+        finally:
+            for n in range(slots):
+                self.ChainLedger(
+                    status_key, 'batch_' + str(n)).remove_working_folders()
+
+    def run_batch_stage(self, stage, items):
+        # Runs algorithm number stage for each [idx, value, ledger, algs,
+        # response] item; a failure is stored as the item's response
+        name = self.algs[stage]['name']
+        last = stage == len(self.algs) - 1
+        m = get_algorithm_module(self.atk_path, name)
+        self.chain_ledger.chain_percent = int(stage / len(self.algs) * 100)
+        self.chain_ledger.set_status('Running algorithm: ' + name, force=True)
+
+        batch_hook = m.Main.has_batch_hook()
+        if self.get_map_parameter(stage) is not None:
+            batch_hook = False
+
+        batched = []
+        for item in items:
+            if not batch_hook:
+                self.run_batch_item(stage, item)
+                continue
+
+            cl = item[2]
+            params = item[3][stage].setdefault('parameters', {})
+            try:
+                self.get_chain_params(stage, params, cl)
+                self.check_batch_params(m, name, cl, params)
+                batched.append((item, params))
+            except (ValueError, AlgorithmException) as e:
+                item[4] = self.get_error_response(e)
+            except Exception as e:
+                item[4] = self.get_exception_response(e)
+
+        if not batched:
+            return
+
+        try:
+            alg = m.Main(cl=self.chain_ledger, params=None)
+            alg.name = name
+            updates = alg.run_batch([params for item, params in batched])
+            if len(updates) != len(batched):
+                raise AlgorithmException(
+                    name + ' returned ' + str(len(updates)) +
+                    ' results for ' + str(len(batched)) + ' items')
+        except AlgorithmException as e:
+            response = self.get_error_response(e)
+            updates = None
+        except Exception as e:
+            response = self.get_exception_response(e)
+            updates = None
+
+        for n, (item, params) in enumerate(batched):
+            if updates is None:
+                item[4] = response
+                continue
+            cl = item[2]
+            cl.metadata.update(updates[n] or {})
+            cl.archive_metadata(name, params)
+            if not last:
+                cl.clear_current_metadata()
+
+    def run_batch_item(self, stage, item):
+        # Runs algorithm number stage for one [idx, value, ledger, algs,
+        # response] item; a failure is stored as the item's response
+        name = self.algs[stage]['name']
+        params = item[3][stage].setdefault('parameters', {})
+        try:
+            cl = self.call_algorithm(name, params, stage, item[2])
+            cl.archive_metadata(name, params)
+            if stage != len(self.algs) - 1:
+                cl.clear_current_metadata()
+        except (ValueError, AlgorithmException) as e:
+            item[4] = self.get_error_response(e)
+        except Exception as e:
+            item[4] = self.get_exception_response(e)
+
+    def iter_batch_pipeline(self, iter_list, iter_param):
+        # Each algorithm runs on a thread of its own, taking iterations
+        # from a bounded queue (BATCH_PIPELINE_DEPTH) and passing them on
+        # to the next algorithm's queue, so one iteration can be in the
+        # first algorithm while an earlier one is in the second. Iterations
+        # come out in order. Each stage's throughput and queue depth are
+        # published with the status as batch_stages.
+        depth = app.config['BATCH_PIPELINE_DEPTH']
+        status_key = self.chain_ledger.status_key
+        stages = [BatchStage(a['name'], depth) for a in self.algs]
+        output = BatchStage(None, depth)
+        targets = stages[1:] + [output]
+        stop = threading.Event()
+        state = {'cancelled': False, 'error': None}
+        ledgers = {}
+
+        def feed():
+            try:
+                for idx, value in enumerate(iter_list):
+                    if self.chain_ledger.get_run_state() == 0:
+                        state['cancelled'] = True
+                        break
+                    cl = self.ChainLedger(status_key, 'batch_' + str(idx))
+                    cl.batch_ledger = self.chain_ledger
+                    cl.liveness = self.chain_ledger.liveness
+                    cl.make_working_folders(deferred=True)
+                    ledgers[idx] = cl
+                    algs = self.get_sweep_algs(self.algs, {iter_param: value})
+                    if not stages[0].put([idx, value, cl, algs, None], stop):
+                        return
+            except Exception as e:
+                state['error'] = e
+            stages[0].put(None, stop)
+
+        def work(stage):
+            name = self.algs[stage]['name']
+            while True:
+                item = stages[stage].get(stop)
+                if item is None:
+                    targets[stage].put(None, stop)
+                    return
+                if item[4] is None:
+                    start = time.time()
+                    cl = item[2]
+                    cl.chain_percent = int(stage / len(self.algs) * 100)
+                    cl.set_status('Running algorithm: ' + name)
+                    self.run_batch_item(stage, item)
+                    stages[stage].busy += time.time() - start
+                stages[stage].completed += 1
+                if not targets[stage].put(item, stop):
+                    return
+
+        threads = [threading.Thread(target=feed)]
+        for stage in range(len(stages)):
+            threads.append(threading.Thread(target=work, args=(stage,)))
+        self.chain_ledger.batch_stages = stages
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        next_idx = 0
+        try:
+            while True:
+                item = output.get(stop)
+                if item is None:
+                    if state['error'] is not None:
+                        raise state['error']
+                    if state['cancelled']:
+                        yield next_idx, None, None, None
+                    return
+
+                idx, value, cl, algs, response = item
+                if response is None:
+                    response = self.get_chain_output(cl)
+                history = cl.history_to_json()
+                cl.remove_working_folders()
+                del ledgers[idx]
+                yield idx, value, response, history
+                next_idx = idx + 1
+        finally:
+            stop.set()
+            for t in threads:
+                t.join()
+            for cl in list(ledgers.values()):
+                cl.remove_working_folders()
+
+    def check_batch_params(self, m, name, cl, params):
+        # Validates an item's parameters the way set_up does; raises
+        # ValueError with the parameter errors
+        json_path = get_json_path(self.atk_path, name)
+        entry = get_definition_entry(json_path)
+        alg = m.Main(cl=cl, params=params)
+        alg.name = name
+        if not alg.check_params(entry.data, get_entry_validator(entry)):
+            alg.raise_parameter_errors(alg.errors)
+
+    def run_batch_iteration(self, idx, batch_ledger=None):
+        # Runs one batch iteration in its own ledger and working folder;
+        # self.algs must already hold the iteration's parameters
+        status_key = self.chain_ledger.status_key
+        cl = self.ChainLedger(status_key, 'batch_' + str(idx))
+        cl.batch_percent = self.chain_ledger.batch_percent
+        cl.batch_ledger = batch_ledger
+        cl.liveness = self.chain_ledger.liveness
+        self.chain_ledger = cl
+        cl.make_working_folders()
+
+        response = self.run_chain_safely()
+        history = cl.history_to_json()
+        cl.remove_working_folders()
+        return response, history
+
+    def iter_batch_parallel(self, iter_list, alg, param, batch_workers):
+        # Iterations run concurrently on a thread or process pool
+        # (BATCH_EXECUTOR) but are yielded in iteration order. New work is
+        # only submitted while the job has not been cancelled.
+        use_processes = app.config['BATCH_EXECUTOR'] == 'process'
+        if use_processes:
+            executor = ProcessPoolExecutor(max_workers=batch_workers)
         else:
-            make_dir_if_not_exists(os.path.join(self.atk_path, 'history'))
-            save_path = os.path.join(self.atk_path, 'history', save_fname)
-        self.chain_ledger.save_json_to_file(
-            batch_output, save_path, pretty=True)
+            executor = ThreadPoolExecutor(max_workers=batch_workers)
 
-        self.chain_ledger.batch_percent = 100
-        self.chain_ledger.set_status('Batch complete', 100)
+        max_pending = batch_workers * 2
+        pending = {}
+        values = {}
+        iterator = enumerate(iter_list)
+        next_idx = 0
+        exhausted = False
+        cancelled = False
 
-        return response
+        try:
+            while True:
+                while not exhausted and not cancelled and (
+                        len(pending) < max_pending):
+                    if self.chain_ledger.get_run_state() == 0:
+                        cancelled = True
+                        break
+                    try:
+                        idx, i = next(iterator)
+                    except StopIteration:
+                        exhausted = True
+                        break
+
+                    values[idx] = i
+                    algs = self.get_batch_algs(alg, param, i)
+                    if use_processes:
+                        pending[idx] = executor.submit(
+                            run_batch_iteration,
+                            self.atk_path,
+                            self.chain_name,
+                            algs,
+                            self.chain_ledger.status_key,
+                            idx,
+                            self.chain_ledger.batch_percent
+                        )
+                    else:
+                        it_chain = copy.copy(self)
+                        it_chain.algs = algs
+                        pending[idx] = executor.submit(
+                            it_chain.run_batch_iteration,
+                            idx,
+                            self.chain_ledger
+                        )
+
+                if next_idx not in pending:
+                    if cancelled:
+                        yield next_idx, None, None, None
+                    return
+
+                response, history = pending.pop(next_idx).result()
+                yield next_idx, values.pop(next_idx), response, history
+                next_idx += 1
+        finally:
+            for future in pending.values():
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    def call_chain_algorithms(self, start_idx=0):
+        # start_idx skips algorithms already in the ledger history, for
+        # resumed runs
+        if app.config['CHAIN_SCHEDULER'] == 'dag' and len(self.algs) > 1:
+            return self.call_chain_algorithms_concurrently(start_idx)
 
-    def call_chain_algorithms(self):
         cl = self.chain_ledger
         algs = self.algs
-        cl.set_status('Starting chain run...', 0)
+        cl.set_status('Starting chain run...', 0, force=True)
 
-        import time
         chain_length = len(algs)
         cl.chain_percent = 0
         for idx, a in enumerate(algs):
+            if idx < start_idx:
+                continue
             cl.chain_percent = int(idx / chain_length * 100)
             start = time.time()
-            cl.set_status('Running algorithm: ' + a['name'])
+            cl.set_status('Running algorithm: ' + a['name'], force=True)
 
             try:
                 temp_params = a['parameters']
@@ -519,40 +1449,50 @@ class AlgorithmChain(object):
                 temp_params = {}
 
             try:
-                cl = self.call_algorithm(a['name'], temp_params, idx)
+                try:
+                    cl = self.call_algorithm(a['name'], temp_params, idx)
+                finally:
+                    cl.flush_status()
                 cl.archive_metadata(a['name'], temp_params)
                 if idx != len(algs) - 1:
                     cl.clear_current_metadata()
-            except ValueError as e:
-                if hasattr(e, 'message'):
-                    msg = e.message
-                else:
-                    msg = e.args[0]
-                response = {
-                    'output_type': 'error',
-                    'message': 'Error in parameters',
-                    'error_list': msg
-                }
-                app.logger.error(str(response))
-                return response
-            except AlgorithmException as e:
-                if hasattr(e, 'message'):
-                    msg = e.message
-                else:
-                    msg = e.args[0]
-                response = {
-                    'output_type': 'error',
-                    'message': msg
-                }
-                app.logger.error(str(response))
-                return response
+            except (ValueError, AlgorithmException) as e:
+                return self.get_error_response(e)
 
             end = time.time()
             app.logger.info("alg ran in: " + str(end - start) + " s")
 
+        return self.finish_chain_run()
+
+    def get_error_response(self, e):
+        if hasattr(e, 'message'):
+            msg = e.message
+        else:
+            msg = e.args[0]
+
+        if isinstance(e, AlgorithmException):
+            response = {
+                'output_type': 'error',
+                'message': msg
+            }
+        else:
+            response = {
+                'output_type': 'error',
+                'message': 'Error in parameters',
+                'error_list': msg
+            }
+        app.logger.error(str(response))
+        self.chain_ledger.flush_status()
+        return response
+
+    def finish_chain_run(self, cl=None):
+        if cl is None:
+            cl = self.chain_ledger
         cl.chain_percent = 100
-        cl.set_status('Chain run complete', 100)
+        cl.set_status('Chain run complete', 100, force=True)
+        return self.get_chain_output(cl)
 
+    def get_chain_output(self, cl):
         if 'chain_output_value' in cl.metadata:
             response = cl.metadata['chain_output_value']
         else:
@@ -563,8 +1503,133 @@ class AlgorithmChain(object):
 
         return response
 
-    def call_algorithm(self, algorithm, params, idx):
+    def is_concurrent_algorithm(self, algorithm):
+        json_path = get_json_path(self.atk_path, algorithm)
+        return get_algorithm(json_path, shared=True).get('concurrent', True)
+
+    def get_chain_dependencies(self):
+        # For every algorithm in the request, the set of earlier indices it
+        # must wait for: each earlier run of an algorithm it reads from the
+        # chain ledger, plus the nearest algorithm that opted out of
+        # concurrency with "concurrent": false in its algorithm.json (such
+        # algorithms themselves wait for everything before them).
+        algs = self.algs
+        cd = self.chain_definition
+        dependencies = []
+        barrier = None
+        for idx, a in enumerate(algs):
+            deps = set()
+            this_def = cd[idx] if idx < len(cd) else {}
+            for p_items in this_def.get('parameters', {}).values():
+                if (
+                    p_items.get('source') == 'chain_ledger' and
+                    'source_algorithm' in p_items
+                ):
+                    deps.update(
+                        j for j in range(idx)
+                        if algs[j]['name'] == p_items['source_algorithm']
+                    )
+
+            if not self.is_concurrent_algorithm(a['name']):
+                deps.update(range(idx))
+                barrier = idx
+            elif barrier is not None:
+                deps.add(barrier)
+            dependencies.append(deps)
+        return dependencies
+
+    def run_algorithm_step(self, idx, cl):
+        a = self.algs[idx]
+        start = time.time()
+        cl.set_status('Running algorithm: ' + a['name'], force=True)
+
+        try:
+            temp_params = a['parameters']
+        except KeyError:
+            temp_params = {}
+
+        try:
+            cl = self.call_algorithm(a['name'], temp_params, idx, cl)
+        finally:
+            cl.flush_status()
+
+        end = time.time()
+        app.logger.info("alg ran in: " + str(end - start) + " s")
+        return cl, temp_params
+
+    def call_chain_algorithms_concurrently(self, start_idx=0):
+        # Runs algorithms as soon as the algorithms they depend on have been
+        # archived. Each running algorithm gets its own metadata dict; the
+        # results are archived strictly in request order, so the ledger
+        # history (and every occurrence lookup) matches a sequential run.
         cl = self.chain_ledger
+        algs = self.algs
+        chain_length = len(algs)
+        dependencies = self.get_chain_dependencies()
+
+        cl.set_status('Starting chain run...', 0, force=True)
+        cl.chain_percent = 0
+
+        executor = ThreadPoolExecutor(
+            max_workers=app.config['CHAIN_SCHEDULER_WORKERS'])
+        running = {}
+        finished = {}
+        next_submit = set(range(start_idx, chain_length))
+        archived = start_idx
+
+        try:
+            while archived < chain_length:
+                for idx in sorted(next_submit):
+                    if all(j < archived for j in dependencies[idx]):
+                        next_submit.discard(idx)
+                        running[executor.submit(
+                            self.run_algorithm_step,
+                            idx,
+                            cl.create_view()
+                        )] = idx
+
+                done, not_done = wait(
+                    list(running.keys()), return_when=FIRST_COMPLETED)
+                for future in done:
+                    finished[running.pop(future)] = future
+
+                while archived in finished:
+                    future = finished.pop(archived)
+                    try:
+                        view, temp_params = future.result()
+                    except (ValueError, AlgorithmException) as e:
+                        return self.get_error_response(e)
+
+                    cl.metadata = view.metadata
+                    cl.archive_metadata(algs[archived]['name'], temp_params)
+                    if archived != chain_length - 1:
+                        cl.clear_current_metadata()
+                    archived += 1
+                    cl.chain_percent = int(archived / chain_length * 100)
+        finally:
+            executor.shutdown(wait=True)
+
+        return self.finish_chain_run()
+
+    def call_algorithm(self, algorithm, params, idx, cl=None):
+        if cl is None:
+            cl = self.chain_ledger
+        self.get_chain_params(idx, params, cl)
+        map_param = self.get_map_parameter(idx)
+        if map_param is not None:
+            return self.call_map_algorithm(algorithm, params, map_param, cl)
+
+        m = get_algorithm_module(self.atk_path, algorithm)
+
+        json_path = get_json_path(self.atk_path, algorithm)
+        return_value = m.Main(cl=cl, params=params).set_up(
+            algorithm, json_path)
+
+        return return_value
+
+    def get_chain_params(self, idx, params, cl):
+        # Adds the parameters the chain definition takes from the chain
+        # ledger to params
         cd = self.chain_definition
         try:
             this_def = cd[idx]
@@ -584,27 +1649,98 @@ class AlgorithmChain(object):
             if 'source' in p_items:
                 if p_items['source'] == 'chain_ledger':
                     if 'source_algorithm' in p_items:
-                        temp_output_list = cl.search_history(
-                            p_items['key'], p_items['source_algorithm'])
-
                         if 'occurrence' in p_items:
                             index = text2int(p_items['occurrence'])
                         else:
                             index = -1
-                        params[p] = temp_output_list[index]
+                        params[p] = cl.search_history_occurrence(
+                            p_items['key'], p_items['source_algorithm'], index)
+        return params
 
-        import_str = '.' + algorithm.replace('/', '.') + '.main'
+    def get_map_parameter(self, idx):
+        # The parameter the chain definition maps algorithm idx over, if any
         try:
-            m = importlib.import_module(import_str, package='algorithms')
-        except ImportError:
-            import_str = 'algorithms' + import_str
-            m = importlib.import_module(import_str, package=None)
+            temp_params = self.chain_definition[idx].get('parameters', {})
+        except IndexError:
+            return None
+        for p in temp_params:
+            p_items = temp_params[p]
+            if p_items.get('source') == 'chain_ledger' and p_items.get('map'):
+                return p
+        return None
+
+    def call_map_algorithm(self, algorithm, params, map_param, cl):
+        # Runs the algorithm once for each element of params[map_param] on
+        # a pool of MAP_WORKERS (MAP_EXECUTOR), all in the chain's working
+        # folder. Each metadata key the runs add is collected into a list
+        # in element order, for the next algorithm to reduce.
+        elements = params[map_param]
+        if isinstance(elements, str):
+            elements = [e.strip() for e in elements.split(',') if e.strip()]
+        total = len(elements)
+
+        use_processes = app.config['MAP_EXECUTOR'] == 'process'
+        if use_processes:
+            executor = ProcessPoolExecutor(
+                max_workers=app.config['MAP_WORKERS'],
+                initializer=init_map_worker,
+                initargs=(cl.history,)
+            )
+        else:
+            executor = ThreadPoolExecutor(
+                max_workers=app.config['MAP_WORKERS'])
 
-        json_path = get_json_path(self.atk_path, algorithm)
-        return_value = m.Main(cl=cl, params=params).set_up(
-            algorithm, json_path)
+        futures = []
+        try:
+            for element in elements:
+                element_params = dict(params)
+                element_params[map_param] = element
+                if use_processes:
+                    futures.append(executor.submit(
+                        run_map_element,
+                        self.atk_path,
+                        self.chain_name,
+                        algorithm,
+                        element_params,
+                        cl.status_key,
+                        cl.working_subfolder
+                    ))
+                else:
+                    futures.append(executor.submit(
+                        self.run_map_element,
+                        algorithm,
+                        element_params,
+                        cl.create_view()
+                    ))
+
+            for done, future in enumerate(as_completed(futures)):
+                future.result()
+                cl.set_status(
+                    'Mapped ' + algorithm + ': ' + str(done + 1) + ' of ' +
+                    str(total), int((done + 1) / total * 100)
+                )
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=True)
 
-        return return_value
+        # the outputs in algorithm.json are lists even with no elements
+        results = [future.result() for future in futures]
+        json_path = get_json_path(self.atk_path, algorithm)
+        keys = [o['name'] for o in get_algorithm(
+            json_path, shared=True).get('outputs', [])]
+        for metadata in results:
+            keys.extend(metadata)
+        for key in keys:
+            if key not in cl.metadata:
+                cl.metadata[key] = [r.get(key) for r in results]
+        return cl
+
+    def run_map_element(self, algorithm, params, cl):
+        m = get_algorithm_module(self.atk_path, algorithm)
+        json_path = get_json_path(self.atk_path, algorithm)
+        m.Main(cl=cl, params=params).set_up(algorithm, json_path)
+        return cl.metadata
 
     def get_request_dict(self):
         '''
@@ -619,7 +1755,7 @@ class AlgorithmChain(object):
         for alg in cd:
             a_name = alg['algorithm']
             json_path = get_json_path(self.atk_path, a_name)
-            alg_def = get_algorithm(json_path)
+            alg_def = get_algorithm(json_path, shared=True)
             temp_alg = {}
             temp_alg['algorithm'] = a_name
             temp_params = {}
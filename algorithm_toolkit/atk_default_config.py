@@ -7,4 +7,146 @@ DEFAULT_WORKING_ROOT = '/tmp'
 CHAIN_HISTORY = OrderedDict()
 CHAIN_HISTORY_LENGTH = 0
 
-CHAIN_DATA = OrderedDict()
\ No newline at end of file
+# With RELEASE_LEDGER_VALUES on, a value in the ledger history is replaced
+# with a short summary as soon as the last algorithm that reads it through
+# a chain_ledger parameter has run, rather than being held until the chain
+# ends (and in CHAIN_HISTORY). Algorithms that look keys up in the history
+# themselves list them as "pinned_keys" in algorithm.json; "pinned_keys" on
+# a chain definition entry keeps that algorithm's results.
+RELEASE_LEDGER_VALUES = False
+
+# With CHAIN_CHECKPOINTS on, single chain runs save their ledger history to
+# history/checkpoint_<status_key>.pickle after every algorithm. Runs that
+# fail keep their working folder and checkpoint; a POST to
+# /chain_resume/<status_key>/ continues from the first unfinished algorithm.
+CHAIN_CHECKPOINTS = False
+
+# The last RERUN_HISTORY_LENGTH successful single chain runs are kept (in
+# history/rerun_<status_key>.pickle, with their working folders) so that a
+# request with rerun_from=<status_key> only runs the chain from the first
+# algorithm whose parameters changed, reusing the earlier results.
+RERUN_HISTORY_LENGTH = 0
+
+# Numeric arrays in the ledger history with up to HISTORY_INLINE_ARRAY_SIZE
+# elements are saved as JSON lists; larger arrays (and binary values) are
+# saved to .npy files next to the history file.
+HISTORY_INLINE_ARRAY_SIZE = 1000
+
+CHAIN_DATA = OrderedDict()
+
+# Asynchronous chain runs: requests with run_async=true (or every request,
+# if ASYNC_CHAIN_RUNS is True) return their status_key immediately and run
+# on a 'thread' or 'process' pool. Process pools need STATUS_STORE = 'sqlite'
+# for progress to be visible to the web process.
+ASYNC_CHAIN_RUNS = False
+CHAIN_EXECUTOR = 'thread'
+CHAIN_EXECUTOR_WORKERS = 4
+
+# With JOB_QUEUE = 'sqlite', asynchronous chain runs are not run by the web
+# process but saved to a job queue (JOB_QUEUE_PATH defaults to atk_jobs.db
+# in ATK_PATH) and run by worker processes started with "alg worker -n N".
+# Workers send a heartbeat every few seconds; a job whose worker stops for
+# JOB_QUEUE_TIMEOUT seconds is queued again, for up to JOB_QUEUE_ATTEMPTS
+# runs. Idle workers check the queue every JOB_QUEUE_POLL_INTERVAL seconds.
+# Use STATUS_STORE = 'sqlite' so the progress of runs is visible to the web
+# process.
+JOB_QUEUE = None
+JOB_QUEUE_PATH = None
+JOB_QUEUE_TIMEOUT = 60
+JOB_QUEUE_ATTEMPTS = 3
+JOB_QUEUE_POLL_INTERVAL = 1
+
+# Job status, run state and async results live in a status store: 'memory'
+# (this process only; bounded by STATUS_STORE_MAX_ENTRIES) or 'sqlite'
+# (shared by every worker process; STATUS_STORE_PATH defaults to
+# atk_status.db in ATK_PATH). Entries expire after STATUS_STORE_TTL seconds.
+STATUS_STORE = 'memory'
+STATUS_STORE_PATH = None
+STATUS_STORE_MAX_ENTRIES = 10000
+STATUS_STORE_TTL = 86400
+
+# With SINGLE_FLIGHT_CHAINS on, identical single chain runs (same chain name
+# and algorithm parameters) that are requested while one of them is running
+# are run once. The other requests follow the running one: their status
+# key reports its status, and they get its response. Requests are matched
+# in the status store, so across processes with STATUS_STORE = 'sqlite'.
+# The running request holds a lease of SINGLE_FLIGHT_LEASE seconds that it
+# renews while it runs; if the lease runs out, or the run takes longer than
+# SINGLE_FLIGHT_TIMEOUT seconds, waiting requests run the chain themselves.
+SINGLE_FLIGHT_CHAINS = False
+SINGLE_FLIGHT_LEASE = 30
+SINGLE_FLIGHT_TIMEOUT = 3600
+
+# Only the last STATUS_MESSAGE_LIMIT status messages of a job are kept.
+# chain_run_status returns the messages after a 'since' sequence number;
+# all_msg (the whole log as one string) is only included when requested
+# with all_msg=true or when STATUS_ALL_MSG is True.
+STATUS_MESSAGE_LIMIT = 1000
+STATUS_ALL_MSG = False
+
+# Algorithm status updates are published at most every
+# STATUS_UPDATE_INTERVAL seconds, or when the algorithm percentage moves by
+# STATUS_PERCENT_STEP; the latest update is always published at the end of
+# each algorithm.
+STATUS_UPDATE_INTERVAL = 0.5
+STATUS_PERCENT_STEP = 10
+
+# Batch iterations run one at a time unless BATCH_WORKERS is greater than 1
+# (or a request passes batch_workers, at most BATCH_MAX_WORKERS). Use a
+# 'process' BATCH_EXECUTOR for CPU-bound chains and 'thread' for I/O-bound
+# ones. Worker processes cannot update a 'memory' status store (see
+# STATUS_STORE) in the web process, so with 'process' the progress of
+# iterations is only visible with STATUS_STORE = 'sqlite'. With 'pipeline',
+# each algorithm of the chain runs on its own thread and iterations wait for
+# it in a queue of at most BATCH_PIPELINE_DEPTH, so an I/O-bound algorithm
+# can work on one iteration while the next algorithm works on an earlier
+# one.
+BATCH_WORKERS = 1
+BATCH_MAX_WORKERS = 16
+BATCH_EXECUTOR = 'thread'
+BATCH_PIPELINE_DEPTH = 4
+
+# Batch jobs write their ledger to history/batch_<status_key>.jsonl (one
+# line per iteration) with a manifest in batch_<status_key>.json. With
+# BATCH_INLINE_RESULTS off, the response is the manifest instead of the list
+# of every iteration's response, so memory use does not grow with the batch.
+# Requests with stream=true get each iteration as a line of NDJSON instead,
+# sent as soon as it finishes.
+BATCH_INLINE_RESULTS = True
+
+# Sequential batches of chains with an algorithm that implements run_batch
+# run BATCH_CHUNK_SIZE iterations at a time, one algorithm at a time; those
+# algorithms get the whole chunk's parameters in one call.
+BATCH_CHUNK_SIZE = 256
+
+# 'sequential' runs chain algorithms strictly in order; 'dag' runs
+# algorithms whose chain_ledger inputs are ready concurrently. Algorithms
+# with hidden side effects can opt out with "concurrent": false.
+CHAIN_SCHEDULER = 'sequential'
+CHAIN_SCHEDULER_WORKERS = 4
+
+# An algorithm with a chain_ledger parameter marked "map": true in the chain
+# definition runs once for each element of that ledger value (a list, or a
+# comma-separated string), on MAP_WORKERS threads or, with a 'process'
+# MAP_EXECUTOR, processes. Each worker process is sent a copy of the chain
+# history when it starts, so a long history adds to the start-up cost of a
+# 'process' MAP_EXECUTOR.
+MAP_WORKERS = 4
+MAP_EXECUTOR = 'thread'
+
+# Algorithm modules are imported once per algorithm name. PRELOAD_ALGORITHMS
+# imports every algorithm used by the installed chains at startup;
+# ALGORITHM_RELOAD re-imports an algorithm when its Python files change.
+PRELOAD_ALGORITHMS = False
+ALGORITHM_RELOAD = False
+
+# Algorithms marked "cacheable": true reuse earlier results when their
+# source, version and resolved parameters (including the contents of input
+# files in the working folder) are unchanged. RESULT_CACHE_ENTRIES results
+# are kept in memory and up to RESULT_CACHE_BYTES on disk in
+# RESULT_CACHE_PATH (DEFAULT_WORKING_ROOT/atk_result_cache by default);
+# a RESULT_CACHE_BYTES of 0 keeps results in memory only.
+RESULT_CACHE = True
+RESULT_CACHE_ENTRIES = 128
+RESULT_CACHE_PATH = None
+RESULT_CACHE_BYTES = 1024 * 1024 * 1024
@@ -1,6 +1,7 @@
 import unittest
 
 from . import AlgorithmChain, app
+from .utils.status_utils import get_chain_status
 
 
 class AlgorithmTestCase(unittest.TestCase):
@@ -18,4 +19,5 @@ class AlgorithmTestCase(unittest.TestCase):
         return self.cl.get_from_metadata(key) == value
 
     def check_status(self, status):
-        return app.config['test']['latest_msg'] == status
+        self.cl.flush_status()
+        return get_chain_status('test')['latest_msg'] == status
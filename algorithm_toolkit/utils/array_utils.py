@@ -0,0 +1,35 @@
+import os
+import uuid
+
+import numpy as np
+
+
+def is_array_ref(value):
+    return isinstance(value, dict) and 'array_path' in value
+
+
+def get_array_ref(path, shape, dtype):
+    # Plain, JSON serializable description of an array stored in a .npy
+    # file; this is what goes into the chain ledger
+    return {
+        'array_path': path,
+        'shape': list(shape),
+        'dtype': np.dtype(dtype).str
+    }
+
+
+def create_array_file(folder, name, shape, dtype='float32'):
+    # Allocates a memory-mapped .npy file; returns the writable array and
+    # its reference
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    path = os.path.join(folder, name + '_' + uuid.uuid4().hex[:8] + '.npy')
+    array = np.lib.format.open_memmap(
+        path, mode='w+', dtype=dtype, shape=tuple(shape))
+    return array, get_array_ref(path, array.shape, array.dtype)
+
+
+def open_array_ref(ref, mode='r'):
+    # Maps the array without reading it into memory; any process on the
+    # host can open the same reference
+    return np.load(ref['array_path'], mmap_mode=mode)
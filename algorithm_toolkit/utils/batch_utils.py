@@ -0,0 +1,407 @@
+import csv
+import fnmatch
+import json
+import os
+import queue
+import re
+import threading
+import time
+
+from itertools import islice, product
+
+from .. import app
+from .array_utils import is_array_ref, open_array_ref
+from .data_utils import to_json_value
+from .file_utils import make_dir_if_not_exists
+
+
+def get_history_folder(path):
+    if 'CHAIN_LEDGER_HISTORY_PATH' in app.config:
+        folder = app.config['CHAIN_LEDGER_HISTORY_PATH']
+    else:
+        folder = os.path.join(path, 'history')
+    make_dir_if_not_exists(folder)
+    return folder
+
+
+def get_batch_ledger_paths(path, status_key):
+    # (manifest, JSON Lines ledger) for a batch job
+    folder = get_history_folder(path)
+    name = 'batch_' + status_key
+    return (
+        os.path.join(folder, name + '.json'),
+        os.path.join(folder, name + '.jsonl')
+    )
+
+
+class BatchLedgerWriter(object):
+    '''
+    Writes a batch job's ledger as it runs: one JSON line per iteration,
+    flushed immediately, and a manifest summarizing the job that is
+    rewritten when it finishes. Nothing is held in memory between
+    iterations.
+    '''
+
+    def __init__(self, path, status_key, manifest):
+        self.manifest_path, self.ledger_path = get_batch_ledger_paths(
+            path, status_key)
+        self.manifest = manifest
+        self.manifest['batch_ledger'] = os.path.basename(self.ledger_path)
+        self.manifest['completed'] = 0
+        self.manifest['errors'] = 0
+        self.manifest['state'] = 'running'
+        self.save_manifest()
+        self.ledger_file = open(self.ledger_path, 'w')
+
+    def save_manifest(self):
+        with open(self.manifest_path, 'w') as f:
+            f.write(json.dumps(
+                self.manifest, indent=4, separators=(',', ': ')))
+
+    def write(self, idx, value, response, history):
+        record = {
+            'iteration': idx,
+            'iteration_value': to_json_value(value),
+            'response': to_json_value(response),
+            'history': history
+        }
+        self.ledger_file.write(json.dumps(record) + '\n')
+        self.ledger_file.flush()
+
+        self.manifest['completed'] += 1
+        if response.get('output_type') == 'error':
+            self.manifest['errors'] += 1
+
+    def close(self, state):
+        self.ledger_file.close()
+        self.manifest['state'] = state
+        if state == 'complete':
+            self.manifest['iterations'] = self.manifest['completed']
+        self.save_manifest()
+
+
+def read_batch_ledger(path, status_key, offset=0, limit=100):
+    # Returns the manifest and a page of iteration records, reading only
+    # as far into the ledger as the page ends
+    manifest_path, ledger_path = get_batch_ledger_paths(path, status_key)
+    if not os.path.isfile(manifest_path):
+        return None
+
+    with open(manifest_path, 'r') as f:
+        manifest = json.load(f)
+
+    records = []
+    if os.path.isfile(ledger_path):
+        with open(ledger_path, 'r') as f:
+            for line in islice(f, offset, offset + limit):
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # last line of a job that stopped mid-write
+                    break
+
+    return {
+        'manifest': manifest,
+        'offset': offset,
+        'limit': limit,
+        'records': records
+    }
+
+
+class BatchValues(object):
+    '''
+    The values a batch iterates over, produced lazily: each iteration
+    starts a fresh pass over the source. total is the number of values,
+    or None while it is still being counted.
+    '''
+
+    def __init__(self, make_iter, total=None):
+        self.make_iter = make_iter
+        self.total = total
+        self.stopped = False
+
+    def __iter__(self):
+        return self.make_iter()
+
+    def start_count(self):
+        # count in the background with a pass of its own, so the batch
+        # can start at once
+        if self.total is None:
+            counter = threading.Thread(target=self.count)
+            counter.daemon = True
+            counter.start()
+
+    def count(self):
+        total = 0
+        try:
+            for value in self.make_iter():
+                if self.stopped:
+                    return
+                total += 1
+        except Exception:
+            # a bad value is reported by the run that reaches it
+            return
+        self.total = total
+
+    def stop(self):
+        self.stopped = True
+
+
+class BatchStage(object):
+    '''
+    One algorithm of a pipelined batch: the bounded queue of iterations
+    waiting for it, and how quickly it has been getting through them.
+    '''
+
+    def __init__(self, name, depth):
+        self.name = name
+        self.queue = queue.Queue(depth)
+        self.completed = 0
+        self.busy = 0
+        self.started = time.time()
+
+    def put(self, item, stop):
+        # waits while the queue is full; False if the pipeline was stopped
+        while not stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(self, stop):
+        # the next item, or None once the pipeline was stopped
+        while not stop.is_set():
+            try:
+                return self.queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return None
+
+    def get_stats(self):
+        elapsed = max(time.time() - self.started, 0.001)
+        return {
+            'algorithm': self.name,
+            'completed': self.completed,
+            'queue_depth': self.queue.qsize(),
+            'items_per_second': round(self.completed / elapsed, 2),
+            'busy_percent': min(int(self.busy / elapsed * 100), 100)
+        }
+
+
+_magic_check = re.compile('[*?[]')
+
+
+def iter_files(pattern):
+    # The same matches as glob.glob, but streamed from os.scandir one
+    # directory entry at a time (glob lists whole directories first)
+    parts = pattern.split(os.sep)
+    folder = ''
+    if pattern.startswith(os.sep):
+        folder = os.sep
+        parts = parts[1:]
+    return _iter_matches(folder, parts)
+
+
+def _iter_matches(folder, parts):
+    part, rest = parts[0], parts[1:]
+    if not _magic_check.search(part):
+        path = os.path.join(folder, part)
+        if not rest:
+            if os.path.lexists(path):
+                yield path
+        elif os.path.isdir(path):
+            for match in _iter_matches(path, rest):
+                yield match
+        return
+
+    match_name = re.compile(fnmatch.translate(os.path.normcase(part))).match
+    try:
+        entries = os.scandir(folder or os.curdir)
+    except OSError:
+        return
+    with entries:
+        for entry in entries:
+            name = entry.name
+            # like glob, hidden names only match patterns that start with .
+            if name.startswith('.') and not part.startswith('.'):
+                continue
+            if not match_name(os.path.normcase(name)):
+                continue
+            path = os.path.join(folder, name)
+            if not rest:
+                yield path
+            elif entry.is_dir():
+                for match in _iter_matches(path, rest):
+                    yield match
+
+
+def iter_range(start, stop, step=1):
+    return iter(range(start, stop + 1, step))
+
+
+def iter_linspace(start, stop, num):
+    # like numpy.linspace: num evenly spaced floats, both ends included
+    if num == 1:
+        yield start
+        return
+    step = (stop - start) / (num - 1)
+    for i in range(num - 1):
+        yield start + i * step
+    yield stop
+
+
+def iter_lines(file_path):
+    with open(file_path, 'r') as f:
+        for line in f:
+            line = line.rstrip('\r\n')
+            if line.strip():
+                yield line
+
+
+def iter_csv(file_path, column=None):
+    # rows as dicts keyed by the header, or just the named column
+    with open(file_path, 'r', newline='') as f:
+        reader = csv.DictReader(f)
+        if column is not None and column not in (reader.fieldnames or []):
+            column = None
+        for row in reader:
+            if column is not None:
+                yield row[column]
+            else:
+                yield row
+
+
+def iter_jsonl(file_path):
+    with open(file_path, 'r') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_array(ref):
+    array = open_array_ref(ref)
+    for i in range(array.shape[0]):
+        yield array[i].tolist()
+
+
+def get_ledger_value(path, status_key, algorithm_name, key):
+    # the last value of key saved in a previous chain run's history
+    history_path = os.path.join(
+        get_history_folder(path), status_key + '.json')
+    with open(history_path, 'r') as f:
+        history = json.load(f)['atk_chain_metadata']
+    for metadata in reversed(history):
+        if algorithm_name is not None:
+            if metadata.get('algorithm_name') != algorithm_name:
+                continue
+        if key in metadata:
+            return metadata[key]
+    raise KeyError(key)
+
+
+def get_sweep_values(dims, sweep_mode='product'):
+    '''
+    Combine the values of several iterated parameters, given as
+    (iter_param, BatchValues) pairs, into dicts of iter_param: value. In
+    product mode (every combination, the last parameter varying fastest)
+    each parameter's values are read into a list; zip mode stays lazy and
+    stops with the shortest parameter.
+    '''
+    params = [d[0] for d in dims]
+    if sweep_mode == 'zip':
+        return BatchValues(lambda: (
+            dict(zip(params, combination))
+            for combination in zip(*[d[1] for d in dims])
+        ))
+
+    lists = [list(d[1]) for d in dims]
+    total = 1
+    for values in lists:
+        total *= len(values)
+    return BatchValues(lambda: (
+        dict(zip(params, combination))
+        for combination in product(*lists)
+    ), total=total)
+
+
+def get_batch_values(path, iter_param, iter_type, iter_value):
+    '''
+    Return (BatchValues, error message) for a batch request:
+
+    files: glob pattern, matched lazily with os.scandir
+    range: start,stop[,step] integers, stop included
+    linspace: start,stop,num floats, stop included
+    lines: path to a text file, one value per non-empty line
+    csv: path to a CSV file with a header row; the column named like the
+    iterated parameter if there is one, otherwise each row as a dict
+    jsonl: path to a JSON Lines file, one value per record
+    ledger: status_key[,algorithm_name],key of a list (or saved array)
+    in a previous chain run's history
+    '''
+    param = iter_param.split('__')[-1]
+    iter_value = str(iter_value)
+    values = None
+
+    try:
+        if iter_type == 'files':
+            values = BatchValues(lambda: iter_files(iter_value))
+        elif iter_type == 'range':
+            ranges = [int(x.strip()) for x in iter_value.split(',')]
+            if len(ranges) in (2, 3):
+                r = range(ranges[0], ranges[1] + 1, *ranges[2:])
+                values = BatchValues(
+                    lambda: iter_range(*ranges), total=len(r))
+        elif iter_type == 'linspace':
+            parts = iter_value.split(',')
+            if len(parts) == 3:
+                start, stop = float(parts[0]), float(parts[1])
+                num = int(parts[2])
+                values = BatchValues(
+                    lambda: iter_linspace(start, stop, num),
+                    total=max(num, 0)
+                )
+        elif iter_type in ('lines', 'csv', 'jsonl'):
+            if not os.path.isfile(iter_value):
+                return None, 'Batch file not found'
+            if iter_type == 'lines':
+                values = BatchValues(lambda: iter_lines(iter_value))
+            elif iter_type == 'csv':
+                values = BatchValues(lambda: iter_csv(iter_value, param))
+            else:
+                values = BatchValues(lambda: iter_jsonl(iter_value))
+        elif iter_type == 'ledger':
+            parts = [x.strip() for x in iter_value.split(',')]
+            if len(parts) == 2:
+                parts.insert(1, None)
+            if len(parts) == 3:
+                try:
+                    value = get_ledger_value(path, *parts)
+                except (IOError, OSError, KeyError, ValueError):
+                    return None, 'Batch ledger value not found'
+                if is_array_ref(value):
+                    values = BatchValues(
+                        lambda: iter_array(value), total=value['shape'][0])
+                elif isinstance(value, list):
+                    values = BatchValues(
+                        lambda: iter(value), total=len(value))
+                else:
+                    return None, 'Batch ledger value is not a list'
+    except ValueError:
+        values = None
+
+    if values is None:
+        return None, 'Invalid iterator'
+
+    if values.total == 0:
+        return None, 'Empty batch'
+    if values.total is None:
+        try:
+            first = next(iter(values), None)
+        except ValueError:
+            return None, 'Invalid iterator'
+        if first is None:
+            return None, 'Empty batch'
+
+    return values, ''
@@ -0,0 +1,287 @@
+import copy
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+
+from collections import OrderedDict
+
+from .. import app
+
+
+WORKING_FOLDER_TOKEN = '<atk_working_folder>/'
+
+_source_hashes = {}
+_source_lock = threading.Lock()
+
+
+def hash_file(file_path):
+    file_hash = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def get_source_hash(folder):
+    # hash of an algorithm's Python files and definition, recomputed only
+    # when their mtimes or sizes change
+    signature = []
+    for root, dirs, files in os.walk(folder):
+        for f in files:
+            if f.endswith('.py') or f.endswith('.json'):
+                file_path = os.path.join(root, f)
+                stat = os.stat(file_path)
+                signature.append((file_path, stat.st_mtime, stat.st_size))
+    signature = tuple(sorted(signature))
+
+    with _source_lock:
+        cached = _source_hashes.get(folder)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    source_hash = hashlib.sha256()
+    for file_path, mtime, size in signature:
+        source_hash.update(os.path.relpath(file_path, folder).encode('utf-8'))
+        source_hash.update(hash_file(file_path).encode('utf-8'))
+    source_hash = source_hash.hexdigest()
+    with _source_lock:
+        _source_hashes[folder] = (signature, source_hash)
+    return source_hash
+
+
+def replace_in_strings(value, old, new):
+    if isinstance(value, str):
+        return value.replace(old, new)
+    if isinstance(value, dict):
+        return dict(
+            (k, replace_in_strings(v, old, new)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return type(value)(replace_in_strings(v, old, new) for v in value)
+    return value
+
+
+def find_working_files(value, working_folder):
+    # files in the working folder (given with a trailing separator)
+    # referenced by string values, including comma-separated lists of
+    # paths; returned relative to the folder
+    found = []
+    if isinstance(value, str):
+        if working_folder in value:
+            for token in value.split(','):
+                token = token.strip()
+                if token.startswith(working_folder) and os.path.isfile(token):
+                    found.append(os.path.relpath(token, working_folder))
+    elif isinstance(value, dict):
+        for v in value.values():
+            found.extend(find_working_files(v, working_folder))
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            found.extend(find_working_files(v, working_folder))
+    return found
+
+
+def get_folder_size(folder):
+    size = 0
+    for root, dirs, files in os.walk(folder):
+        for f in files:
+            try:
+                size += os.path.getsize(os.path.join(root, f))
+            except OSError:
+                pass
+    return size
+
+
+class ResultCache(object):
+    '''
+    Two-tier cache of algorithm results: ledger metadata in an in-memory
+    LRU, metadata and produced files in a size-capped folder on disk.
+    Paths inside the working folder are stored relative to it, so a result
+    can be restored into any chain run. The size of the disk tier is kept
+    as a running total; the folder is only walked again once that total
+    goes over max_bytes.
+    '''
+
+    def __init__(self, max_entries=128, cache_path=None, max_bytes=0):
+        self.max_entries = max_entries
+        self.cache_path = cache_path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.disk_bytes = None
+
+    def get_key(self, name, version, source_hash, params, working_folder):
+        working_folder = os.path.join(working_folder, '')
+        input_files = dict(
+            (f, hash_file(os.path.join(working_folder, f)))
+            for f in find_working_files(params, working_folder)
+        )
+        try:
+            key_string = json.dumps({
+                'algorithm': name,
+                'version': version,
+                'source': source_hash,
+                'params': replace_in_strings(
+                    params, working_folder, WORKING_FOLDER_TOKEN),
+                'input_files': input_files
+            }, sort_keys=True)
+        except (TypeError, ValueError):
+            # parameters that cannot be serialized cannot be cached
+            return None
+        return hashlib.sha256(key_string.encode('utf-8')).hexdigest()
+
+    def get_entry_folder(self, key):
+        return os.path.join(self.cache_path, key)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+
+        if entry is None and self.max_bytes:
+            entry_file = os.path.join(self.get_entry_folder(key), 'entry.json')
+            try:
+                with open(entry_file, 'r') as f:
+                    entry = json.load(f)
+            except (IOError, OSError, ValueError):
+                return None
+            self.remember(key, entry)
+
+        if entry is None:
+            return None
+        if entry['files']:
+            entry_folder = self.get_entry_folder(key)
+            for f in entry['files']:
+                if not os.path.isfile(os.path.join(entry_folder, 'files', f)):
+                    return None
+            try:
+                os.utime(entry_folder, None)
+            except OSError:
+                pass
+        return entry
+
+    def remember(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def put(self, key, metadata, working_folder):
+        working_folder = os.path.join(working_folder, '')
+        files = sorted(set(find_working_files(metadata, working_folder)))
+        entry = {
+            'metadata': replace_in_strings(
+                metadata, working_folder, WORKING_FOLDER_TOKEN),
+            'files': files
+        }
+        if self.max_bytes:
+            self.write_entry(key, entry, working_folder)
+        elif files:
+            # produced files can only be kept on disk
+            return
+        self.remember(key, copy.deepcopy(entry))
+
+    def write_entry(self, key, entry, working_folder):
+        make_folder = os.path.join(
+            self.cache_path, 'tmp-' + uuid.uuid4().hex)
+        os.makedirs(os.path.join(make_folder, 'files'))
+        try:
+            for f in entry['files']:
+                dest = os.path.join(make_folder, 'files', f)
+                if not os.path.exists(os.path.dirname(dest)):
+                    os.makedirs(os.path.dirname(dest))
+                shutil.copy2(os.path.join(working_folder, f), dest)
+            try:
+                with open(os.path.join(make_folder, 'entry.json'), 'w') as f:
+                    json.dump(entry, f)
+            except (TypeError, ValueError):
+                # metadata that cannot be serialized stays in memory only
+                os.remove(os.path.join(make_folder, 'entry.json'))
+            os.rename(make_folder, self.get_entry_folder(key))
+        except OSError:
+            # another worker stored the same result first
+            shutil.rmtree(make_folder, ignore_errors=True)
+            return
+
+        size = get_folder_size(self.get_entry_folder(key))
+        with self.lock:
+            if self.disk_bytes is not None:
+                self.disk_bytes += size
+            over = self.disk_bytes is None or self.disk_bytes > self.max_bytes
+        if over:
+            self.evict()
+
+    def evict(self):
+        # Removes the least recently used entries until the disk tier fits
+        # in max_bytes, and recounts the running total: other processes
+        # may have added or removed entries since
+        folders = []
+        total = 0
+        for name in os.listdir(self.cache_path):
+            folder = os.path.join(self.cache_path, name)
+            if name.startswith('tmp-') or not os.path.isdir(folder):
+                continue
+            size = get_folder_size(folder)
+            try:
+                folders.append((os.path.getmtime(folder), folder, size))
+            except OSError:
+                continue
+            total += size
+
+        for mtime, folder, size in sorted(folders):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(folder, ignore_errors=True)
+            total -= size
+        with self.lock:
+            self.disk_bytes = total
+
+    def restore(self, key, cl):
+        # copy a cached result into the ledger; False on a miss
+        entry = self.get(key)
+        if entry is None:
+            return False
+
+        working_folder = os.path.join(cl.get_working_folder(), '')
+        entry_folder = self.get_entry_folder(key)
+        for f in entry['files']:
+            dest = os.path.join(working_folder, f)
+            if not os.path.exists(os.path.dirname(dest)):
+                os.makedirs(os.path.dirname(dest))
+            shutil.copy2(os.path.join(entry_folder, 'files', f), dest)
+
+        metadata = replace_in_strings(
+            copy.deepcopy(entry['metadata']),
+            WORKING_FOLDER_TOKEN, working_folder)
+        cl.metadata.update(metadata)
+        return True
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    global _result_cache
+    with _result_cache_lock:
+        if _result_cache is None:
+            cache_path = app.config['RESULT_CACHE_PATH']
+            if cache_path is None:
+                cache_path = os.path.join(
+                    app.config['DEFAULT_WORKING_ROOT'], 'atk_result_cache')
+            max_bytes = app.config['RESULT_CACHE_BYTES']
+            if max_bytes and not os.path.exists(cache_path):
+                os.makedirs(cache_path)
+            _result_cache = ResultCache(
+                app.config['RESULT_CACHE_ENTRIES'], cache_path, max_bytes)
+    return _result_cache
+
+
+def reset_result_cache():
+    global _result_cache
+    with _result_cache_lock:
+        _result_cache = None
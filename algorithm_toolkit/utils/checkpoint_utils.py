@@ -0,0 +1,88 @@
+import os
+import pickle
+import re
+
+from .batch_utils import get_history_folder
+
+
+_status_key_re = re.compile(r'^[\w-][\w.-]*$')
+
+
+def is_valid_status_key(status_key):
+    # status keys name checkpoint files, so they must be plain ids: no
+    # path separators and no leading dot
+    return bool(_status_key_re.match(status_key or ''))
+
+
+# 'checkpoint' files let failed runs be resumed; 'rerun' files keep
+# completed runs for rerun_from
+def get_checkpoint_path(path, status_key, kind='checkpoint'):
+    if not is_valid_status_key(status_key):
+        raise ValueError('Invalid status key')
+    return os.path.join(
+        get_history_folder(path), kind + '_' + status_key + '.pickle')
+
+
+def save_checkpoint(path, status_key, checkpoint, kind='checkpoint'):
+    # The chain, then each history entry as a pickle of its own, so that
+    # later entries can be appended (see append_checkpoint). Written to a
+    # temporary file first, so a run that dies mid-write leaves the previous
+    # checkpoint in place.
+    checkpoint_path = get_checkpoint_path(path, status_key, kind)
+    temp_path = checkpoint_path + '.tmp'
+    try:
+        with open(temp_path, 'wb') as f:
+            pickle.dump(
+                {'chain': checkpoint['chain']}, f, pickle.HIGHEST_PROTOCOL)
+            for entry in checkpoint['history']:
+                pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        os.remove(temp_path)
+        raise
+    os.replace(temp_path, checkpoint_path)
+
+
+def append_checkpoint(path, status_key, entries, kind='checkpoint'):
+    # Adds history entries to a saved checkpoint; an entry cut short by a
+    # run that dies mid-write is skipped by load_checkpoint
+    checkpoint_path = get_checkpoint_path(path, status_key, kind)
+    with open(checkpoint_path, 'ab') as f:
+        for entry in entries:
+            pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+
+
+def load_checkpoint(path, status_key, kind='checkpoint'):
+    if not is_valid_status_key(status_key):
+        return None
+    try:
+        with open(get_checkpoint_path(path, status_key, kind), 'rb') as f:
+            checkpoint = pickle.load(f)
+            checkpoint['history'] = []
+            while True:
+                try:
+                    checkpoint['history'].append(pickle.load(f))
+                except (EOFError, pickle.UnpicklingError):
+                    break
+    except (IOError, OSError, EOFError, pickle.UnpicklingError):
+        return None
+    return checkpoint
+
+
+def remove_checkpoint(path, status_key, kind='checkpoint'):
+    if not is_valid_status_key(status_key):
+        return
+    checkpoint_path = get_checkpoint_path(path, status_key, kind)
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+
+def list_checkpoints(path, kind='checkpoint'):
+    # status keys with a checkpoint of this kind, oldest first
+    folder = get_history_folder(path)
+    prefix = kind + '_'
+    found = []
+    for name in os.listdir(folder):
+        if name.startswith(prefix) and name.endswith('.pickle'):
+            mtime = os.path.getmtime(os.path.join(folder, name))
+            found.append((mtime, name[len(prefix):-len('.pickle')]))
+    return [status_key for mtime, status_key in sorted(found)]
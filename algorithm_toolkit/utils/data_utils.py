@@ -1,7 +1,12 @@
 import inflect
+import os
 import random
 import json
 
+import numpy as np
+
+from .array_utils import get_array_ref, is_array_ref
+
 p = inflect.engine()
 word_to_number_mapping = {}
 http_chars = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
@@ -16,6 +21,117 @@ def test_json_serialize(val):
         return False
 
 
+NOT_SERIALIZABLE = 'Value not JSON serializable'
+_json_scalar_types = (str, int, float, bool, type(None))
+_json_scalar_set = frozenset(_json_scalar_types)
+
+
+class _Unserializable(Exception):
+    pass
+
+
+class SidecarWriter(object):
+    '''
+    Writes values that JSON cannot hold to numbered .npy files in folder
+    and returns array references to them (see array_utils).
+    '''
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.count = 0
+
+    def write(self, array):
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        path = os.path.join(self.folder, str(self.count) + '.npy')
+        self.count += 1
+        np.save(path, array)
+        return get_array_ref(path, array.shape, array.dtype)
+
+
+def _to_json(value, sidecars, inline_size):
+    value_type = type(value)
+    if value_type in _json_scalar_types:
+        return value
+    if value_type is list or value_type is tuple:
+        if _json_scalar_set.issuperset(map(type, value)):
+            # lists of plain values are shared, not copied
+            return value if value_type is list else list(value)
+        return [_to_json(v, sidecars, inline_size) for v in value]
+    if value_type is dict:
+        return _dict_to_json(value, sidecars, inline_size)
+
+    if isinstance(value, np.ndarray):
+        if value.size <= inline_size and value.dtype.kind in 'biuf':
+            return value.tolist()
+        if sidecars is not None:
+            return sidecars.write(value)
+        raise _Unserializable()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (bytes, bytearray)) and sidecars is not None:
+        return sidecars.write(np.frombuffer(value, dtype=np.uint8))
+    if isinstance(value, dict):
+        return _dict_to_json(value, sidecars, inline_size)
+    if isinstance(value, (list, tuple)):
+        return [_to_json(v, sidecars, inline_size) for v in value]
+    if isinstance(value, (str, int, float)):
+        return value
+    raise _Unserializable()
+
+
+def _dict_to_json(value, sidecars, inline_size):
+    json_dict = {}
+    for k, v in value.items():
+        if type(k) not in _json_scalar_types:
+            raise _Unserializable()
+        json_dict[k] = _to_json(v, sidecars, inline_size)
+    return json_dict
+
+
+def to_json_value(value, sidecars=None, inline_size=1000):
+    '''
+    Return a copy of value that json.dumps can write, in one pass and
+    without serializing it. Numeric arrays of up to inline_size elements
+    become lists; larger arrays and binary values go to sidecars (a
+    SidecarWriter) if given. Anything else that JSON cannot hold makes the
+    whole value NOT_SERIALIZABLE.
+    '''
+    try:
+        return _to_json(value, sidecars, inline_size)
+    except _Unserializable:
+        return NOT_SERIALIZABLE
+
+
+def summarize_value(value, min_length=256):
+    '''
+    Return a small stand-in for a ledger value that will not be read again,
+    or None for values too small to be worth releasing: numbers, strings
+    shorter than min_length, array references and earlier summaries.
+    '''
+    if value is None or isinstance(value, (bool, int, float)):
+        return None
+    if is_array_ref(value) or is_released_value(value):
+        return None
+    try:
+        length = len(value)
+    except TypeError:
+        length = None
+    if isinstance(value, (str, bytes)) and length < min_length:
+        return None
+
+    summary = {'atk_released': type(value).__name__}
+    if length is not None:
+        summary['length'] = length
+    if hasattr(value, 'shape'):
+        summary['shape'] = list(value.shape)
+    return summary
+
+
+def is_released_value(value):
+    return isinstance(value, dict) and 'atk_released' in value
+
+
 def find_in_dict(key, dictionary):
     if key in dictionary:
         return dictionary[key]
@@ -1,6 +1,8 @@
+import copy
 import json
 import os
 import shutil
+import threading
 
 
 def make_dir_if_not_exists(dir_to_create):
@@ -13,62 +15,178 @@ def remove_folder(path):
         shutil.rmtree(path)
 
 
-def list_algorithms(path):
-    installed_algs = []
+def copy_folder(src, dst):
+    # copies the contents of src into dst, which may already exist
+    if os.path.exists(src):
+        shutil.copytree(src, dst, dirs_exist_ok=True)
+
+
+# In-process registry of parsed definition files. Entries are keyed by
+# absolute path and invalidated when a file's mtime or size changes, so
+# steady-state lookups cost a stat() instead of a directory walk and a
+# JSON parse. Objects handed out with shared=True belong to the registry
+# and must be treated as read-only.
+_registry_lock = threading.RLock()
+_definition_registry = {}
+_chain_dir_registry = {}
+_algorithm_dir_registry = {}
+_registry_generation = [0]
+
+
+class DefinitionEntry(object):
+
+    def __init__(self, signature, data):
+        self.signature = signature
+        self.data = data
+        # artifacts derived from data (e.g. compiled validators); they are
+        # discarded along with the entry when the file changes
+        self.derived = {}
+
+
+def _path_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size)
+
+
+def invalidate_definitions():
+    with _registry_lock:
+        _definition_registry.clear()
+        _chain_dir_registry.clear()
+        _algorithm_dir_registry.clear()
+        _registry_generation[0] += 1
+
+
+def get_registry_generation():
+    return _registry_generation[0]
+
+
+def get_definition_entry(path):
+    # Raises IOError/ValueError like open()/json.load() would
+    path = os.path.abspath(path)
+    sig = _path_signature(path)
+    if sig is None:
+        _definition_registry.pop(path, None)
+        raise IOError('No such file: ' + path)
+
+    entry = _definition_registry.get(path)
+    if entry is not None and entry.signature == sig:
+        return entry
+
+    with open(path, 'r') as json_file:
+        data = json.load(json_file)
+
+    entry = DefinitionEntry(sig, data)
+    with _registry_lock:
+        _definition_registry[path] = entry
+    return entry
+
+
+def _algorithm_json_paths(path):
     alg_path = os.path.join(path, 'algorithms')
-    for root, dirs, files in os.walk(alg_path):
-        for algdir in dirs:
-            parent = root[root.rfind(os.sep) + 1:]
-            if parent == 'algorithms':
-                temp_path = get_json_path(path, algdir)
-            else:
-                temp_path = get_json_path(path, parent + os.sep + algdir)
-            temp_alg = get_algorithm(temp_path)
-            if temp_alg != {}:
-                installed_algs.append(temp_alg)
+    root_sig = _path_signature(alg_path)
+    cached = _algorithm_dir_registry.get(alg_path)
+    if cached is not None and cached[0] == root_sig:
+        sub_sigs = [_path_signature(d) for d in cached[1]]
+        if sub_sigs == cached[2]:
+            return cached[3]
+
+    json_paths = []
+    sub_dirs = []
+    if root_sig is not None:
+        for algdir in sorted(os.listdir(alg_path)):
+            temp_dir = os.path.join(alg_path, algdir)
+            if not os.path.isdir(temp_dir):
+                continue
+            sub_dirs.append(temp_dir)
+            json_paths.append(get_json_path(path, algdir))
+            for subdir in sorted(os.listdir(temp_dir)):
+                if os.path.isdir(os.path.join(temp_dir, subdir)):
+                    json_paths.append(
+                        get_json_path(path, algdir + os.sep + subdir))
+
+    with _registry_lock:
+        _algorithm_dir_registry[alg_path] = (
+            root_sig,
+            sub_dirs,
+            [_path_signature(d) for d in sub_dirs],
+            json_paths
+        )
+    return json_paths
+
+
+def list_algorithms(path, shared=False):
+    installed_algs = []
+    for temp_path in _algorithm_json_paths(path):
+        temp_alg = get_algorithm(temp_path, shared=shared)
+        if temp_alg != {}:
+            installed_algs.append(temp_alg)
     return sorted(installed_algs, key=lambda k: k['name'])
 
 
-def get_algorithm(path):
+def get_algorithm(path, shared=False):
     try:
-        with open(path, 'r') as alg_file:
-            try:
-                alg_def = json.load(alg_file)
-            except ValueError:
-                alg_def = {}
-    except IOError:
+        alg_def = get_definition_entry(path).data
+    except (IOError, ValueError):
         alg_def = {}
-    return alg_def
+    if shared:
+        return alg_def
+    return copy.deepcopy(alg_def)
 
 
-def get_chain_def(path, chain_name=None):
-    chain_path = os.path.join(path, 'chains')
-    if not os.path.exists(chain_path):
-        os.makedirs(chain_path)
+def _load_chain_defs(chain_path):
+    dir_sig = _path_signature(chain_path)
+    cached = _chain_dir_registry.get(chain_path)
+    if cached is not None and cached[0] == dir_sig:
+        file_sigs = [_path_signature(f) for f in cached[1]]
+        if file_sigs == cached[2]:
+            return cached[3]
 
     chain_defs = {}
+    chain_files = []
+    for f in sorted(os.listdir(chain_path)):
+        if '.json' in f:
+            temp_key = f.replace('.json', '')
+            chain_file = os.path.join(chain_path, f)
+            try:
+                with open(chain_file) as the_file:
+                    try:
+                        temp_obj = json.load(the_file)
+                        chain_defs[temp_key] = temp_obj[temp_key]
+                    except ValueError:
+                        return {}
+            except IOError:
+                return {}
+            chain_files.append(chain_file)
+
+    with _registry_lock:
+        _chain_dir_registry[chain_path] = (
+            dir_sig,
+            chain_files,
+            [_path_signature(f) for f in chain_files],
+            chain_defs
+        )
+    return chain_defs
 
-    for root, dirs, files in os.walk(chain_path):
-        for f in files:
-            if '.json' in f:
-                temp_key = f.replace('.json', '')
-                try:
-                    with open(os.path.join(chain_path, f)) as the_file:
-                        try:
-                            temp_obj = json.load(the_file)
-                            chain_defs[temp_key] = temp_obj[temp_key]
-                        except ValueError:
-                            return {}
-                except IOError:
-                    return {}
+
+def get_chain_def(path, chain_name=None, shared=False):
+    chain_path = os.path.abspath(os.path.join(path, 'chains'))
+    if not os.path.exists(chain_path):
+        os.makedirs(chain_path)
+
+    chain_defs = _load_chain_defs(chain_path)
 
     if chain_name:
         try:
-            return chain_defs[chain_name]
+            chain_defs = chain_defs[chain_name]
         except KeyError:
             return {}
-    else:
+
+    if shared:
         return chain_defs
+    return copy.deepcopy(chain_defs)
 
 
 def clear_chains(path):
@@ -80,6 +198,7 @@ def clear_chains(path):
                 os.unlink(os.path.join(chain_path, f))
             except IOError:
                 pass
+    invalidate_definitions()
 
 
 def save_chain_files(path, chains):
@@ -90,8 +209,13 @@ def save_chain_files(path, chains):
                 json.dump(temp_json, f, indent=4, separators=(',', ': '))
         except IOError:
             pass
+    invalidate_definitions()
 
 
-def get_json_path(path, a):
+def get_algorithm_folder(path, a):
     a = a.replace('\\', os.sep).replace('/', os.sep)
-    return os.path.join(path, 'algorithms', a, 'algorithm.json')
+    return os.path.join(path, 'algorithms', a)
+
+
+def get_json_path(path, a):
+    return os.path.join(get_algorithm_folder(path, a), 'algorithm.json')
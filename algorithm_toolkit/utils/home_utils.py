@@ -1,19 +1,45 @@
 import requests
 import json
 import os
+import traceback
 
 from flask import (
+    Response,
     make_response,
-    jsonify
+    jsonify,
+    stream_with_context
 )
 from .. import (
     AlgorithmChain,
     app
 )
-from .data_utils import create_random_string
-from .file_utils import (
-    get_chain_def,
-    make_dir_if_not_exists
+from .batch_utils import get_history_folder
+from .checkpoint_utils import (
+    list_checkpoints,
+    load_checkpoint,
+    remove_checkpoint
+)
+from .data_utils import create_random_string, to_json_value
+from .file_utils import get_chain_def
+from .job_utils import (
+    JOB_QUEUED,
+    end_flight,
+    get_flight_key,
+    get_job_result,
+    hold_flight,
+    join_flight,
+    renew_flight,
+    run_job,
+    set_job_result,
+    submit_job,
+    wait_flight
+)
+from .queue_utils import get_job_queue
+from .status_utils import (
+    get_chain_status,
+    get_status_messages,
+    resolve_status_key,
+    set_status_alias
 )
 
 
@@ -25,6 +51,12 @@ def check_chain_request_form(request, chain_name, path):
     iter_param = None
     iter_type = None
     iter_value = None
+    batch_workers = None
+    sweep = None
+    sweep_mode = None
+    stream = False
+    rerun_from = None
+    run_async = app.config['ASYNC_CHAIN_RUNS']
 
     if request.method == 'POST':
         try:
@@ -46,10 +78,21 @@ def check_chain_request_form(request, chain_name, path):
                     iter_value = request.form['iter_value']
                 except KeyError:
                     return make_response('Batch mode misconfigured', 400)
+                batch_workers = request.form.get('batch_workers', None)
+                stream = request.form.get('stream', '').lower() == 'true'
+            elif request.form['run_mode'] == 'sweep':
+                run_mode = 'sweep'
+                sweep = request.form.get('sweep', None)
+                sweep_mode = request.form.get('sweep_mode', 'product')
+                stream = request.form.get('stream', '').lower() == 'true'
             else:
                 run_mode = 'single'
         else:
             run_mode = 'single'
+
+        rerun_from = request.form.get('rerun_from', None)
+        if 'run_async' in request.form:
+            run_async = request.form['run_async'].lower() == 'true'
     elif request.method == 'GET':  # pragma: no branch
         chain = request.args.get('chain', None)
         status_key = request.args.get('status_key', None)
@@ -57,6 +100,19 @@ def check_chain_request_form(request, chain_name, path):
         iter_param = request.args.get('iter_param', None)
         iter_type = request.args.get('iter_type', None)
         iter_value = request.args.get('iter_value', None)
+        batch_workers = request.args.get('batch_workers', None)
+        sweep = request.args.get('sweep', None)
+        sweep_mode = request.args.get('sweep_mode', 'product')
+        stream = request.args.get('stream', '').lower() == 'true'
+        rerun_from = request.args.get('rerun_from', None)
+        if 'run_async' in request.args:
+            run_async = request.args['run_async'].lower() == 'true'
+
+    if stream and run_mode in ['batch', 'sweep']:
+        # a streamed batch runs for as long as the client is connected
+        run_async = False
+    else:
+        stream = False
 
     if status_key is None:
         status_key = create_random_string(http_safe=True)
@@ -64,6 +120,28 @@ def check_chain_request_form(request, chain_name, path):
     if chain is None:
         return make_response('Missing chain parameter in request', 400)
 
+    if batch_workers is not None:
+        try:
+            batch_workers = int(batch_workers)
+        except ValueError:
+            return make_response('Batch mode misconfigured', 400)
+        if batch_workers < 1:
+            return make_response('Batch mode misconfigured', 400)
+        batch_workers = min(batch_workers, app.config['BATCH_MAX_WORKERS'])
+
+    if run_mode == 'sweep':
+        # a list of {iter_param, iter_type, iter_value}, as for batch mode
+        try:
+            sweep = json.loads(sweep)
+        except (TypeError, ValueError):
+            sweep = None
+        if not isinstance(sweep, list) or not sweep or not all(
+            isinstance(d, dict) and
+            all(k in d for k in ['iter_param', 'iter_type', 'iter_value'])
+            for d in sweep
+        ) or sweep_mode not in ['product', 'zip']:
+            return make_response('Sweep mode misconfigured', 400)
+
     if chain.lower() == 'from_global':
         try:
             chain = app.config['CHAIN_DATA'].pop(status_key)
@@ -76,7 +154,7 @@ def check_chain_request_form(request, chain_name, path):
         except ValueError:
             return make_response('Chain parameter not properly formatted', 400)
 
-    if chain_name not in get_chain_def(path):
+    if chain_name not in get_chain_def(path, shared=True):
         return make_response('Chain name does not exist', 400)
 
     if 'algorithms' not in chain:
@@ -88,12 +166,20 @@ def check_chain_request_form(request, chain_name, path):
         'run_mode': run_mode,
         'iter_param': iter_param,
         'iter_type': iter_type,
-        'iter_value': iter_value
+        'iter_value': iter_value,
+        'batch_workers': batch_workers,
+        'sweep': sweep,
+        'sweep_mode': sweep_mode,
+        'stream': stream,
+        'run_async': run_async,
+        'rerun_from': rerun_from or None
     })
 
 
-def process_chain_request(checked_response, path):
-
+def execute_chain_request(checked_response, path):
+    # Runs a checked chain request to completion and returns the response
+    # dict with its HTTP status code. Used directly for synchronous runs and
+    # by the job executor for asynchronous ones.
     chain = checked_response['chain']
     status_key = checked_response['status_key']
     run_mode = checked_response['run_mode']
@@ -103,21 +189,24 @@ def process_chain_request(checked_response, path):
 
     c_obj = AlgorithmChain(path, chain)
     if c_obj.chain_definition == {}:
-        return make_response('Chain name not found', 404)
+        return 'Chain name not found', 404
 
     cl = c_obj.create_ledger(status_key)
+    start_idx = 0
+    if checked_response.get('resume'):
+        # looked up before the working folder is made
+        start_idx = c_obj.resume_checkpoint()
+        if start_idx is None:
+            return 'Checkpoint not found', 404
     cl.make_working_folders()
 
     if run_mode == 'single':
-        response = c_obj.call_chain_algorithms()
-        save_fname = status_key + '.json'
-
-        if 'CHAIN_LEDGER_HISTORY_PATH' in app.config:
-            save_path = os.path.join(
-                app.config['CHAIN_LEDGER_HISTORY_PATH'], save_fname)
-        else:
-            make_dir_if_not_exists(os.path.join(path, 'history'))
-            save_path = os.path.join(path, 'history', save_fname)
+        if checked_response.get('rerun_from'):
+            start_idx = c_obj.rerun_checkpoint(checked_response['rerun_from'])
+        c_obj.start_checkpoints()
+        response = c_obj.call_chain_algorithms(start_idx)
+        save_path = os.path.join(
+            get_history_folder(path), status_key + '.json')
         c_obj.chain_ledger.save_history_to_json(save_path, pretty=True)
 
         if 'CHAIN_HISTORY' in app.config:
@@ -129,12 +218,289 @@ def process_chain_request(checked_response, path):
                     ch.popitem(last=False)
 
                 ch[status_key] = c_obj.chain_ledger
+    elif run_mode == 'sweep':
+        response = c_obj.call_sweep(
+            checked_response['sweep'], checked_response['sweep_mode'])
     else:
-        response = c_obj.call_batch(iter_param, iter_type, iter_value)
+        response = c_obj.call_batch(
+            iter_param,
+            iter_type,
+            iter_value,
+            checked_response['batch_workers']
+        )
+
+    if run_mode == 'single' and response['output_type'] == 'error' and (
+            cl.checkpoint is not None and cl.get_history_size()):
+        # the working folder and checkpoint are kept for /chain_resume/
+        return response, 400
+
+    remove_checkpoint(path, status_key)
+    if run_mode == 'single' and response['output_type'] != 'error' and (
+            app.config['RERUN_HISTORY_LENGTH'] > 0):
+        # the working folder is kept for reruns (see rerun_from)
+        keep_rerun(c_obj, path)
+        return response, 200
 
     cl.remove_working_folders()
 
     if response['output_type'] == 'error':
-        return make_response(jsonify(response), 400)
+        return response, 400
+
+    return response, 200
+
+
+def keep_rerun(c_obj, path):
+    # Saves a finished run for rerun_from, dropping the oldest runs (and
+    # their working folders) past RERUN_HISTORY_LENGTH
+    c_obj.save_checkpoint(c_obj.chain_ledger, 'rerun')
+    kept = list_checkpoints(path, 'rerun')
+    extra = len(kept) - app.config['RERUN_HISTORY_LENGTH']
+    for status_key in kept[:max(extra, 0)]:
+        c_obj.ChainLedger(status_key).remove_working_folders()
+        remove_checkpoint(path, status_key, 'rerun')
+
+
+def check_resume_request(request, status_key, path):
+    # The checked request for resuming the chain run checkpointed under
+    # status_key, as for check_chain_request_form
+    checkpoint = load_checkpoint(path, status_key)
+    if checkpoint is None:
+        return make_response('Checkpoint not found', 404)
+
+    run_async = app.config['ASYNC_CHAIN_RUNS']
+    if 'run_async' in request.values:
+        run_async = request.values['run_async'].lower() == 'true'
+
+    return ({
+        'chain': checkpoint['chain'],
+        'status_key': status_key,
+        'run_mode': 'single',
+        'iter_param': None,
+        'iter_type': None,
+        'iter_value': None,
+        'batch_workers': None,
+        'sweep': None,
+        'sweep_mode': None,
+        'stream': False,
+        'run_async': run_async,
+        'rerun_from': None,
+        'resume': True
+    })
+
+
+def stream_chain_request(checked_response, path):
+    # Runs a batch or sweep while sending it to the client as NDJSON: one
+    # line per iteration, in iteration order, as soon as it finishes, then
+    # a line with the batch ledger manifest
+    iter_param = checked_response['iter_param']
+    iter_type = checked_response['iter_type']
+    iter_value = checked_response['iter_value']
+    sweep = checked_response['sweep']
+    sweep_mode = checked_response['sweep_mode']
+
+    c_obj = AlgorithmChain(path, checked_response['chain'])
+    if c_obj.chain_definition == {}:
+        return make_response('Chain name not found', 404)
+
+    if checked_response['run_mode'] == 'sweep':
+        segments, iter_list, msg = c_obj.get_sweep_list(sweep, sweep_mode)
+    else:
+        iter_list, msg = c_obj.get_batch_list(
+            iter_param, iter_type, iter_value)
+    if msg:
+        return make_response(jsonify({
+            'output_type': 'error',
+            'message': msg
+        }), 400)
+
+    cl = c_obj.create_ledger(checked_response['status_key'])
+    cl.make_working_folders()
+
+    if checked_response['run_mode'] == 'sweep':
+        results = c_obj.iter_sweep_results(
+            sweep, sweep_mode, segments, iter_list)
+    else:
+        results = c_obj.iter_batch_results(
+            iter_param, iter_type, iter_value, iter_list,
+            checked_response['batch_workers'])
+
+    def generate():
+        try:
+            for idx, value, response in results:
+                if response is None:
+                    line = {
+                        'output_type': 'error',
+                        'message': 'Batch job cancelled'
+                    }
+                    yield json.dumps(line) + '\n'
+                    return
+                line = {
+                    'iteration': idx,
+                    'iteration_value': to_json_value(value),
+                    'response': to_json_value(response)
+                }
+                yield json.dumps(line) + '\n'
+
+            line = {
+                'output_type': 'batch_ledger',
+                'output_value': c_obj.batch_manifest
+            }
+            yield json.dumps(line) + '\n'
+        except Exception as e:
+            # the response has already started, so report it in-band
+            app.logger.error(str(traceback.format_exc()))
+            line = {
+                'output_type': 'error',
+                'error_message': str(type(e).__name__) + ':' + str(e.args)
+            }
+            yield json.dumps(line) + '\n'
+        finally:
+            cl.remove_working_folders()
+
+    return Response(
+        stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def process_chain_request(checked_response, path):
+
+    if checked_response['stream']:
+        return stream_chain_request(checked_response, path)
+
+    if app.config['SINGLE_FLIGHT_CHAINS'] and (
+        checked_response['run_mode'] == 'single' and
+        not checked_response.get('resume') and
+        not checked_response.get('rerun_from')
+    ):
+        return process_single_flight(checked_response, path)
+
+    if checked_response['run_async']:
+        submit_chain_request(checked_response, path)
+        return async_response(checked_response['status_key'])
+
+    response, status_code = execute_chain_request(checked_response, path)
+    return chain_response(response, status_code)
+
+
+def process_single_flight(checked_response, path):
+    # The first of several identical requests runs the chain; requests
+    # arriving while it runs follow its status and get its response
+    status_key = checked_response['status_key']
+    flight_key = get_flight_key(checked_response['chain'])
+    set_job_result(status_key, JOB_QUEUED)
+
+    for attempt in range(2):
+        leader_key = join_flight(flight_key, status_key)
+        if leader_key is None:
+            return lead_flight(checked_response, path, flight_key)
+
+        app.logger.info('Chain run ' + status_key + ' follows ' + leader_key)
+        set_status_alias(status_key, leader_key)
+        if checked_response['run_async']:
+            return async_response(status_key)
+
+        result = wait_flight(flight_key, leader_key)
+        if result is not None:
+            return chain_response(result['response'], result['status_code'])
+        # the run in flight stopped without a result, or took too long
+        set_status_alias(status_key, status_key)
+
+    # the chain is run here, outside the flight
+    response, status_code = run_job(
+        status_key, execute_chain_request, checked_response, path)
+    return chain_response(response, status_code)
+
+
+def lead_flight(checked_response, path, flight_key):
+    status_key = checked_response['status_key']
+    if checked_response['run_async']:
+        submit_chain_request(checked_response, path, flight_key)
+        return async_response(status_key)
+
+    stop = hold_flight(flight_key, status_key)
+    try:
+        response, status_code = run_job(
+            status_key, execute_chain_request, checked_response, path)
+    finally:
+        stop.set()
+        end_flight(flight_key)
+    return chain_response(response, status_code)
+
+
+def submit_chain_request(checked_response, path, flight_key=None):
+    # Starts an asynchronous chain run: on the job queue, for the worker
+    # processes, if there is one (see JOB_QUEUE), otherwise on this
+    # process's executor
+    status_key = checked_response['status_key']
+    job_queue = get_job_queue()
+    if job_queue is not None:
+        if flight_key is not None:
+            # nobody renews the lease until a worker claims the job
+            renew_flight(
+                flight_key, status_key, app.config['SINGLE_FLIGHT_TIMEOUT'])
+        job_queue.enqueue(
+            status_key, dict(checked_response, flight_key=flight_key))
+        return
+
+    future = submit_job(
+        status_key, execute_chain_request, checked_response, path)
+    if flight_key is not None:
+        stop = hold_flight(flight_key, status_key)
+
+        def flight_done(f):
+            stop.set()
+            end_flight(flight_key)
+        future.add_done_callback(flight_done)
+
+
+def async_response(status_key):
+    return make_response(jsonify({
+        'output_type': 'async',
+        'status_key': status_key
+    }), 202)
+
+
+def chain_response(response, status_code):
+    if not isinstance(response, dict):
+        return make_response(response, status_code)
+
+    if status_code != 200:
+        return make_response(jsonify(response), status_code)
 
     return jsonify(response)
+
+
+def chain_status_response(status_key, since=None, all_msg=False):
+    status_key = resolve_status_key(status_key)
+    chain_status = get_chain_status(status_key)
+    if chain_status is None:
+        return make_response('Invalid status key', 404)
+
+    chain_status = dict(chain_status)
+    if since is not None:
+        chain_status['messages'] = [
+            {'seq': seq, 'msg': msg}
+            for seq, msg in get_status_messages(status_key, since)
+        ]
+    if all_msg:
+        chain_status['all_msg'] = '  \n'.join(
+            msg for seq, msg in get_status_messages(status_key))
+
+    return jsonify(chain_status)
+
+
+def chain_result_response(status_key):
+    result = get_job_result(resolve_status_key(status_key))
+    if result is None:
+        return make_response('Invalid status key', 404)
+
+    if result['state'] == JOB_QUEUED:
+        return make_response(jsonify({
+            'output_type': 'async',
+            'status_key': status_key,
+            'state': result['state']
+        }), 202)
+
+    response = result['response']
+    if not isinstance(response, dict):
+        return make_response(response, result['status_code'])
+    return make_response(jsonify(response), result['status_code'])
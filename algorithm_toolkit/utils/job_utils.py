@@ -0,0 +1,192 @@
+import hashlib
+import json
+import threading
+import time
+import traceback
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from .. import app
+from .queue_utils import get_job_queue
+from .status_utils import get_status_store
+
+
+JOB_QUEUED = 'queued'
+JOB_COMPLETE = 'complete'
+JOB_ERROR = 'error'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    # One pool per process, created on first use from the app config:
+    # CHAIN_EXECUTOR is 'thread' or 'process'
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = app.config['CHAIN_EXECUTOR_WORKERS']
+            if app.config['CHAIN_EXECUTOR'] == 'process':
+                _executor = ProcessPoolExecutor(max_workers=workers)
+            else:
+                _executor = ThreadPoolExecutor(max_workers=workers)
+    return _executor
+
+
+def shutdown_executor(wait=True):
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait)
+            _executor = None
+
+
+def set_job_result(status_key, state, response=None, status_code=None):
+    get_status_store().set(status_key + '_result', {
+        'state': state,
+        'response': response,
+        'status_code': status_code
+    })
+
+
+def get_job_result(status_key):
+    if get_job_queue() is not None:
+        # jobs run by worker processes (see JOB_QUEUE)
+        result = get_job_queue().get_result(status_key)
+        if result is not None:
+            return result
+    return get_status_store().get(status_key + '_result')
+
+
+def call_job(fn, *args):
+    # (state, response, status_code) of a job function
+    try:
+        response, status_code = fn(*args)
+    except Exception as e:
+        app.logger.error(str(traceback.format_exc()))
+        response = {
+            'output_type': 'error',
+            'message': str(type(e).__name__) + ':' + str(e.args)
+        }
+        return JOB_ERROR, response, 500
+    return JOB_COMPLETE, response, status_code
+
+
+def _record_job(status_key, fn, *args):
+    state, response, status_code = call_job(fn, *args)
+    set_job_result(status_key, state, response, status_code)
+    return response, status_code
+
+
+def _job_done(status_key, future):
+    _record_job(status_key, future.result)
+
+
+def submit_job(status_key, fn, *args):
+    # fn must be a module-level function returning (response, status_code)
+    # so it can also be shipped to a process pool
+    set_job_result(status_key, JOB_QUEUED)
+    future = get_executor().submit(fn, *args)
+    future.add_done_callback(lambda f: _job_done(status_key, f))
+    return future
+
+
+def run_job(status_key, fn, *args):
+    # runs fn in this thread, recording its result as submit_job does
+    set_job_result(status_key, JOB_QUEUED)
+    return _record_job(status_key, fn, *args)
+
+
+def get_flight_key(chain):
+    # the same for requests of a chain with the same algorithm parameters
+    algorithms = json.dumps(
+        chain['algorithms'], sort_keys=True, separators=(',', ':'),
+        default=str
+    )
+    flight_hash = hashlib.sha256(
+        (str(chain.get('chain_name')) + '\n' + algorithms).encode('utf-8'))
+    return 'atk_flight_' + flight_hash.hexdigest()
+
+
+def _flight_lease(status_key, lease=None):
+    if lease is None:
+        lease = app.config['SINGLE_FLIGHT_LEASE']
+    return {'leader': status_key, 'expires': time.time() + lease}
+
+
+def _live_leader(flight):
+    # the status key leading the flight, unless its lease ran out
+    if flight is None or flight['expires'] < time.time():
+        return None
+    return flight['leader']
+
+
+def join_flight(flight_key, status_key):
+    # None if status_key now leads the flight, otherwise the status key of
+    # the run in flight
+    store = get_status_store()
+    while True:
+        if store.add(flight_key, _flight_lease(status_key)):
+            return None
+        flight = store.get(flight_key)
+        leader_key = _live_leader(flight)
+        if leader_key is not None:
+            return leader_key
+        if flight is not None:
+            # the leader stopped renewing its lease: the flight is free
+            app.logger.warning('Flight lease expired: ' + flight['leader'])
+            store.delete(flight_key)
+
+
+def renew_flight(flight_key, status_key, lease=None):
+    # extends the lease of the flight status_key leads; False if it no
+    # longer leads it
+    store = get_status_store()
+    flight = store.get(flight_key)
+    if flight is None or flight['leader'] != status_key:
+        return False
+    store.set(flight_key, _flight_lease(status_key, lease))
+    return True
+
+
+def _renew_flight_lease(flight_key, status_key, stop):
+    interval = max(app.config['SINGLE_FLIGHT_LEASE'] / 3.0, 0.1)
+    while not stop.wait(interval):
+        if not renew_flight(flight_key, status_key):
+            return
+
+
+def hold_flight(flight_key, status_key):
+    # Renews the lease of the flight status_key leads until the returned
+    # event is set
+    stop = threading.Event()
+    t = threading.Thread(
+        target=_renew_flight_lease, args=(flight_key, status_key, stop))
+    t.daemon = True
+    t.start()
+    return stop
+
+
+def end_flight(flight_key):
+    get_status_store().delete(flight_key)
+
+
+def wait_flight(flight_key, leader_key, interval=0.1, timeout=None):
+    # The result of the run in flight, or None if it ended without one or
+    # did not finish within timeout (SINGLE_FLIGHT_TIMEOUT) seconds
+    if timeout is None:
+        timeout = app.config['SINGLE_FLIGHT_TIMEOUT']
+    give_up = time.time() + timeout
+    while True:
+        result = get_job_result(leader_key)
+        if result is not None and result['state'] != JOB_QUEUED:
+            return result
+        flight = get_status_store().get(flight_key)
+        if _live_leader(flight) != leader_key:
+            result = get_job_result(leader_key)
+            if result is not None and result['state'] != JOB_QUEUED:
+                return result
+            return None
+        if time.time() >= give_up:
+            return None
+        time.sleep(interval)
@@ -0,0 +1,114 @@
+import importlib
+import os
+import sys
+import threading
+
+from .. import app
+from .file_utils import (
+    get_algorithm_folder,
+    get_chain_def,
+    get_definition_entry,
+    get_json_path
+)
+from .validation_utils import get_entry_validator
+
+
+_module_lock = threading.Lock()
+_module_cache = {}
+
+
+def _module_signature(folder):
+    # (path, mtime, size) of every Python file in the algorithm's folder
+    signature = []
+    for root, dirs, files in os.walk(folder):
+        for f in files:
+            if f.endswith('.py'):
+                file_path = os.path.join(root, f)
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+                signature.append((file_path, stat.st_mtime, stat.st_size))
+    return tuple(sorted(signature))
+
+
+def _import_algorithm(algorithm):
+    import_str = '.' + algorithm.replace('/', '.') + '.main'
+    try:
+        return importlib.import_module(import_str, package='algorithms')
+    except ImportError:
+        import_str = 'algorithms' + import_str
+        return importlib.import_module(import_str, package=None)
+
+
+def _unload_modules(folder):
+    # drop the algorithm's modules (main and any helpers in its folder) so
+    # the next import reads them from disk; runs already holding the old
+    # module objects are unaffected
+    folder = os.path.abspath(folder) + os.sep
+    for name, module in list(sys.modules.items()):
+        module_file = getattr(module, '__file__', None)
+        if module_file and os.path.abspath(module_file).startswith(folder):
+            del sys.modules[name]
+    importlib.invalidate_caches()
+
+
+def get_algorithm_module(path, algorithm):
+    '''
+    Return the imported main module of an algorithm. Modules are resolved
+    once per algorithm name; with ALGORITHM_RELOAD set, an algorithm is
+    re-imported when any of its Python files change.
+    '''
+    reload_modules = app.config['ALGORITHM_RELOAD']
+    cached = _module_cache.get(algorithm)
+    if cached is not None and not reload_modules:
+        return cached[1]
+
+    folder = get_algorithm_folder(path, algorithm)
+    signature = _module_signature(folder) if reload_modules else None
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    with _module_lock:
+        cached = _module_cache.get(algorithm)
+        if cached is not None:
+            if cached[0] == signature:
+                return cached[1]
+            if cached[0] is None:
+                # imported before ALGORITHM_RELOAD was set
+                _module_cache[algorithm] = (signature, cached[1])
+                return cached[1]
+            app.logger.info('Reloading algorithm: ' + algorithm)
+            _unload_modules(folder)
+        module = _import_algorithm(algorithm)
+        _module_cache[algorithm] = (signature, module)
+    return module
+
+
+def clear_module_cache():
+    with _module_lock:
+        _module_cache.clear()
+
+
+def preload_algorithms(path):
+    '''
+    Import every algorithm used by the installed chains and compile its
+    definition, so the first request does not pay for it.
+    '''
+    loaded = []
+    for chain in get_chain_def(path, shared=True).values():
+        for alg in chain:
+            algorithm = alg.get('algorithm')
+            if algorithm is None or algorithm in loaded:
+                continue
+            loaded.append(algorithm)
+            try:
+                get_algorithm_module(path, algorithm)
+                entry = get_definition_entry(get_json_path(path, algorithm))
+                get_entry_validator(entry)
+            except Exception as e:
+                app.logger.warning(
+                    'Could not preload algorithm ' + algorithm + ': ' +
+                    str(type(e).__name__) + ':' + str(e.args)
+                )
+    return loaded
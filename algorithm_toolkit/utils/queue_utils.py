@@ -0,0 +1,178 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from .. import app
+
+
+JOB_RUNNING = 'running'
+
+
+class SQLiteJobQueue(object):
+    '''
+    Chain requests waiting for, or taken by, worker processes (see "alg
+    worker"), kept in an SQLite database in WAL mode so that queued jobs
+    outlive the web process. Jobs are claimed atomically: each one runs in
+    a single worker at a time. Requests and results must be JSON
+    serializable.
+    '''
+
+    def __init__(self, path, timeout=60, attempts=3):
+        self.path = path
+        self.timeout = timeout
+        self.attempts = attempts
+        self.local = threading.local()
+        self.get_connection().execute(
+            'CREATE TABLE IF NOT EXISTS atk_jobs ('
+            'status_key TEXT PRIMARY KEY, request TEXT, state TEXT, '
+            'attempts INTEGER, worker TEXT, response TEXT, '
+            'status_code INTEGER, created REAL, heartbeat REAL)'
+        )
+
+    def get_connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    def enqueue(self, status_key, request):
+        self.get_connection().execute(
+            'INSERT OR REPLACE INTO atk_jobs (status_key, request, state, '
+            'attempts, created) VALUES (?, ?, ?, 0, ?)',
+            (status_key, json.dumps(request, default=str), 'queued',
+             time.time())
+        )
+
+    def claim(self, worker):
+        # (status_key, request, attempts) of the oldest queued job, now
+        # running in worker; None if no job is waiting
+        conn = self.get_connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT status_key, request, attempts FROM atk_jobs '
+                'WHERE state = ? ORDER BY created LIMIT 1', ('queued',)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    'UPDATE atk_jobs SET state = ?, attempts = ?, '
+                    'worker = ?, heartbeat = ? WHERE status_key = ?',
+                    (JOB_RUNNING, row[2] + 1, worker, time.time(), row[0])
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if row is None:
+            return None
+        return row[0], json.loads(row[1]), row[2] + 1
+
+    def beat(self, status_key, worker):
+        # the worker running the job is still alive
+        self.get_connection().execute(
+            'UPDATE atk_jobs SET heartbeat = ? '
+            'WHERE status_key = ? AND worker = ? AND state = ?',
+            (time.time(), status_key, worker, JOB_RUNNING)
+        )
+
+    def finish(self, status_key, worker, state, response, status_code):
+        self.get_connection().execute(
+            'UPDATE atk_jobs SET state = ?, response = ?, status_code = ? '
+            'WHERE status_key = ? AND worker = ?',
+            (state, json.dumps(response, default=str), status_code,
+             status_key, worker)
+        )
+
+    def requeue_lost(self):
+        # Jobs whose worker stopped sending heartbeats are queued again, or
+        # given up on after the last attempt; returns their status keys
+        from .job_utils import end_flight  # job_utils imports this module
+
+        lost_before = time.time() - self.timeout
+        flight_keys = []
+        conn = self.get_connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute(
+                'SELECT status_key, attempts, request FROM atk_jobs '
+                'WHERE state = ? AND heartbeat < ?',
+                (JOB_RUNNING, lost_before)
+            ).fetchall()
+            for status_key, attempts, request in rows:
+                if attempts < self.attempts:
+                    conn.execute(
+                        'UPDATE atk_jobs SET state = ?, worker = NULL '
+                        'WHERE status_key = ?', ('queued', status_key)
+                    )
+                else:
+                    conn.execute(
+                        'UPDATE atk_jobs SET state = ?, response = ?, '
+                        'status_code = 500 WHERE status_key = ?',
+                        ('error', json.dumps({
+                            'output_type': 'error',
+                            'message': 'Job lost after ' + str(attempts) +
+                            ' attempts'
+                        }), status_key)
+                    )
+                    flight_keys.append(json.loads(request).get('flight_key'))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        # identical requests following a job given up on run on their own
+        for flight_key in flight_keys:
+            if flight_key:
+                end_flight(flight_key)
+        return [row[0] for row in rows]
+
+    def get_result(self, status_key):
+        # the job's result, as for job_utils.get_job_result
+        row = self.get_connection().execute(
+            'SELECT state, response, status_code FROM atk_jobs '
+            'WHERE status_key = ?', (status_key,)
+        ).fetchone()
+        if row is None:
+            return None
+        state, response, status_code = row
+        if state == JOB_RUNNING:
+            state = 'queued'
+        if response is not None:
+            response = json.loads(response)
+        return {
+            'state': state,
+            'response': response,
+            'status_code': status_code
+        }
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    # None unless JOB_QUEUE is set
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None and app.config['JOB_QUEUE'] == 'sqlite':
+            path = app.config['JOB_QUEUE_PATH']
+            if path is None:
+                path = os.path.join(app.config['ATK_PATH'], 'atk_jobs.db')
+            _job_queue = SQLiteJobQueue(
+                path,
+                timeout=app.config['JOB_QUEUE_TIMEOUT'],
+                attempts=app.config['JOB_QUEUE_ATTEMPTS']
+            )
+    return _job_queue
+
+
+def reset_job_queue():
+    global _job_queue
+    with _job_queue_lock:
+        _job_queue = None
@@ -0,0 +1,312 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from collections import OrderedDict, deque
+from itertools import islice
+
+from .. import app
+
+
+class StatusStore(object):
+    '''
+    Key/value store for job status dicts, run states (cancel flags) and
+    results of asynchronous runs. Values must be JSON serializable.
+    '''
+
+    def get(self, key, default=None):  # pragma: no cover
+        # the value stored for key, or default
+        pass
+
+    def set(self, key, value):  # pragma: no cover
+        pass
+
+    def add(self, key, value):  # pragma: no cover
+        # set key only if it is not present; True if the value was stored
+        pass
+
+    def delete(self, key):  # pragma: no cover
+        pass
+
+    def append(self, key, item, limit):  # pragma: no cover
+        # add item to a log holding the last limit items; returns its
+        # sequence number (1, 2, 3...)
+        pass
+
+    def get_items(self, key, since=0):  # pragma: no cover
+        # [(seq, item), ...] for logged items with seq greater than since
+        pass
+
+
+class MemoryStatusStore(StatusStore):
+    '''
+    Thread-safe, in-process store. Entries expire ttl seconds after their
+    last write and the least recently written entries are evicted beyond
+    max_entries. Only visible to the process that owns it.
+    '''
+
+    def __init__(self, max_entries=10000, ttl=86400):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def _expired(self, written, now):
+        return self.ttl and now - written > self.ttl
+
+    def _evict(self, now):
+        while self.entries:
+            key, (written, value) = next(iter(self.entries.items()))
+            if len(self.entries) > self.max_entries > 0 or self._expired(
+                    written, now):
+                del self.entries[key]
+            else:
+                break
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self.lock:
+            try:
+                written, value = self.entries[key]
+            except KeyError:
+                return default
+            if self._expired(written, now):
+                del self.entries[key]
+                return default
+            return value
+
+    def set(self, key, value):
+        now = time.time()
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (now, value)
+            self._evict(now)
+
+    def add(self, key, value):
+        now = time.time()
+        with self.lock:
+            if key in self.entries:
+                written, old_value = self.entries[key]
+                if not self._expired(written, now):
+                    return False
+                del self.entries[key]
+            self.entries[key] = (now, value)
+            self._evict(now)
+            return True
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def append(self, key, item, limit):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None or self._expired(entry[0], now):
+                seq, items = 0, deque(maxlen=limit or None)
+            else:
+                seq, items = entry[1]
+            seq += 1
+            items.append((seq, item))
+            self.entries[key] = (now, (seq, items))
+            self._evict(now)
+            return seq
+
+    def get_items(self, key, since=0):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or self._expired(entry[0], now):
+                return []
+            seq, items = entry[1]
+            # sequence numbers in the log are consecutive
+            start = max(0, len(items) - (seq - since))
+            return list(islice(items, start, None))
+
+
+class SQLiteStatusStore(StatusStore):
+    '''
+    Store shared by every process on a host, backed by an SQLite database
+    in WAL mode. Each thread and process opens its own connection.
+    '''
+
+    def __init__(self, path, ttl=86400):
+        self.path = path
+        self.ttl = ttl
+        self.local = threading.local()
+        self.last_purge = 0
+        conn = self.get_connection()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS atk_status ('
+            'key TEXT PRIMARY KEY, value TEXT, written REAL)'
+        )
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS atk_status_log ('
+            'key TEXT, seq INTEGER, item TEXT, written REAL, '
+            'PRIMARY KEY (key, seq))'
+        )
+
+    def get_connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    def purge(self, now):
+        if self.ttl and now - self.last_purge > 60:
+            self.last_purge = now
+            conn = self.get_connection()
+            conn.execute(
+                'DELETE FROM atk_status WHERE written < ?', (now - self.ttl,))
+            conn.execute(
+                'DELETE FROM atk_status_log WHERE written < ?',
+                (now - self.ttl,)
+            )
+
+    def get(self, key, default=None):
+        row = self.get_connection().execute(
+            'SELECT value, written FROM atk_status WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return default
+        if self.ttl and time.time() - row[1] > self.ttl:
+            return default
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        now = time.time()
+        self.get_connection().execute(
+            'INSERT OR REPLACE INTO atk_status (key, value, written) '
+            'VALUES (?, ?, ?)',
+            (key, json.dumps(value, default=str), now)
+        )
+        self.purge(now)
+
+    def add(self, key, value):
+        now = time.time()
+        conn = self.get_connection()
+        if self.ttl:
+            conn.execute(
+                'DELETE FROM atk_status WHERE key = ? AND written < ?',
+                (key, now - self.ttl)
+            )
+        cursor = conn.execute(
+            'INSERT OR IGNORE INTO atk_status (key, value, written) '
+            'VALUES (?, ?, ?)',
+            (key, json.dumps(value, default=str), now)
+        )
+        return cursor.rowcount == 1
+
+    def delete(self, key):
+        conn = self.get_connection()
+        conn.execute('DELETE FROM atk_status WHERE key = ?', (key,))
+        conn.execute('DELETE FROM atk_status_log WHERE key = ?', (key,))
+
+    def append(self, key, item, limit):
+        now = time.time()
+        conn = self.get_connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT MAX(seq) FROM atk_status_log WHERE key = ?', (key,)
+            ).fetchone()
+            seq = (row[0] or 0) + 1
+            conn.execute(
+                'INSERT INTO atk_status_log (key, seq, item, written) '
+                'VALUES (?, ?, ?, ?)',
+                (key, seq, json.dumps(item, default=str), now)
+            )
+            if limit:
+                conn.execute(
+                    'DELETE FROM atk_status_log WHERE key = ? AND seq <= ?',
+                    (key, seq - limit)
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        self.purge(now)
+        return seq
+
+    def get_items(self, key, since=0):
+        rows = self.get_connection().execute(
+            'SELECT seq, item FROM atk_status_log WHERE key = ? AND seq > ? '
+            'ORDER BY seq', (key, since)
+        ).fetchall()
+        return [(seq, json.loads(item)) for seq, item in rows]
+
+
+_status_store = None
+_status_store_lock = threading.Lock()
+
+
+def get_status_store():
+    global _status_store
+    with _status_store_lock:
+        if _status_store is None:
+            _status_store = create_status_store()
+    return _status_store
+
+
+def create_status_store():
+    if app.config['STATUS_STORE'] == 'sqlite':
+        path = app.config['STATUS_STORE_PATH']
+        if path is None:
+            path = os.path.join(app.config['ATK_PATH'], 'atk_status.db')
+        return SQLiteStatusStore(path, ttl=app.config['STATUS_STORE_TTL'])
+    return MemoryStatusStore(
+        max_entries=app.config['STATUS_STORE_MAX_ENTRIES'],
+        ttl=app.config['STATUS_STORE_TTL']
+    )
+
+
+def reset_status_store():
+    global _status_store
+    with _status_store_lock:
+        _status_store = None
+
+
+def get_chain_status(status_key):
+    return get_status_store().get(status_key)
+
+
+def set_chain_status(status_key, chain_status):
+    get_status_store().set(status_key, chain_status)
+
+
+def get_run_state(status_key):
+    # 0 = cancel
+    # 1 = running
+    return get_status_store().get(status_key + '_run_state', 1)
+
+
+def set_run_state(status_key, run_state):
+    get_status_store().set(status_key + '_run_state', run_state)
+
+
+def add_status_message(status_key, message):
+    return get_status_store().append(
+        status_key + '_messages', message,
+        app.config['STATUS_MESSAGE_LIMIT']
+    )
+
+
+def get_status_messages(status_key, since=0):
+    return get_status_store().get_items(status_key + '_messages', since)
+
+
+def set_status_alias(status_key, leader_key):
+    get_status_store().set(status_key + '_alias', leader_key)
+
+
+def resolve_status_key(status_key):
+    # the key the status and result of a request following another run
+    # (see SINGLE_FLIGHT_CHAINS) are kept under
+    return get_status_store().get(status_key + '_alias', status_key)
@@ -0,0 +1,261 @@
+import json
+import re
+import threading
+
+from collections import OrderedDict
+
+import numpy as np
+
+from .array_utils import is_array_ref
+
+
+VALIDATOR_CACHE_SIZE = 256
+
+_validator_cache = OrderedDict()
+_validator_lock = threading.Lock()
+
+
+class ParameterValidator(object):
+    '''
+    Validation plan for a single parameter definition.
+
+    Everything that only depends on the definition (lowercased custom
+    validation, cross-parameter comparisons, compiled regular expressions,
+    choice sets) is worked out once here; check() only looks at the value.
+    '''
+
+    def __init__(self, p, required):
+        self.name = p['name']
+        self.required = required
+        self.p_type = p['data_type'].lower()
+        self.is_numeric = self.p_type in ('integer', 'float')
+
+        self.min_value = p.get('min_value', None) or None
+        self.max_value = p.get('max_value', None) or None
+
+        p_cv = p.get('custom_validation', None)
+        self.compare = None
+        self.compare_param = None
+        self.parity = None
+        self.regex = None
+        self.regex_src = None
+        self.regex_error = None
+        if p_cv:
+            lower_cv = p_cv.lower().replace(' ', '')
+            if lower_cv[:11] == 'greaterthan' or lower_cv[:8] == 'lessthan':
+                self.compare = lower_cv.split('.')[0]
+                # resolved lazily so a malformed rule fails like it used to
+                self.compare_param = lower_cv.split('.')[1:2]
+            if self.p_type == 'integer':
+                if lower_cv == 'evenonly':
+                    self.parity = 0
+                elif lower_cv == 'oddonly':
+                    self.parity = 1
+            if p_cv[0] == '^':
+                self.regex_src = p_cv
+                try:
+                    self.regex = re.compile(p_cv)
+                except re.error as e:
+                    # only reported once the value is actually checked
+                    self.regex_error = e
+
+        self.choices = p.get('parameter_choices', None)
+        self.choice_set = None
+        if self.choices and isinstance(self.choices, (list, tuple)):
+            try:
+                self.choice_set = frozenset(self.choices)
+            except TypeError:
+                self.choice_set = None
+
+        if self.p_type == 'integer':
+            self.coerce = int
+        elif self.p_type == 'float':
+            self.coerce = float
+        else:
+            self.coerce = None
+
+    def check_type(self, algorithm, params, is_valid):
+        name = self.name
+        p_type = self.p_type
+        value = params[name]
+
+        if p_type == 'string' and type(value) != str:
+            try:
+                str(value)
+            except ValueError:  # pragma: no cover
+                algorithm.add_error_message(name, 'Not a valid string')
+                is_valid = False
+        elif self.coerce is not None and type(value) != self.coerce:
+            try:
+                params[name] = self.coerce(value)
+            except ValueError:
+                if not self.required and value == '':
+                    pass
+                else:
+                    algorithm.add_error_message(
+                        name, 'Not a valid ' + p_type)
+                    is_valid = False
+        elif p_type == 'array' and type(value) != list and not isinstance(
+                value, np.ndarray) and not is_array_ref(value):
+            try:
+                if value[0] == '[':
+                    value[1:-1].split(",")
+                else:
+                    value.split(",")
+            except (ValueError, TypeError):
+                algorithm.add_error_message(name, 'Not a valid array')
+                is_valid = False
+
+        return is_valid
+
+    def check_numeric(self, algorithm, params, is_valid):
+        name = self.name
+        value = params[name]
+
+        if self.min_value is not None and value < self.min_value:
+            algorithm.add_error_message(name, 'Value too small')
+            is_valid = False
+        if self.max_value is not None and value > self.max_value:
+            algorithm.add_error_message(name, 'Value too large')
+            is_valid = False
+
+        if self.compare is not None:
+            p_param = self.coerce(params[self.compare_param[0]])
+            if not algorithm.custom_check(value, p_param, self.compare):
+                if self.compare == 'greaterthan':
+                    msg = 'Value must be greater than '
+                else:
+                    msg = 'Value must be less than '
+                algorithm.add_error_message(name, msg + str(p_param))
+                is_valid = False
+
+        if self.parity is not None and value % 2 != self.parity:
+            if self.parity == 0:
+                algorithm.add_error_message(
+                    name, 'Value must be an even number')
+            else:
+                algorithm.add_error_message(
+                    name, 'Value must be an odd number')
+            is_valid = False
+
+        return is_valid
+
+    def check_choices(self, value):
+        if self.choice_set is not None:
+            try:
+                return value in self.choice_set
+            except TypeError:
+                pass
+        return value in self.choices
+
+    def check(self, algorithm, params, is_valid):
+        name = self.name
+
+        """
+        Data type validation
+        """
+        if self.required and name not in params:
+            algorithm.add_error_message(name, 'Parameter missing')
+            is_valid = False
+
+        if self.p_type in ('string', 'integer', 'float', 'array'):
+            is_valid = self.check_type(algorithm, params, is_valid)
+
+        """
+        Parameter value validation: numeric parameters
+        """
+        if is_valid and self.is_numeric:
+            is_valid = self.check_numeric(algorithm, params, is_valid)
+
+        """
+        Parameter value validation: value in list
+        """
+        if is_valid and self.choices:
+            if not self.check_choices(params[name]):
+                algorithm.add_error_message(
+                    name,
+                    'Value not in list of valid choices: ' + str(
+                        self.choices
+                    )
+                )
+                is_valid = False
+
+        """
+        Parameter value validation: Regular Expression
+        """
+        if is_valid and self.regex_src is not None:
+            if self.regex_error is not None:
+                raise self.regex_error
+            if not self.regex.match(params[name]):
+                algorithm.add_error_message(
+                    name,
+                    'Value does not match expression: "' +
+                    self.regex_src + '"'
+                )
+                is_valid = False
+
+        return is_valid
+
+
+class InvalidParameterValidator(object):
+    '''
+    Stands in for a parameter definition that could not be compiled, so
+    the error surfaces when the parameter is checked (as it always has).
+    '''
+
+    def __init__(self, p, required, error):
+        self.name = p['name']
+        self.required = required
+        self.error = error
+
+    def check(self, algorithm, params, is_valid):
+        raise self.error
+
+
+def compile_parameter(p, required):
+    try:
+        return ParameterValidator(p, required)
+    except Exception as e:
+        return InvalidParameterValidator(p, required, e)
+
+
+class DefinitionValidator(object):
+
+    def __init__(self, definition):
+        self.required = [
+            compile_parameter(rp, True)
+            for rp in definition['required_parameters']
+        ]
+        self.optional = [
+            compile_parameter(op, False)
+            for op in definition['optional_parameters']
+        ]
+
+
+def compile_validator(definition):
+    try:
+        cache_key = json.dumps(definition, sort_keys=True)
+    except (TypeError, ValueError):
+        return DefinitionValidator(definition)
+
+    with _validator_lock:
+        validator = _validator_cache.get(cache_key)
+        if validator is not None:
+            _validator_cache.move_to_end(cache_key)
+            return validator
+
+    validator = DefinitionValidator(definition)
+    with _validator_lock:
+        _validator_cache[cache_key] = validator
+        while len(_validator_cache) > VALIDATOR_CACHE_SIZE:
+            _validator_cache.popitem(last=False)
+    return validator
+
+
+def get_entry_validator(entry):
+    # validators compiled from a registry entry live as long as the entry
+    validator = entry.derived.get('validator')
+    if validator is None:
+        validator = DefinitionValidator(entry.data)
+        entry.derived['validator'] = validator
+    return validator
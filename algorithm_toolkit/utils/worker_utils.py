@@ -0,0 +1,91 @@
+import multiprocessing
+import os
+import socket
+import threading
+import time
+
+from .. import app
+from .checkpoint_utils import load_checkpoint
+from .home_utils import execute_chain_request
+from .job_utils import call_job, end_flight, hold_flight, set_job_result
+from .queue_utils import get_job_queue
+
+
+def send_heartbeats(job_queue, worker, status_key, stop):
+    interval = max(app.config['JOB_QUEUE_TIMEOUT'] / 4.0, 0.1)
+    while not stop.wait(interval):
+        job_queue.beat(status_key, worker)
+
+
+def run_queued_job(job_queue, worker, job, path):
+    status_key, checked_response, attempts = job
+    if attempts > 1 and checked_response['run_mode'] == 'single' and (
+            load_checkpoint(path, status_key) is not None):
+        # a run lost with its worker continues from its checkpoint
+        checked_response['resume'] = True
+
+    stop = threading.Event()
+    heartbeats = threading.Thread(
+        target=send_heartbeats, args=(job_queue, worker, status_key, stop))
+    heartbeats.daemon = True
+    heartbeats.start()
+    flight_key = checked_response.get('flight_key')
+    if flight_key:
+        lease = hold_flight(flight_key, status_key)
+    try:
+        try:
+            state, response, status_code = call_job(
+                execute_chain_request, checked_response, path)
+        finally:
+            stop.set()
+            if flight_key:
+                lease.set()
+        job_queue.finish(status_key, worker, state, response, status_code)
+        set_job_result(status_key, state, response, status_code)
+    except Exception:
+        # identical requests following this job must not wait for it
+        if flight_key:
+            end_flight(flight_key)
+        raise
+    if flight_key:
+        end_flight(flight_key)
+
+
+def run_worker(path, stop=None):
+    '''
+    Run chain requests from the job queue (see JOB_QUEUE), one at a time,
+    until stop is set or the worker is interrupted.
+    '''
+    job_queue = get_job_queue()
+    worker = socket.gethostname() + ':' + str(os.getpid())
+    app.logger.info('Worker started: ' + worker)
+    try:
+        while stop is None or not stop.is_set():
+            for status_key in job_queue.requeue_lost():
+                app.logger.warning('Job lost by its worker: ' + status_key)
+            job = job_queue.claim(worker)
+            if job is None:
+                time.sleep(app.config['JOB_QUEUE_POLL_INTERVAL'])
+                continue
+            app.logger.info('Running job: ' + job[0])
+            run_queued_job(job_queue, worker, job, path)
+    except KeyboardInterrupt:
+        # a job that was running is queued again once its heartbeats stop
+        pass
+    app.logger.info('Worker stopped: ' + worker)
+
+
+def start_workers(path, workers):
+    # Runs worker processes until they are interrupted
+    processes = [
+        multiprocessing.Process(target=run_worker, args=(path,))
+        for i in range(workers)
+    ]
+    for p in processes:
+        p.start()
+    try:
+        for p in processes:
+            p.join()
+    except KeyboardInterrupt:
+        for p in processes:
+            p.join()
@@ -42,7 +42,10 @@ from ..utils.file_utils import (
 )
 from ..utils.data_utils import create_random_string
 from ..utils.home_utils import (
+    chain_result_response,
+    chain_status_response,
     check_chain_request_form,
+    check_resume_request,
     process_chain_request
 )
 from cli.cli import do_uninstall
@@ -119,7 +122,7 @@ def index():
 
     return render_template(
         'index.html',
-        chains=get_chain_def(path),
+        chains=get_chain_def(path, shared=True),
         docs=get_docs_link(),
         ad1=ad1,
         ad2=ad2,
@@ -174,31 +177,52 @@ def main():
     return response
 
 
+@home.route('/chain_resume/<status_key>/', methods=['POST'])
+@cross_origin(origins=cors_origins)
+@check_api_key(request, api_key)
+def chain_resume(status_key):
+    check = check_resume_request(request, status_key, path)
+    if not isinstance(check, dict):
+        return check
+    return process_chain_request(check, path)
+
+
 @home.route('/chain_run_status/<status_key>/', methods=['POST'])
 @cross_origin(origins=cors_origins)
 @check_api_key(request, api_key)
 def chain_run_status(status_key):
-    chain_status = {}
-    try:
-        chain_status = app.config[status_key]
-    except KeyError:
-        return make_response('Invalid status key', 404)
+    since = request.values.get('since')
+    if since is not None:
+        try:
+            since = int(since)
+        except ValueError:
+            return make_response('Invalid since value', 400)
+    all_msg = app.config['STATUS_ALL_MSG']
+    if 'all_msg' in request.values:
+        all_msg = request.values['all_msg'] == 'true'
+
+    return chain_status_response(status_key, since, all_msg)
 
-    return jsonify(chain_status)
+
+@home.route('/chain_result/<status_key>/', methods=['POST'])
+@cross_origin(origins=cors_origins)
+@check_api_key(request, api_key)
+def chain_result(status_key):
+    return chain_result_response(status_key)
 
 
 @home.route('/list_chains/', methods=['GET'])
 @cross_origin(origins=cors_origins)
 @check_api_key(request, api_key)
 def list():
-    return jsonify(get_chain_def(path))
+    return jsonify(get_chain_def(path, shared=True))
 
 
 @home.route('/chain_info/<chain>/', methods=['GET'])
 @cross_origin(origins=cors_origins)
 @check_api_key(request, api_key)
 def chain_info(chain):
-    return jsonify(get_chain_def(path, chain))
+    return jsonify(get_chain_def(path, chain, shared=True))
 
 
 def set_param_source(alg, param):
@@ -219,7 +243,7 @@ def set_param_source(alg, param):
 @cross_origin(origins=cors_origins)
 @check_api_key(request, api_key)
 def chain_algorithms(chain):
-    chain_obj = get_chain_def(path, chain)
+    chain_obj = get_chain_def(path, chain, shared=True)
     alg_list = []
     for alg in chain_obj:
         a_path = get_json_path(path, alg['algorithm'])
@@ -250,7 +274,7 @@ def chain_algorithms(chain):
 @check_api_key(request, api_key)
 def algorithm_info(algorithm=None):
     a_path = get_json_path(path, algorithm)
-    return jsonify(get_algorithm(a_path))
+    return jsonify(get_algorithm(a_path, shared=True))
 
 
 @home.route('/algorithms/', methods=['GET'])
@@ -258,8 +282,8 @@ def algorithm_info(algorithm=None):
 def algorithms():
     return render_template(
         'algorithms.html',
-        algs=list_algorithms(path),
-        chains=get_chain_def(path),
+        algs=list_algorithms(path, shared=True),
+        chains=get_chain_def(path, shared=True),
         docs=get_docs_link(),
         nav='algorithms'
     )
@@ -291,7 +315,7 @@ def create_algorithm(algorithm=None):
     else:
         form = AlgorithmCreateForm()
 
-    algs = [x['name'] for x in list_algorithms(path)]
+    algs = [x['name'] for x in list_algorithms(path, shared=True)]
     if algorithm is not None:
         algs.remove(algorithm)
     form.name.validators = [validators.NoneOf(
@@ -507,7 +531,7 @@ def create_algorithm(algorithm=None):
         o_form=o_form,
         docs=get_docs_link(),
         algs=algs,
-        chains=get_chain_def(path),
+        chains=get_chain_def(path, shared=True),
         nav='algorithms'
     )
 
@@ -598,7 +622,7 @@ def chain_builder():
                 temp_path = get_json_path(path, algdir)
             else:
                 temp_path = get_json_path(path, parent + os.sep + algdir)
-            temp_alg = get_algorithm(temp_path)
+            temp_alg = get_algorithm(temp_path, shared=True)
             all_algs.append(temp_alg)
             if temp_alg != {}:  # pragma: no branch
                 temp_name = temp_alg['name']
@@ -690,7 +714,7 @@ def chain_builder():
                 block_list.append(this_block)
                 block_scripts.append(this_script)
 
-    chain_obj = get_chain_def(path)
+    chain_obj = get_chain_def(path, shared=True)
 
     return render_template(
         'chain_builder.html',
@@ -716,7 +740,9 @@ def add_parameter_blocks(params, chain_alg):
             try:
                 temp_param = chain_alg['parameters'][p['name']]
             except KeyError:
-                temp_param['source'] = 'user'
+                # parameters missing from the chain definition are entered
+                # by the user; the (shared) definition itself is not changed
+                temp_param = {'source': 'user'}
 
             if temp_param['source'] == 'user':
                 temp_block += u_block.replace(
@@ -737,11 +763,11 @@ def add_parameter_blocks(params, chain_alg):
 @home.route('/chain_builder/get_blocks/<chain>/', methods=['GET'])
 @debug_only(app.config)
 def get_blocks(chain):
-    chain_obj = get_chain_def(path)
+    chain_obj = get_chain_def(path, shared=True)
     alg_count = 0
     for chain_alg in chain_obj[chain]:
         temp_path = get_json_path(path, chain_alg['algorithm'])
-        temp_alg = get_algorithm(temp_path)
+        temp_alg = get_algorithm(temp_path, shared=True)
         if alg_count == 0:
             temp_block = '<xml xmlns="http://www.w3.org/1999/xhtml" id="'
             temp_block += 'workspaceBlocks" style="display:none">\n'
@@ -819,7 +845,7 @@ def test_run(chain_name):
     chain = {}
     alg_choices = []
 
-    chain_definition = get_chain_def(path, chain_name)
+    chain_definition = get_chain_def(path, chain_name, shared=True)
 
     for a in chain_definition:
         a_name = a['algorithm']
@@ -879,7 +905,7 @@ def test_run(chain_name):
         fetching_results=fetching_results,
         chain=chain,
         chain_name=chain_name,
-        chains=get_chain_def(path),
+        chains=get_chain_def(path, shared=True),
         docs=get_docs_link(),
         nav='test_run'
     )
@@ -1,11 +1,13 @@
 import os
 
-from flask import jsonify, request
+from flask import jsonify, make_response, request
 from flask_cors import cross_origin
 
 from . import manage
 from .. import app, check_management_api_key, debug_only
+from ..utils.batch_utils import get_history_folder, read_batch_ledger
 from ..utils.manage_utils import vital_stats
+from ..utils.status_utils import set_run_state
 
 management_api_key = app.config['ATK_MANAGEMENT_API_KEY']
 api_key = app.config['API_KEY']
@@ -56,7 +58,22 @@ def get_ledger(status_key):
         if run_mode == 'batch':
             filename = 'batch_' + filename
 
-    ledger_path = os.path.join(app.config['ATK_PATH'], 'history', filename)
+            if 'offset' in request.args or 'limit' in request.args:
+                try:
+                    offset = int(request.args.get('offset', 0))
+                    limit = int(request.args.get('limit', 100))
+                except ValueError:
+                    return make_response('Invalid offset or limit', 400)
+                if offset < 0 or limit < 0:
+                    return make_response('Invalid offset or limit', 400)
+                ledger = read_batch_ledger(
+                    app.config['ATK_PATH'], status_key, offset, limit)
+                if ledger is None:
+                    return jsonify('Ledger not found')
+                return jsonify(ledger)
+
+    ledger_path = os.path.join(
+        get_history_folder(app.config['ATK_PATH']), filename)
 
     if os.path.isfile(ledger_path):
         with open(ledger_path, 'r') as ledger_file:
@@ -70,7 +87,7 @@ def get_ledger(status_key):
 @cross_origin(origins=cors_origins)
 @check_management_api_key(request, api_key, management_api_key)
 def cancel_job(status_key):
-    app.config[status_key + '_run_state'] = 0
+    set_run_state(status_key, 0)
     return 'Job cancellation submitted'
 
 
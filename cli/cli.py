@@ -6,6 +6,7 @@ import random
 import requests
 import shutil
 import subprocess
+import sys
 import unittest
 
 import jinja2
@@ -738,6 +739,40 @@ def run(args):
     subprocess.call(['flask', 'run'] + list(args))
 
 
+@cli.command('worker', context_settings=CONTEXT_SETTINGS)
+@click.option(
+    '--workers', '-n', help='Number of worker processes', default=1,
+    type=click.IntRange(min=1)
+)
+def worker_cmd(workers):
+    '''
+    Run chain requests from the job queue.
+    '''
+    from flask.cli import load_dotenv
+
+    os.environ['FLASK_APP'] = 'run'
+    os.environ['ATK_CONFIG'] = os.path.join(os.getcwd(), 'config.py')
+
+    path = os.path.dirname(os.environ['ATK_CONFIG'])
+    if not os.path.exists(os.path.join(path, '.env')):
+        generate_settings(this_path, path)
+    load_dotenv(os.path.join(path, '.env'))
+
+    if not os.path.exists(os.path.join(path, 'logs')):
+        os.mkdir(os.path.join(path, 'logs'))
+
+    # algorithms are imported from the project folder
+    sys.path.insert(0, path)
+    from algorithm_toolkit import app
+    from algorithm_toolkit.utils.worker_utils import start_workers
+
+    if app.config['JOB_QUEUE'] is None:
+        return click.echo('No job queue: set JOB_QUEUE in config.py')
+
+    click.echo('Starting ' + str(workers) + ' worker(s)...')
+    start_workers(app.config['ATK_PATH'], workers)
+
+
 @cli.command('shell', context_settings=dict(ignore_unknown_options=True))
 @click.argument('args', nargs=-1, type=click.UNPROCESSED, required=False)
 def shell(args):
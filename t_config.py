@@ -6,10 +6,12 @@ from logging import Formatter, StreamHandler
 ATK_PATH = os.path.join(os.path.dirname(
     os.path.abspath(__file__)), 'test_project')
 API_KEY = 'testkey'
+ATK_MANAGEMENT_API_KEY = 'testmanagementkey'
 PRESERVE_CONTEXT_ON_EXCEPTION = False
 TESTING = True
 SECRET_KEY = 'testsecret'
 WTF_CSRF_ENABLED = False
+STATUS_UPDATE_INTERVAL = 0
 
 dirname = os.path.dirname
 handler = StreamHandler()
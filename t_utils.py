@@ -631,3 +631,143 @@ def get_chain_builder_chain_blocks_math():
         '</xml>\n'
     )
     return chain_blocks
+
+
+def get_batch_algorithms():
+    # algorithm.json and main.py of the algorithms of the squares test
+    # chain: square has a run_batch hook that records its chunks, plus_one
+    # only runs one iteration at a time and fails while its fail flag is
+    # set. Both record the values they were run with.
+    def make_param(name, data_type, min_value=None):
+        return {
+            "name": name,
+            "description": name,
+            "display_name": name,
+            "data_type": data_type,
+            "field_type": "number",
+            "help_text": "",
+            "min_value": min_value,
+            "max_value": None,
+            "default_value": None,
+            "custom_validation": None,
+            "parameter_choices": [],
+            "sort_order": 0
+        }
+
+    def make_alg(name, required, optional, output):
+        return {
+            "name": name,
+            "display_name": name,
+            "description": name,
+            "version": "0.0.1",
+            "license": "MIT",
+            "private": False,
+            "homepage": "",
+            "required_parameters": required,
+            "optional_parameters": optional,
+            "outputs": [{
+                "name": output,
+                "description": output,
+                "data_type": "integer"
+            }]
+        }
+
+    square = (
+        'import os\n'
+        'import time\n'
+        '\n'
+        'from algorithm_toolkit import Algorithm\n'
+        '\n'
+        'batch_calls = []\n'
+        'runs = []\n'
+        '\n'
+        '\n'
+        'class Main(Algorithm):\n'
+        '\n'
+        '    def run(self):\n'
+        '        cl = self.cl\n'
+        '        runs.append(self.params["x"])\n'
+        '        time.sleep(self.params.get("delay", 0))\n'
+        '        cl.add_to_metadata("y", self.params["x"] ** 2)\n'
+        '        y_path = os.path.join(cl.get_temp_folder(), "y.txt")\n'
+        '        with open(y_path, "w") as f:\n'
+        '            f.write(str(self.params["x"] ** 2))\n'
+        '        cl.add_to_metadata("y_path", y_path)\n'
+        '        cl.add_to_metadata("tiles", [self.params["x"]] * 300)\n'
+        '        return cl\n'
+        '\n'
+        '    def run_batch(self, params_list):\n'
+        '        xs = [params["x"] for params in params_list]\n'
+        '        batch_calls.append(xs)\n'
+        '        if 13 in xs:\n'
+        '            self.raise_client_error("Unlucky number")\n'
+        '        if 66 in xs:\n'
+        '            raise RuntimeError("Ni!")\n'
+        '        if 99 in xs:\n'
+        '            return [{"y": 0}]\n'
+        '        return [{"y": x ** 2} for x in xs]\n'
+    )
+    plus_one = (
+        'from algorithm_toolkit import Algorithm\n'
+        '\n'
+        'runs = []\n'
+        'fail = False\n'
+        '\n'
+        '\n'
+        'class Main(Algorithm):\n'
+        '\n'
+        '    def run(self):\n'
+        '        cl = self.cl\n'
+        '        runs.append(self.params["y"])\n'
+        '        if fail:\n'
+        '            self.raise_client_error("Bridge out")\n'
+        '        z = self.params["y"] + 1\n'
+        '        cl.add_to_metadata("z", z)\n'
+        '        cl.add_to_metadata("chain_output_value", {\n'
+        '            "output_type": "integer", "output_value": z})\n'
+        '        return cl\n'
+    )
+    return {
+        'square': (make_alg(
+            'square',
+            [make_param('x', 'integer', 1)],
+            [make_param('delay', 'float')],
+            'y'
+        ), square),
+        'plus_one': (make_alg(
+            'plus_one', [make_param('y', 'integer')], [], 'z'), plus_one)
+    }
+
+
+def get_batch_chain():
+    chain_def = {
+        "squares": [
+            {
+                "algorithm": "square",
+                "parameter_source": "user"
+            }, {
+                "algorithm": "plus_one",
+                "parameters": {
+                    "y": {
+                        "source": "chain_ledger",
+                        "source_algorithm": "square",
+                        "key": "y",
+                        "occurrence": "first"
+                    }
+                }
+            }
+        ]
+    }
+    chain = {
+        "algorithms": [
+            {
+                "name": "square",
+                "parameters": {}
+            }, {
+                "name": "plus_one",
+                "parameters": {}
+            }
+        ],
+        "chain_name": "squares"
+    }
+    return chain_def, chain
@@ -1,3 +1,4 @@
+import copy
 import json
 import os
 
@@ -17,6 +18,8 @@ from wtforms.validators import InputRequired, Optional
 
 from t_utils import (
     get_algorithms,
+    get_batch_algorithms,
+    get_batch_chain,
     get_chains,
     get_updated_chain,
     get_chain_algs,
@@ -871,6 +874,36 @@ class ATKTestCase(TestCase):
         self.assert200(response)
         self.assertTrue(new_block in temp_blocks)
 
+    def test_chain_builder_get_blocks_registry(self):
+        from algorithm_toolkit import get_chain_def
+        print('Chain builder blocks should not change the chain registry')
+        json_file = os.path.join(
+            test_alg_path, 'algorithms', 'stitch_tiles', 'algorithm.json')
+        with open(json_file, 'r') as alg_file:
+            original = alg_file.read()
+        try:
+            # a parameter the chain definition does not mention
+            stitch_tiles = json.loads(original)
+            stitch_tiles['required_parameters'].append({
+                'name': 'useless',
+                'display_name': 'Useless Parameter',
+                'data_type': 'string',
+                'field_type': 'text',
+                'sort_order': 2
+            })
+            with open(json_file, 'w') as alg_file:
+                alg_file.write(json.dumps(stitch_tiles))
+
+            before = copy.deepcopy(get_chain_def(test_alg_path, shared=True))
+            response = self.client.get(
+                '/chain_builder/get_blocks/map_tiles/')
+            self.assert200(response)
+            self.assertEqual(
+                get_chain_def(test_alg_path, shared=True), before)
+        finally:
+            with open(json_file, 'w') as alg_file:
+                alg_file.write(original)
+
     def test_update_chains_error(self):
         print(
             'If update_chains is called without a chains '
@@ -1272,7 +1305,8 @@ class ATKTestCase(TestCase):
             'batch_percent_complete': 0,
             'chain_percent_complete': 100,
             'latest_msg': 'Chain run complete',
-            'algorithm_percent_complete': 100
+            'algorithm_percent_complete': 100,
+            'last_seq': 13
         }
         data = {
             'api_key': 'testkey',
@@ -1284,11 +1318,29 @@ class ATKTestCase(TestCase):
             print(response.data)
         self.assert200(response)
         response = self.client.post(
-            '/chain_run_status/throatwarblermangrove/?api_key=testkey')
+            '/chain_run_status/throatwarblermangrove/'
+            '?api_key=testkey&all_msg=true')
         resp_json = json.loads(response.data)
         self.assert200(response)
         self.assertEqual(resp_json, retval)
 
+        # all_msg is opt-in
+        response = self.client.post(
+            '/chain_run_status/throatwarblermangrove/?api_key=testkey')
+        resp_json = json.loads(response.data)
+        self.assertFalse('all_msg' in resp_json)
+        self.assertEqual(resp_json['last_seq'], 13)
+
+        # only messages after the since cursor are returned
+        response = self.client.post(
+            '/chain_run_status/throatwarblermangrove/?api_key=testkey'
+            '&since=11')
+        resp_json = json.loads(response.data)
+        self.assertEqual(resp_json['messages'], [
+            {'seq': 12, 'msg': 'Running algorithm: output_image_to_client'},
+            {'seq': 13, 'msg': 'Chain run complete'}
+        ])
+
     def test_get_status_errors(self):
         print(
             'Calling the chain_run_status endpoint '
@@ -1319,6 +1371,181 @@ class ATKTestCase(TestCase):
         self.assert404(response)
         self.assertEqual(response.data, 'Invalid status key')
 
+        # bad since cursor
+        response = self.client.post(
+            '/chain_run_status/johangambolputty/',
+            data={'api_key': 'testkey', 'since': 'spam'})
+        self.assert400(response)
+        self.assertEqual(response.data, 'Invalid since value')
+
+    def test_main_run_async(self):
+        print(
+            'Asynchronous chain runs should return the status key at once '
+            'and make the final response available later'
+        )
+        import time
+        test_run_chain = get_test_run_chain()
+        test_run_chain['algorithms'][0]['parameters']['zoom'] = 10
+        data = {
+            'api_key': 'testkey',
+            'chain': json.dumps(test_run_chain),
+            'status_key': 'arthurtwoshedsjackson',
+            'run_async': 'true'
+        }
+        response = self.client.post('/chains/map_tiles/', data=data)
+        self.assertStatus(response, 202)
+        resp_json = json.loads(response.data)
+        self.assertEqual(resp_json['status_key'], 'arthurtwoshedsjackson')
+
+        for x in range(600):
+            response = self.client.post(
+                '/chain_result/arthurtwoshedsjackson/',
+                data={'api_key': 'testkey'}
+            )
+            if response.status_code != 202:
+                break
+            time.sleep(0.1)
+        self.assert200(response)
+        resp_json = json.loads(response.data)
+        self.assertEqual(resp_json['output_type'], 'geo_raster')
+
+        # unknown status key
+        response = self.client.post(
+            '/chain_result/ofulm/', data={'api_key': 'testkey'})
+        self.assert404(response)
+
+    def test_main_run_batch_parallel(self):
+        print(
+            'Parallel batch runs should return results in iteration order '
+            'and save the batch ledger'
+        )
+        test_run_chain = get_test_run_chain()
+        data = {
+            'api_key': 'testkey',
+            'chain': json.dumps(test_run_chain),
+            'status_key': 'bicyclerepairman',
+            'run_mode': 'batch',
+            'iter_param': 'getmaptiles_roi__zoom',
+            'iter_type': 'range',
+            'iter_value': '9,11',
+            'batch_workers': 3
+        }
+        response = self.client.post('/chains/map_tiles/', data=data)
+        self.assert200(response)
+        resp_json = json.loads(response.data)
+        self.assertEqual(resp_json['output_type'], 'batch_result')
+        self.assertEqual(len(resp_json['output_value']), 3)
+
+        ledger_path = os.path.join(
+            test_alg_path, 'history', 'batch_bicyclerepairman.jsonl')
+        with open(ledger_path, 'r') as ledger_file:
+            ledger = [json.loads(line) for line in ledger_file]
+        for idx, zoom in enumerate([9, 10, 11]):
+            self.assertEqual(ledger[idx]['iteration'], idx)
+            first_alg = ledger[idx]['history']['atk_chain_metadata'][0]
+            self.assertEqual(first_alg['algorithm_params']['zoom'], zoom)
+
+        # every iteration cleans up its own working folder
+        self.assertFalse(os.path.exists('/tmp/bicyclerepairman/batch_0'))
+
+        data['batch_workers'] = 'many'
+        response = self.client.post('/chains/map_tiles/', data=data)
+        self.assert400(response)
+
+    def test_main_run_batch_stream(self):
+        print('Streamed batch runs should send one NDJSON line per iteration')
+        test_run_chain = get_test_run_chain()
+        data = {
+            'api_key': 'testkey',
+            'chain': json.dumps(test_run_chain),
+            'status_key': 'bicyclerepairman',
+            'run_mode': 'batch',
+            'iter_param': 'getmaptiles_roi__zoom',
+            'iter_type': 'range',
+            'iter_value': '9,11',
+            'stream': 'true'
+        }
+        for workers in [1, 3]:
+            data['batch_workers'] = workers
+            response = self.client.post('/chains/map_tiles/', data=data)
+            self.assert200(response)
+            self.assertEqual(response.mimetype, 'application/x-ndjson')
+            lines = [
+                json.loads(line) for line in response.data.splitlines()]
+            self.assertEqual(len(lines), 4)
+            for idx, zoom in enumerate([9, 10, 11]):
+                self.assertEqual(lines[idx]['iteration'], idx)
+                self.assertEqual(lines[idx]['iteration_value'], zoom)
+                self.assertIn('output_type', lines[idx]['response'])
+            self.assertEqual(lines[3]['output_type'], 'batch_ledger')
+            self.assertEqual(lines[3]['output_value']['completed'], 3)
+            self.assertEqual(lines[3]['output_value']['state'], 'complete')
+
+        # iterator errors are reported before streaming starts
+        data['iter_value'] = '9'
+        response = self.client.post('/chains/map_tiles/', data=data)
+        self.assert400(response)
+
+    def test_main_run_sweep(self):
+        print('Sweeps should run every combination of the swept parameters')
+        test_run_chain = get_test_run_chain()
+        sweep = [{
+            'iter_param': 'getmaptiles_roi__zoom',
+            'iter_type': 'range',
+            'iter_value': '9,10'
+        }, {
+            'iter_param': 'getmaptiles_roi__roi',
+            'iter_type': 'jsonl',
+            'iter_value': os.path.join(test_alg_path, 'rois.jsonl')
+        }]
+        with open(sweep[1]['iter_value'], 'w') as roi_file:
+            roi = test_run_chain['algorithms'][0]['parameters']['roi']
+            roi_file.write(json.dumps(roi) + '\n' + json.dumps(roi) + '\n')
+        data = {
+            'api_key': 'testkey',
+            'chain': json.dumps(test_run_chain),
+            'status_key': 'ronobvious',
+            'run_mode': 'sweep',
+            'sweep': json.dumps(sweep)
+        }
+        response = self.client.post('/chains/map_tiles/', data=data)
+        self.assert200(response)
+        resp_json = json.loads(response.data)
+        self.assertEqual(resp_json['output_type'], 'batch_result')
+        self.assertEqual(len(resp_json['output_value']), 4)
+
+        ledger_path = os.path.join(
+            test_alg_path, 'history', 'batch_ronobvious.jsonl')
+        with open(ledger_path, 'r') as ledger_file:
+            ledger = [json.loads(line) for line in ledger_file]
+        self.assertEqual(
+            [r['iteration_value']['getmaptiles_roi__zoom'] for r in ledger],
+            [9, 9, 10, 10]
+        )
+
+        data['sweep_mode'] = 'zip'
+        response = self.client.post('/chains/map_tiles/', data=data)
+        self.assert200(response)
+        self.assertEqual(len(json.loads(response.data)['output_value']), 2)
+
+        for sweep_value, sweep_mode in [
+                ('[]', 'product'),
+                ('spam', 'product'),
+                (json.dumps(sweep), 'lumberjack'),
+                (json.dumps([{'iter_param': 'getmaptiles_roi__zoom'}]), 'zip')
+        ]:
+            data['sweep'] = sweep_value
+            data['sweep_mode'] = sweep_mode
+            response = self.client.post('/chains/map_tiles/', data=data)
+            self.assert400(response)
+            self.assertEqual(response.data, b'Sweep mode misconfigured')
+
+        sweep[0]['iter_param'] = 'spam__zoom'
+        data['sweep'] = json.dumps(sweep)
+        data['sweep_mode'] = 'product'
+        response = self.client.post('/chains/map_tiles/', data=data)
+        self.assert400(response)
+
     def test_test_run(self):
         print('test_run endpoint should display correctly')
 
@@ -1944,6 +2171,36 @@ class ATKTestCaseTestAlgorithm(TestCase):
         self.assertTrue(response['valid'])
         self.assertEqual(response['errors'], [])
 
+    def test_compiled_validator_cached(self):
+        from algorithm_toolkit.utils.validation_utils import compile_validator
+        print(
+            'Validation plans should be reused for identical definitions '
+            'and rebuilt when a definition changes'
+        )
+        self.r_param['custom_validation'] = '^thing'
+        self.test_alg['required_parameters'].append(self.r_param)
+        first = compile_validator(self.test_alg)
+        second = compile_validator(json.loads(json.dumps(self.test_alg)))
+        self.assertTrue(first is second)
+        self.assertEqual(first.required[-1].regex.pattern, '^thing')
+
+        self.r_param['custom_validation'] = '^dinsdale'
+        third = compile_validator(self.test_alg)
+        self.assertFalse(first is third)
+        response = self.checkit(self.p_submit, self.test_alg)
+        self.assertTrue(response['valid'])
+
+    def test_compiled_validator_bad_expression(self):
+        print(
+            'A malformed expression should be reported as a parameter '
+            'error rather than breaking validation'
+        )
+        self.r_param['custom_validation'] = '^[dinsdale'
+        self.test_alg['required_parameters'].append(self.r_param)
+        response = self.checkit(self.p_submit, self.test_alg)
+        self.assertFalse(response['valid'])
+        self.assertEqual(response['errors'][0]['parameter'], 'test')
+
 
 class ATKTestCaseTestAlgorithmChain(TestCase):
 
@@ -2039,20 +2296,559 @@ class ATKTestCaseTestAlgorithmChain(TestCase):
         h_list = self.cl.search_history('thingie', 'getmaptiles_roi')
         self.assertEqual(h_list, [None])
 
+    def test_search_history_index(self):
+        print('Chain ledger history lookups should use the history index')
+        self.cl.metadata = {'hedgehog': 'Spiny Norman'}
+        self.cl.archive_metadata('piranha_brothers', {})
+        self.cl.clear_current_metadata()
+        self.cl.metadata = {'hedgehog': 'Dinsdale'}
+        self.cl.archive_metadata('getmaptiles_roi', self.alg_data)
+        self.cl.clear_current_metadata()
+        self.cl.metadata = {'hedgehog': 'Doug'}
+        self.cl.archive_metadata('piranha_brothers', {})
+        self.cl.clear_current_metadata()
+
+        self.assertEqual(
+            self.cl.search_history('hedgehog', 'piranha_brothers'),
+            ['Spiny Norman', 'Doug']
+        )
+        self.assertEqual(
+            self.cl.search_history_occurrence(
+                'hedgehog', 'piranha_brothers', -1),
+            'Doug'
+        )
+        self.assertEqual(
+            sorted(self.cl.search_all_history('hedgehog')),
+            ['Dinsdale', 'Doug', 'Spiny Norman']
+        )
+        self.assertTrue(self.cl.is_algo_in_history('getmaptiles_roi'))
+        self.assertFalse(self.cl.is_algo_in_history('stitch_tiles'))
+
+        # entries appended directly are picked up as well
+        self.cl.history.append(
+            {'algorithm_name': 'stitch_tiles', 'hedgehog': 'Vince'})
+        self.assertTrue(self.cl.is_algo_in_history('stitch_tiles'))
+
+        # and so is a history cut short in place
+        del self.cl.history[2:]
+        self.assertFalse(self.cl.is_algo_in_history('stitch_tiles'))
+        self.assertEqual(
+            self.cl.search_history('hedgehog', 'piranha_brothers'),
+            ['Spiny Norman']
+        )
+        self.cl.history.append(
+            {'algorithm_name': 'piranha_brothers', 'hedgehog': 'Vince'})
+        self.assertEqual(
+            self.cl.search_history('hedgehog', 'piranha_brothers'),
+            ['Spiny Norman', 'Vince']
+        )
+
+        # replacing the history resets the index
+        self.cl.history = []
+        self.assertFalse(self.cl.is_algo_in_history('getmaptiles_roi'))
+        self.assertEqual(self.cl.search_all_history('hedgehog'), [])
+
+    def test_chain_ledger_fork(self):
+        print('Forked ledgers should continue from the history they fork')
+        self.cl.add_to_metadata('spam', 'eggs')
+        self.cl.archive_metadata('getmaptiles_roi', {})
+        self.cl.clear_current_metadata()
+
+        branch = self.cl.fork('sweep_1')
+        try:
+            self.assertEqual(branch.get_from_history(0, 'spam'), 'eggs')
+            self.assertEqual(branch.metadata, {})
+            self.assertTrue(branch.batch_ledger is self.cl)
+            self.assertTrue(os.path.exists(branch.get_temp_folder()))
+            self.assertNotEqual(
+                branch.get_working_folder(), self.cl.get_working_folder())
+
+            branch.add_to_metadata('ham', 1)
+            branch.archive_metadata('stitch_tiles', {})
+            self.assertEqual(branch.get_history_size(), 2)
+            self.assertEqual(self.cl.get_history_size(), 1)
+            self.assertEqual(
+                branch.search_history_occurrence(
+                    'spam', 'getmaptiles_roi', 0), 'eggs')
+        finally:
+            branch.remove_working_folders()
+
+    def test_chain_ledger_deferred_folders(self):
+        from algorithm_toolkit import Algorithm
+        print('Deferred ledger folders should be made on first use')
+
+        class Batched(Algorithm):
+            def run_batch(self, params_list):
+                return [{} for params in params_list]
+
+        self.assertTrue(Batched.has_batch_hook())
+        self.assertFalse(Algorithm.has_batch_hook())
+
+        cl = self.cl.fork('batch_0')
+        cl.remove_working_folders()
+        cl.make_working_folders(deferred=True)
+        try:
+            folder = os.path.join(
+                self.cl.get_working_folder(), 'batch_0')
+            self.assertFalse(os.path.exists(folder))
+            self.assertTrue(os.path.exists(cl.get_temp_folder()))
+        finally:
+            cl.remove_working_folders()
+        self.assertFalse(os.path.exists(folder))
+
+    def test_chain_ledger_release(self):
+        from algorithm_toolkit.atk import HistoryLiveness
+        print('Ledger values should be released after their last reader')
+        ledger_param = {
+            'source': 'chain_ledger',
+            'source_algorithm': 'spam',
+            'key': 'tiles',
+            'occurrence': 'first'
+        }
+        chain_definition = [
+            {'algorithm': 'spam', 'pinned_keys': ['bounds']},
+            {'algorithm': 'eggs', 'parameters': {'tiles': ledger_param}},
+            {'algorithm': 'ham'}
+        ]
+        self.cl.liveness = HistoryLiveness(
+            ['spam', 'eggs', 'ham'], chain_definition, [[], [], ['count']])
+        tiles = ['tile'] * 100
+
+        self.cl.add_to_metadata('tiles', tiles)
+        self.cl.add_to_metadata('bounds', [1, 2, 3, 4])
+        self.cl.add_to_metadata('count', [100])
+        self.cl.archive_metadata('spam', {})
+        self.cl.clear_current_metadata()
+        self.assertTrue(self.cl.get_from_history(0, 'tiles') is tiles)
+
+        self.cl.add_to_metadata('chain_output_value', {'output_value': 1})
+        self.cl.archive_metadata('eggs', {'tiles': tiles})
+        released = {'atk_released': 'list', 'length': 100}
+        self.assertEqual(self.cl.get_from_history(0, 'tiles'), released)
+        self.assertEqual(
+            self.cl.get_from_history(1, 'algorithm_params'),
+            {'tiles': released}
+        )
+        self.assertEqual(self.cl.get_from_history(0, 'bounds'), [1, 2, 3, 4])
+        self.assertEqual(self.cl.get_from_history(0, 'count'), [100])
+        self.assertEqual(
+            self.cl.get_from_history(1, 'chain_output_value'),
+            {'output_value': 1}
+        )
+
+    def test_rerun_index(self):
+        from algorithm_toolkit import Algorithm, AlgorithmChain
+        from algorithm_toolkit.utils import checkpoint_utils, file_utils
+        print('Reruns should start from the first changed algorithm')
+        shutil.rmtree(test_alg_path)
+        sys.path.append(test_alg_path)
+        subprocess.call(['alg', 'cp', 'test_project', '-e', '-q'])
+        self.app.config['CHAIN_LEDGER_HISTORY_PATH'] = '/tmp/test_history'
+        try:
+            # a run of the first algorithm with form input (strings),
+            # validated the way Algorithm.set_up does
+            self.ac = AlgorithmChain(test_alg_path, get_test_run_chain())
+            cl = self.ac.create_ledger('spiny')
+            params = self.ac.algs[0]['parameters']
+            entry = file_utils.get_definition_entry(file_utils.get_json_path(
+                test_alg_path, 'getmaptiles_roi'))
+            alg = Algorithm(cl=cl, params=params)
+            self.assertTrue(alg.check_params(entry.data))
+            self.assertEqual(params['zoom'], 14)
+            cl.add_to_metadata('image_filenames', 'spam.png')
+            cl.archive_metadata('getmaptiles_roi', params)
+            self.ac.save_checkpoint(cl, 'rerun')
+            checkpoint = checkpoint_utils.load_checkpoint(
+                test_alg_path, 'spiny', 'rerun')
+
+            ac = AlgorithmChain(test_alg_path, get_test_run_chain())
+            self.assertEqual(ac.get_rerun_index(checkpoint), 1)
+
+            changed = get_test_run_chain()
+            changed['algorithms'][0]['parameters']['zoom'] = '15'
+            ac = AlgorithmChain(test_alg_path, changed)
+            self.assertEqual(ac.get_rerun_index(checkpoint), 0)
+
+            checkpoint['chain']['chain_name'] = 'splunge'
+            ac = AlgorithmChain(test_alg_path, get_test_run_chain())
+            self.assertEqual(ac.get_rerun_index(checkpoint), 0)
+        finally:
+            del self.app.config['CHAIN_LEDGER_HISTORY_PATH']
+            shutil.rmtree('/tmp/test_history', ignore_errors=True)
+
     def test_chain_ledger_status(self):
+        from algorithm_toolkit.utils.status_utils import (
+            get_chain_status,
+            get_status_messages
+        )
         print('Test setting chain ledger status')
         msg1 = 'I... am an enchanter.'
         msg2 = "There are some who call me... 'Tim'?"
         self.cl.set_status(msg1)
         self.cl.set_status(msg2)
-        latest_msg = self.app.config['tim']['latest_msg'].__str__()
-        all_msg = self.app.config['tim']['all_msg'].__str__()
+        chain_status = get_chain_status('tim')
+        latest_msg = chain_status['latest_msg'].__str__()
         self.assertEqual(latest_msg, msg2.replace("'", "&#39;"))
+        last_seq = chain_status['last_seq']
+        messages = get_status_messages('tim', last_seq - 2)
         self.assertEqual(
-            all_msg,
-            msg1 + '  \n' + msg2.replace("'", "&#39;")
+            [(seq, msg.__str__()) for seq, msg in messages],
+            [(last_seq - 1, msg1), (last_seq, msg2.replace("'", "&#39;"))]
         )
 
+    def test_chain_ledger_status_limit(self):
+        from algorithm_toolkit.utils.status_utils import get_status_messages
+        print('Only the most recent status messages should be kept')
+        self.app.config['STATUS_MESSAGE_LIMIT'] = 3
+        cl = self.ac.ChainLedger('bridgekeeper')
+        try:
+            for question in ['name', 'quest', 'favourite colour', 'capital']:
+                cl.set_status('What is your ' + question + '?')
+        finally:
+            self.app.config['STATUS_MESSAGE_LIMIT'] = 1000
+        messages = get_status_messages('bridgekeeper')
+        self.assertEqual([seq for seq, msg in messages], [2, 3, 4])
+        self.assertEqual(get_status_messages('bridgekeeper', 3)[0][0], 4)
+        self.assertEqual(get_status_messages('bridgekeeper', 4), [])
+
+    def test_chain_ledger_status_throttled(self):
+        from algorithm_toolkit.utils.status_utils import (
+            get_chain_status,
+            get_status_messages
+        )
+        print('Status updates in tight loops should be coalesced')
+        self.app.config['STATUS_UPDATE_INTERVAL'] = 60
+        cl = self.ac.ChainLedger('rabbit')
+        try:
+            for i in range(100):
+                cl.set_status('Biting knight ' + str(i), i)
+            published = get_status_messages('rabbit')
+            self.assertTrue(len(published) < 20)
+
+            cl.flush_status()
+            chain_status = get_chain_status('rabbit')
+            self.assertEqual(chain_status['latest_msg'], 'Biting knight 99')
+            self.assertEqual(chain_status['algorithm_percent_complete'], 99)
+
+            # progress only changes the percentage
+            cl.progress(1, 4)
+            cl.flush_status()
+            chain_status = get_chain_status('rabbit')
+            self.assertEqual(chain_status['latest_msg'], 'Biting knight 99')
+            self.assertEqual(chain_status['algorithm_percent_complete'], 25)
+            self.assertEqual(
+                len(get_status_messages('rabbit')), len(published) + 1)
+
+            # forced messages are published at once
+            cl.set_status('Run away!', force=True)
+            self.assertEqual(
+                get_chain_status('rabbit')['latest_msg'], 'Run away!')
+
+            # the last update of a failing algorithm is published
+            def call_algorithm(algorithm, params, idx, cl=None):
+                self.ac.chain_ledger.set_status('Holy hand grenade')
+                raise RuntimeError('Ni!')
+
+            self.ac.call_algorithm = call_algorithm
+            self.ac.chain_ledger = cl
+            with self.assertRaises(RuntimeError):
+                self.ac.call_chain_algorithms()
+            self.assertEqual(
+                get_chain_status('rabbit')['latest_msg'], 'Holy hand grenade')
+        finally:
+            self.app.config['STATUS_UPDATE_INTERVAL'] = 0
+
+    def test_result_cache(self):
+        from algorithm_toolkit.utils.cache_utils import ResultCache
+        print('Cached results should be restored into other chain runs')
+        cache_path = os.path.join(this_path, 'tim_cache')
+        cache = ResultCache(cache_path=cache_path, max_bytes=1000)
+        os.makedirs(cache_path)
+        cl = self.ac.ChainLedger('tim')
+        cl2 = self.ac.ChainLedger('timothy')
+        try:
+            cl.make_working_folders()
+            fname = os.path.join(cl.get_temp_folder(), 'rabbit.txt')
+            with open(fname, 'w') as f:
+                f.write('Follow!')
+            params = {'roi': 'Caerbannog', 'zoom': 14}
+            key = cache.get_key(
+                'bridge', '0.0.1', 'src', params, cl.get_working_folder())
+            self.assertEqual(key, cache.get_key(
+                'bridge', '0.0.1', 'src', params, cl2.get_working_folder()))
+            self.assertNotEqual(key, cache.get_key(
+                'bridge', '0.0.2', 'src', params, cl.get_working_folder()))
+
+            self.assertFalse(cache.restore(key, cl2))
+            cache.put(key, {'path': fname}, cl.get_working_folder())
+            cache.entries.clear()
+
+            # restored from disk, with the path in the new working folder
+            cl2.make_working_folders()
+            self.assertTrue(cache.restore(key, cl2))
+            restored = cl2.get_from_metadata('path')
+            self.assertEqual(
+                restored,
+                os.path.join(cl2.get_temp_folder(), 'rabbit.txt')
+            )
+            with open(restored, 'r') as f:
+                self.assertEqual(f.read(), 'Follow!')
+
+            # later entries are added to a running total of the disk store
+            # size instead of walking it again
+            size = cache.disk_bytes
+            self.assertGreater(size, 0)
+            walks = []
+            evict = cache.evict
+            cache.evict = lambda: walks.append(1) or evict()
+            cache.put('black_knight', {'path': fname}, cl.get_working_folder())
+            self.assertEqual(walks, [])
+            self.assertEqual(cache.disk_bytes, size * 2)
+
+            # the disk store is capped
+            cache.max_bytes = 1
+            cache.put('holy_grail', {'path': fname}, cl.get_working_folder())
+            self.assertEqual(walks, [1])
+            self.assertEqual(os.listdir(cache_path), [])
+            self.assertEqual(cache.disk_bytes, 0)
+        finally:
+            cl.remove_working_folders()
+            cl2.remove_working_folders()
+            shutil.rmtree(cache_path)
+
+    def test_chain_ledger_arrays(self):
+        import numpy as np
+        from algorithm_toolkit import Algorithm
+        from algorithm_toolkit.utils.validation_utils import compile_parameter
+        print('Arrays should be passed between algorithms by reference')
+        try:
+            image = self.cl.create_array('image', (4, 3), dtype='uint8')
+            image[:] = 7
+            image.flush()
+
+            ref = self.cl.get_from_metadata('image')
+            self.assertEqual(ref['shape'], [4, 3])
+            self.assertEqual(ref['dtype'], '|u1')
+            self.assertTrue(ref['array_path'].startswith(
+                self.cl.get_temp_folder()))
+
+            opened = self.cl.open_array(ref)
+            self.assertEqual(int(opened.sum()), 84)
+            with self.assertRaises(ValueError):
+                opened[0, 0] = 1
+            self.assertTrue(np.array_equal(self.cl.open_array('image'), image))
+
+            # references are recorded as-is in the chain history
+            self.cl.archive_metadata('getmaptiles_roi', {})
+            history = self.cl.history_to_json()
+            self.assertEqual(history['atk_chain_metadata'][0]['image'], ref)
+
+            # and accepted by array parameters
+            p = {'name': 'image', 'data_type': 'array'}
+            params = {'image': ref}
+            alg = Algorithm(cl=self.cl, params=params)
+            self.assertTrue(
+                compile_parameter(p, True).check(alg, params, True))
+        finally:
+            self.cl.remove_working_folders()
+
+    def test_memory_status_store(self):
+        from algorithm_toolkit.utils.status_utils import MemoryStatusStore
+        print('Test the bounded in-memory status store')
+        store = MemoryStatusStore(max_entries=2, ttl=0)
+        store.set('arthur', {'latest_msg': 'King of the Britons'})
+        store.set('lancelot', 1)
+        self.assertEqual(
+            store.get('arthur')['latest_msg'], 'King of the Britons')
+
+        # least recently written entry is evicted first
+        store.set('robin', 2)
+        self.assertIsNone(store.get('arthur'))
+        self.assertEqual(store.get('robin'), 2)
+
+        self.assertFalse(store.add('robin', 3))
+        self.assertEqual(store.get('robin'), 2)
+        store.delete('robin')
+        self.assertTrue(store.add('robin', 3))
+
+        store = MemoryStatusStore(ttl=-1)
+        store.set('galahad', 'the Pure')
+        self.assertEqual(store.get('galahad', 'expired'), 'expired')
+
+    def test_sqlite_status_store(self):
+        from algorithm_toolkit.utils.status_utils import SQLiteStatusStore
+        print('Test the SQLite status store')
+        db_path = os.path.join(this_path, 'tim_status.db')
+        try:
+            store = SQLiteStatusStore(db_path)
+            store.set('tim', {'latest_msg': 'enchanter', 'percent': 50})
+            self.assertEqual(store.get('tim')['percent'], 50)
+            self.assertIsNone(store.get('brian'))
+            self.assertFalse(store.add('tim', {}))
+            self.assertTrue(store.add('brian', 0))
+
+            # a second store on the same file sees the same entries
+            other = SQLiteStatusStore(db_path)
+            self.assertEqual(other.get('brian'), 0)
+
+            self.assertEqual(store.append('tim_log', 'spam', 2), 1)
+            self.assertEqual(store.append('tim_log', 'eggs', 2), 2)
+            self.assertEqual(other.append('tim_log', 'ham', 2), 3)
+            self.assertEqual(
+                store.get_items('tim_log', 1), [(2, 'eggs'), (3, 'ham')])
+            other.delete('tim')
+            self.assertIsNone(store.get('tim'))
+        finally:
+            for suffix in ['', '-wal', '-shm']:
+                if os.path.exists(db_path + suffix):
+                    os.remove(db_path + suffix)
+
+    def test_worker_count(self):
+        print('The worker command should need at least one worker')
+        for count in ['0', '-1']:
+            self.assertEqual(subprocess.call(
+                ['alg', 'worker', '-n', count],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL
+            ), 2)
+
+    def test_sqlite_job_queue(self):
+        from algorithm_toolkit.utils.queue_utils import SQLiteJobQueue
+        print('Test the SQLite job queue')
+        db_path = os.path.join(this_path, 'tim_jobs.db')
+        try:
+            job_queue = SQLiteJobQueue(db_path, timeout=-1, attempts=2)
+            job_queue.enqueue('tim', {'chain': 'enchanter'})
+            job_queue.enqueue('brian', {'chain': 'messiah'})
+            self.assertEqual(job_queue.get_result('tim')['state'], 'queued')
+
+            # a second queue on the same file claims the next job
+            other = SQLiteJobQueue(db_path, timeout=-1, attempts=2)
+            self.assertEqual(
+                job_queue.claim('arthur'), ('tim', {'chain': 'enchanter'}, 1))
+            self.assertEqual(other.claim('robin')[0], 'brian')
+            self.assertIsNone(other.claim('robin'))
+
+            job_queue.finish('tim', 'arthur', 'complete', {'spam': 1}, 200)
+            result = other.get_result('tim')
+            self.assertEqual(result['state'], 'complete')
+            self.assertEqual(result['response'], {'spam': 1})
+
+            # jobs without heartbeats are queued again, then given up on
+            self.assertEqual(job_queue.requeue_lost(), ['brian'])
+            self.assertEqual(job_queue.claim('arthur')[2], 2)
+            self.assertEqual(job_queue.requeue_lost(), ['brian'])
+            result = job_queue.get_result('brian')
+            self.assertEqual(result['state'], 'error')
+            self.assertEqual(result['status_code'], 500)
+            self.assertIsNone(job_queue.get_result('lancelot'))
+
+            # requests following a job given up on are released
+            from algorithm_toolkit.utils import job_utils
+            flight_key = job_utils.get_flight_key(get_test_run_chain())
+            self.assertIsNone(job_utils.join_flight(flight_key, 'galahad'))
+            job_queue.enqueue('galahad', {'flight_key': flight_key})
+            job_queue.claim('arthur')
+            self.assertEqual(job_queue.requeue_lost(), ['galahad'])
+            self.assertEqual(job_queue.claim('arthur')[2], 2)
+            self.assertEqual(
+                job_utils.join_flight(flight_key, 'robin'), 'galahad')
+            self.assertEqual(job_queue.requeue_lost(), ['galahad'])
+            self.assertIsNone(job_utils.join_flight(flight_key, 'robin'))
+
+            # and so are those following a job whose worker fails
+            from algorithm_toolkit.utils.worker_utils import run_queued_job
+
+            class BrokenQueue(object):
+                def beat(self, *args):
+                    pass
+
+                def finish(self, *args):
+                    raise RuntimeError('Ni!')
+
+            with self.assertRaises(RuntimeError):
+                run_queued_job(BrokenQueue(), 'arthur', (
+                    'robin', {'flight_key': flight_key, 'chain': {}}, 1
+                ), test_alg_path)
+            self.assertIsNone(job_utils.join_flight(flight_key, 'robin'))
+            job_utils.end_flight(flight_key)
+        finally:
+            for suffix in ['', '-wal', '-shm']:
+                if os.path.exists(db_path + suffix):
+                    os.remove(db_path + suffix)
+
+    def test_single_flight(self):
+        from algorithm_toolkit.utils import job_utils
+        print('Identical chain requests should share one flight')
+        chain = get_test_run_chain()
+        flight_key = job_utils.get_flight_key(chain)
+        reordered = copy.deepcopy(chain)
+        reordered['algorithms'][0]['parameters'] = dict(
+            reversed(list(chain['algorithms'][0]['parameters'].items())))
+        self.assertEqual(job_utils.get_flight_key(reordered), flight_key)
+        reordered['algorithms'][0]['parameters']['zoom'] = '15'
+        self.assertNotEqual(job_utils.get_flight_key(reordered), flight_key)
+
+        try:
+            self.assertIsNone(job_utils.join_flight(flight_key, 'arthur'))
+            self.assertEqual(
+                job_utils.join_flight(flight_key, 'lancelot'), 'arthur')
+
+            job_utils.set_job_result(
+                'arthur', job_utils.JOB_COMPLETE, {'output_value': 1}, 200)
+            result = job_utils.wait_flight(flight_key, 'arthur')
+            self.assertEqual(result['response'], {'output_value': 1})
+        finally:
+            job_utils.end_flight(flight_key)
+        self.assertIsNone(job_utils.join_flight(flight_key, 'robin'))
+        job_utils.end_flight(flight_key)
+
+        print('A flight whose leader stops renewing its lease is released')
+        import time
+        from algorithm_toolkit.utils.home_utils import process_single_flight
+        self.app.config['SINGLE_FLIGHT_LEASE'] = 0.3
+        self.app.config['SINGLE_FLIGHT_TIMEOUT'] = 0.5
+        try:
+            self.assertIsNone(job_utils.join_flight(flight_key, 'arthur'))
+            stop = job_utils.hold_flight(flight_key, 'arthur')
+            time.sleep(0.6)
+            self.assertEqual(
+                job_utils.join_flight(flight_key, 'lancelot'), 'arthur')
+            stop.set()
+            time.sleep(0.6)
+            self.assertIsNone(job_utils.join_flight(flight_key, 'lancelot'))
+            self.assertFalse(job_utils.renew_flight(flight_key, 'arthur'))
+
+            # a follower waits no longer than SINGLE_FLIGHT_TIMEOUT, then
+            # runs the chain itself
+            stop = job_utils.hold_flight(flight_key, 'lancelot')
+            job_utils.set_job_result('lancelot', job_utils.JOB_QUEUED)
+            self.assertIsNone(job_utils.wait_flight(flight_key, 'lancelot'))
+            stop.set()
+            job_utils.end_flight(flight_key)
+            chain = {'chain_name': 'splunge', 'algorithms': []}
+            flight_key = job_utils.get_flight_key(chain)
+            self.assertIsNone(job_utils.join_flight(flight_key, 'lancelot'))
+            stop = job_utils.hold_flight(flight_key, 'lancelot')
+            response = process_single_flight({
+                'chain': chain,
+                'status_key': 'robin',
+                'run_mode': 'single',
+                'run_async': False,
+                'iter_param': None,
+                'iter_type': None,
+                'iter_value': None
+            }, test_alg_path)
+            self.assertEqual(response.status_code, 404)
+            self.assertEqual(response.data, b'Chain name not found')
+            self.assertEqual(
+                job_utils.get_job_result('robin')['status_code'], 404)
+        finally:
+            stop.set()
+            job_utils.end_flight(flight_key)
+            self.app.config['SINGLE_FLIGHT_LEASE'] = 30
+            self.app.config['SINGLE_FLIGHT_TIMEOUT'] = 3600
+
     def test_params_to_json(self):
         print('Test creating a JSON object from chain ledger history')
         self.cl.archive_metadata('getmaptiles_roi', self.alg_data)
@@ -2140,6 +2936,580 @@ class ATKTestCaseTestAlgorithmChain(TestCase):
                 json.dumps(test_obj, separators=(',', ': '), indent=4)
             )
 
+    def test_history_to_json_arrays(self):
+        import numpy as np
+        print('Ledger history should save arrays without changing the ledger')
+
+        class TestClass():
+            pass
+
+        self.app.config['HISTORY_INLINE_ARRAY_SIZE'] = 4
+        tmp_path = '/tmp/testtest.json'
+        sidecar_path = '/tmp/testtest_arrays'
+        try:
+            params = {'hedgehog': TestClass(), 'zoom': np.int64(14)}
+            self.cl.add_to_metadata('small', np.arange(3))
+            self.cl.add_to_metadata('large', np.zeros((3, 3)))
+            self.cl.add_to_metadata('nested', {'spam': [1, TestClass()]})
+            self.cl.archive_metadata('piranha_brothers', params)
+
+            history = self.cl.history_to_json()
+            metadata = history['atk_chain_metadata'][0]
+            self.assertEqual(metadata['algorithm_params'], {
+                'hedgehog': 'Value not JSON serializable', 'zoom': 14})
+            self.assertEqual(metadata['small'], [0, 1, 2])
+            self.assertEqual(metadata['large'], 'Value not JSON serializable')
+            self.assertEqual(metadata['nested'], 'Value not JSON serializable')
+
+            # the ledger itself is left alone
+            self.assertTrue(isinstance(params['hedgehog'], TestClass))
+            self.assertTrue(isinstance(
+                self.cl.get_from_history(0, 'large'), np.ndarray))
+
+            # large arrays are saved next to the history file
+            self.cl.save_history_to_json(tmp_path)
+            with open(tmp_path, 'r') as json_file:
+                metadata = json.load(json_file)['atk_chain_metadata'][0]
+            self.assertEqual(metadata['large']['shape'], [3, 3])
+            self.assertTrue(np.array_equal(
+                np.load(metadata['large']['array_path']), np.zeros((3, 3))))
+        finally:
+            self.app.config['HISTORY_INLINE_ARRAY_SIZE'] = 1000
+            shutil.rmtree(sidecar_path, ignore_errors=True)
+
+    def test_chain_dependencies(self):
+        print(
+            'The DAG scheduler should derive algorithm dependencies '
+            'from chain_ledger parameter sources'
+        )
+        shutil.rmtree(test_alg_path)
+        sys.path.append(test_alg_path)
+        subprocess.call(['alg', 'cp', 'test_project', '-e', '-q'])
+        from algorithm_toolkit import AlgorithmChain
+        self.ac = AlgorithmChain(test_alg_path, get_test_run_chain())
+        self.assertEqual(
+            self.ac.get_chain_dependencies(), [set(), {0}, {1}])
+
+        # algorithms with only user parameters are independent
+        names = [
+            'getmaptiles_roi', 'stitch_tiles', 'output_image_to_client',
+            'getmaptiles_roi'
+        ]
+        self.ac.algs = [{'name': name, 'parameters': {}} for name in names]
+        self.ac.chain_definition = [
+            {'algorithm': name, 'parameter_source': 'user'} for name in names]
+        self.assertEqual(
+            self.ac.get_chain_dependencies(), [set(), set(), set(), set()])
+
+        # algorithms can opt out of running concurrently: they wait for
+        # every earlier algorithm and every later one waits for them
+        json_file = os.path.join(
+            test_alg_path, 'algorithms', 'stitch_tiles', 'algorithm.json')
+        with open(json_file, 'r') as alg_file:
+            stitch = json.load(alg_file)
+        stitch['concurrent'] = False
+        with open(json_file, 'w') as alg_file:
+            alg_file.write(json.dumps(stitch))
+        self.assertEqual(
+            self.ac.get_chain_dependencies(), [set(), {0}, {1}, {1}])
+
+    def test_chain_map(self):
+        print('Mapped algorithms should run once for each ledger element')
+        shutil.rmtree(test_alg_path)
+        sys.path.append(test_alg_path)
+        subprocess.call(['alg', 'cp', 'test_project', '-e', '-q'])
+        from algorithm_toolkit import AlgorithmChain
+        self.ac = AlgorithmChain(test_alg_path, get_test_run_chain())
+        self.assertIsNone(self.ac.get_map_parameter(1))
+        self.ac.chain_definition = copy.deepcopy(self.ac.chain_definition)
+        self.ac.chain_definition[1]['parameters']['image_filenames'][
+            'map'] = True
+        self.assertEqual(self.ac.get_map_parameter(1), 'image_filenames')
+
+        def run_map_element(algorithm, params, cl):
+            cl.add_to_metadata(
+                'image_path', params['image_filenames'] + '.tif')
+            return cl.metadata
+
+        self.ac.run_map_element = run_map_element
+        self.cl = self.ac.create_ledger('spiny')
+        self.cl.add_to_metadata('image_filenames', 'spam, eggs,ham')
+        self.cl.archive_metadata('getmaptiles_roi', {})
+        self.cl.clear_current_metadata()
+        self.ac.call_algorithm('stitch_tiles', {}, 1)
+        self.assertEqual(
+            self.cl.metadata['image_path'],
+            ['spam.tif', 'eggs.tif', 'ham.tif']
+        )
+        self.assertEqual(self.cl.metadata['image_bounds'], [None] * 3)
+
+    def test_chain_map_worker(self):
+        print('Map worker processes should get the history once')
+        from algorithm_toolkit import atk
+        history = [{'algorithm_name': 'getmaptiles_roi', 'hedgehog': 'Norman'}]
+        atk.init_map_worker(history)
+
+        def run_map_element(self, algorithm, params, cl):
+            return {'history': cl.history, 'params': params}
+
+        saved = atk.AlgorithmChain.run_map_element
+        atk.AlgorithmChain.run_map_element = run_map_element
+        try:
+            result = atk.run_map_element(
+                test_alg_path, 'test_run', 'stitch_tiles',
+                {'image_filenames': 'spam'}, 'spiny', 'spiny')
+        finally:
+            atk.AlgorithmChain.run_map_element = saved
+        self.assertEqual(result['history'], history)
+        self.assertEqual(result['params'], {'image_filenames': 'spam'})
+
+    def add_batch_algorithms(self):
+        # the squares chain: square (with a run_batch hook), then plus_one
+        shutil.rmtree(test_alg_path)
+        sys.path.append(test_alg_path)
+        subprocess.call(['alg', 'cp', 'test_project', '-e', '-q'])
+        for name, (definition, main) in get_batch_algorithms().items():
+            alg_path = os.path.join(test_alg_path, 'algorithms', name)
+            os.makedirs(alg_path)
+            with open(os.path.join(alg_path, '__init__.py'), 'w') as f:
+                f.write('')
+            with open(os.path.join(alg_path, 'algorithm.json'), 'w') as f:
+                f.write(json.dumps(definition))
+            with open(os.path.join(alg_path, 'main.py'), 'w') as f:
+                f.write(main)
+        chain_def, chain = get_batch_chain()
+        chain_file = os.path.join(test_alg_path, 'chains', 'squares.json')
+        with open(chain_file, 'w') as f:
+            f.write(json.dumps(chain_def))
+
+        # modules are imported once per process, so their records are
+        # cleared for each test
+        from algorithm_toolkit.utils.module_utils import get_algorithm_module
+        square = get_algorithm_module(test_alg_path, 'square')
+        del square.batch_calls[:]
+        del square.runs[:]
+        plus_one = get_algorithm_module(test_alg_path, 'plus_one')
+        del plus_one.runs[:]
+        plus_one.fail = False
+        return chain
+
+    def run_test_batch(self, chain, status_key, iter_value):
+        # (idx, value, response) of each iteration of a batch over square__x
+        from algorithm_toolkit import AlgorithmChain
+        self.ac = AlgorithmChain(test_alg_path, copy.deepcopy(chain))
+        self.cl = self.ac.create_ledger(status_key)
+        self.cl.make_working_folders()
+        try:
+            iter_list, msg = self.ac.get_batch_list(
+                'square__x', 'range', iter_value)
+            return list(self.ac.iter_batch_results(
+                'square__x', 'range', iter_value, iter_list))
+        finally:
+            self.cl.remove_working_folders()
+
+    def test_chain_run_dag_squares(self):
+        from algorithm_toolkit import AlgorithmChain
+        print(
+            'The DAG scheduler should run algorithms in dependency order '
+            'with the same history as a sequential run'
+        )
+        chain = self.add_batch_algorithms()
+        chain['algorithms'][0]['parameters']['x'] = 3
+        histories = []
+        try:
+            for scheduler in ['sequential', 'dag']:
+                self.app.config['CHAIN_SCHEDULER'] = scheduler
+                self.ac = AlgorithmChain(test_alg_path, copy.deepcopy(chain))
+                self.cl = self.ac.create_ledger('dinsdale' + scheduler)
+                self.cl.make_working_folders()
+                response = self.ac.call_chain_algorithms()
+                self.cl.remove_working_folders()
+                self.assertEqual(response['output_value'], 10)
+                histories.append([
+                    (h['algorithm_name'], h.get('y'), h.get('z'))
+                    for h in self.cl.history
+                ])
+        finally:
+            self.app.config['CHAIN_SCHEDULER'] = 'sequential'
+        self.assertEqual(
+            histories[0], [('square', 9, None), ('plus_one', None, 10)])
+        self.assertEqual(histories[1], histories[0])
+
+    def test_chain_resume(self):
+        from algorithm_toolkit.utils.checkpoint_utils import load_checkpoint
+        from algorithm_toolkit.utils.module_utils import get_algorithm_module
+        print(
+            'A failed chain run should keep its checkpoint and resume from '
+            'the algorithm that failed'
+        )
+        chain = self.add_batch_algorithms()
+        chain['algorithms'][0]['parameters']['x'] = 3
+        square = get_algorithm_module(test_alg_path, 'square')
+        plus_one = get_algorithm_module(test_alg_path, 'plus_one')
+        data = {
+            'api_key': 'testkey',
+            'chain': json.dumps(chain),
+            'status_key': 'brianresume'
+        }
+        self.app.config['CHAIN_CHECKPOINTS'] = True
+        plus_one.fail = True
+        try:
+            response = self.client.post('/chains/squares/', data=data)
+            self.assert400(response)
+            self.assertEqual(
+                json.loads(response.data)['message'], 'Bridge out')
+            checkpoint = load_checkpoint(test_alg_path, 'brianresume')
+            self.assertEqual(
+                [h['algorithm_name'] for h in checkpoint['history']],
+                ['square']
+            )
+            self.assertEqual(checkpoint['history'][0]['y'], 9)
+            self.assertTrue(os.path.exists(
+                self.ac.ChainLedger('brianresume').get_working_folder()))
+
+            plus_one.fail = False
+            response = self.client.post(
+                '/chain_resume/brianresume/', data={'api_key': 'testkey'})
+            self.assert200(response)
+            self.assertEqual(json.loads(response.data)['output_value'], 10)
+            self.assertEqual(square.runs, [3])
+            self.assertEqual(plus_one.runs, [9, 9])
+            self.assertIsNone(load_checkpoint(test_alg_path, 'brianresume'))
+            self.assertFalse(os.path.exists(
+                self.ac.ChainLedger('brianresume').get_working_folder()))
+        finally:
+            plus_one.fail = False
+            self.app.config['CHAIN_CHECKPOINTS'] = False
+            self.ac.ChainLedger('brianresume').remove_working_folders()
+
+    def test_chain_rerun(self):
+        from algorithm_toolkit.utils.checkpoint_utils import list_checkpoints
+        from algorithm_toolkit.utils.module_utils import get_algorithm_module
+        print(
+            'Reruns should reuse the results of a previous run up to the '
+            'first algorithm whose parameters changed'
+        )
+        chain = self.add_batch_algorithms()
+        square = get_algorithm_module(test_alg_path, 'square')
+        plus_one = get_algorithm_module(test_alg_path, 'plus_one')
+        status_keys = ['arthur1', 'arthur2', 'arthur3']
+
+        def run(status_key, x, rerun_from=None):
+            chain['algorithms'][0]['parameters']['x'] = str(x)
+            data = {
+                'api_key': 'testkey',
+                'chain': json.dumps(chain),
+                'status_key': status_key
+            }
+            if rerun_from is not None:
+                data['rerun_from'] = rerun_from
+            response = self.client.post('/chains/squares/', data=data)
+            self.assert200(response)
+            return json.loads(response.data)['output_value']
+
+        self.app.config['RERUN_HISTORY_LENGTH'] = 2
+        try:
+            self.assertEqual(run('arthur1', 3), 10)
+
+            # unchanged parameters: only the last algorithm runs again, on
+            # a copy of the previous run's working folder
+            self.assertEqual(run('arthur2', 3, 'arthur1'), 10)
+            self.assertEqual(square.runs, [3])
+            self.assertEqual(plus_one.runs, [9, 9])
+            history_file = os.path.join(
+                test_alg_path, 'history', 'arthur2.json')
+            with open(history_file, 'r') as f:
+                history = json.load(f)['atk_chain_metadata']
+            y_path = history[0]['y_path']
+            self.assertEqual(y_path, os.path.join(
+                self.ac.ChainLedger('arthur2').get_temp_folder(), 'y.txt'))
+            with open(y_path, 'r') as f:
+                self.assertEqual(f.read(), '9')
+
+            # a changed parameter runs the chain from that algorithm
+            self.assertEqual(run('arthur3', 4, 'arthur1'), 17)
+            self.assertEqual(square.runs, [3, 4])
+            self.assertEqual(plus_one.runs, [9, 9, 16])
+
+            # only the last RERUN_HISTORY_LENGTH runs are kept
+            self.assertEqual(
+                list_checkpoints(test_alg_path, 'rerun'), status_keys[1:])
+            self.assertFalse(os.path.exists(
+                self.ac.ChainLedger('arthur1').get_working_folder()))
+            self.assertTrue(os.path.exists(y_path))
+        finally:
+            self.app.config['RERUN_HISTORY_LENGTH'] = 0
+            for status_key in status_keys:
+                self.ac.ChainLedger(status_key).remove_working_folders()
+
+    def test_chain_result_cache(self):
+        from algorithm_toolkit import AlgorithmChain
+        from algorithm_toolkit.utils.cache_utils import (
+            get_folder_size,
+            get_result_cache,
+            reset_result_cache
+        )
+        from algorithm_toolkit.utils.module_utils import get_algorithm_module
+        print('Cacheable algorithms should reuse results of earlier runs')
+        chain = self.add_batch_algorithms()
+        json_file = os.path.join(
+            test_alg_path, 'algorithms', 'square', 'algorithm.json')
+        with open(json_file, 'r') as alg_file:
+            square_def = json.load(alg_file)
+        square_def['cacheable'] = True
+        with open(json_file, 'w') as alg_file:
+            alg_file.write(json.dumps(square_def))
+        square = get_algorithm_module(test_alg_path, 'square')
+
+        cache_path = os.path.join(this_path, 'tim_cache')
+        self.app.config['RESULT_CACHE_PATH'] = cache_path
+        self.app.config['RESULT_CACHE_BYTES'] = 1024 * 1024
+        reset_result_cache()
+        status_keys = ['enchanter1', 'enchanter2', 'enchanter3']
+        try:
+            outputs = []
+            for status_key, x in zip(status_keys, [3, 3, 4]):
+                chain['algorithms'][0]['parameters']['x'] = x
+                self.ac = AlgorithmChain(test_alg_path, copy.deepcopy(chain))
+                self.cl = self.ac.create_ledger(status_key)
+                self.cl.make_working_folders()
+                outputs.append(
+                    self.ac.call_chain_algorithms()['output_value'])
+            self.assertEqual(outputs, [10, 10, 17])
+
+            # the second run restored the first run's result and file
+            self.assertEqual(square.runs, [3, 4])
+            ledger = self.ac.ChainLedger('enchanter2')
+            y_path = os.path.join(ledger.get_temp_folder(), 'y.txt')
+            with open(y_path, 'r') as f:
+                self.assertEqual(f.read(), '9')
+
+            # the running size total matches the cache on disk
+            cache = get_result_cache()
+            self.assertEqual(len(os.listdir(cache_path)), 2)
+            self.assertEqual(cache.disk_bytes, get_folder_size(cache_path))
+        finally:
+            reset_result_cache()
+            self.app.config['RESULT_CACHE_PATH'] = None
+            self.app.config['RESULT_CACHE_BYTES'] = 1024 * 1024 * 1024
+            shutil.rmtree(cache_path, ignore_errors=True)
+            for status_key in status_keys:
+                self.ac.ChainLedger(status_key).remove_working_folders()
+
+    def test_chain_release_values(self):
+        from algorithm_toolkit import AlgorithmChain
+        print(
+            'Chain runs with RELEASE_LEDGER_VALUES should drop values no '
+            'later algorithm reads, except pinned keys'
+        )
+        chain = self.add_batch_algorithms()
+        chain['algorithms'][0]['parameters']['x'] = 3
+        self.app.config['RELEASE_LEDGER_VALUES'] = True
+        try:
+            self.ac = AlgorithmChain(test_alg_path, copy.deepcopy(chain))
+            self.cl = self.ac.create_ledger('tim')
+            self.cl.make_working_folders()
+            response = self.ac.call_chain_algorithms()
+            self.cl.remove_working_folders()
+            self.assertEqual(response['output_value'], 10)
+            history = self.cl.history_to_json()['atk_chain_metadata']
+            self.assertEqual(
+                history[0]['tiles'], {'atk_released': 'list', 'length': 300})
+            self.assertEqual(history[0]['y'], 9)
+            self.assertEqual(history[1]['z'], 10)
+
+            # keys pinned on the chain definition entry are kept
+            chain_file = os.path.join(
+                test_alg_path, 'chains', 'squares.json')
+            with open(chain_file, 'r') as f:
+                chain_def = json.load(f)
+            chain_def['squares'][0]['pinned_keys'] = ['tiles']
+            with open(chain_file, 'w') as f:
+                f.write(json.dumps(chain_def))
+            self.ac = AlgorithmChain(test_alg_path, copy.deepcopy(chain))
+            self.cl = self.ac.create_ledger('tim')
+            self.cl.make_working_folders()
+            self.ac.call_chain_algorithms()
+            self.cl.remove_working_folders()
+            history = self.cl.history_to_json()['atk_chain_metadata']
+            self.assertEqual(history[0]['tiles'], [3] * 300)
+        finally:
+            self.app.config['RELEASE_LEDGER_VALUES'] = False
+
+    def test_chain_batch_chunked(self):
+        from algorithm_toolkit.utils.module_utils import get_algorithm_module
+        print(
+            'Batches should run algorithms with a run_batch hook a chunk '
+            'at a time and other algorithms once per iteration'
+        )
+        chain = self.add_batch_algorithms()
+        self.app.config['CHAIN_LEDGER_HISTORY_PATH'] = '/tmp/test_history'
+        self.app.config['BATCH_CHUNK_SIZE'] = 3
+        try:
+            batch_calls = get_algorithm_module(
+                test_alg_path, 'square').batch_calls
+            results = self.run_test_batch(chain, 'bruce', '1,7')
+            self.assertEqual(batch_calls, [[1, 2, 3], [4, 5, 6], [7]])
+            self.assertEqual(
+                [(idx, value) for idx, value, response in results],
+                list(enumerate(range(1, 8)))
+            )
+            self.assertEqual(
+                [response['output_value'] for idx, value, response in results],
+                [x ** 2 + 1 for x in range(1, 8)]
+            )
+
+            # an iteration failing validation is left out of the chunk
+            del batch_calls[:]
+            results = self.run_test_batch(chain, 'bruce', '0,2')
+            self.assertEqual(batch_calls, [[1, 2]])
+            self.assertEqual(results[0][2]['output_type'], 'error')
+            self.assertEqual(results[2][2]['output_value'], 5)
+
+            # a failing run_batch fails every iteration of its chunk
+            del batch_calls[:]
+            results = self.run_test_batch(chain, 'bruce', '11,16')
+            self.assertEqual(batch_calls, [[11, 12, 13], [14, 15, 16]])
+            for idx, value, response in results[:3]:
+                self.assertEqual(response, {
+                    'output_type': 'error', 'message': 'Unlucky number'})
+            self.assertEqual(results[3][2]['output_value'], 197)
+
+            results = self.run_test_batch(chain, 'bruce', '64,66')
+            for idx, value, response in results:
+                self.assertEqual(response['output_type'], 'error')
+                self.assertIn('RuntimeError', response['error_message'])
+
+            # so does one returning a result per iteration too few or many
+            results = self.run_test_batch(chain, 'bruce', '97,99')
+            for idx, value, response in results:
+                self.assertEqual(response, {
+                    'output_type': 'error',
+                    'message': 'square returned 1 results for 3 items'
+                })
+
+            # with chunks of one, every algorithm runs once per iteration
+            del batch_calls[:]
+            self.app.config['BATCH_CHUNK_SIZE'] = 1
+            results = self.run_test_batch(chain, 'bruce', '1,3')
+            self.assertEqual(batch_calls, [])
+            self.assertEqual(
+                [response['output_value'] for idx, value, response in results],
+                [2, 5, 10]
+            )
+        finally:
+            self.app.config['BATCH_CHUNK_SIZE'] = 256
+            del self.app.config['CHAIN_LEDGER_HISTORY_PATH']
+
+    def test_chain_batch_pipeline(self):
+        from algorithm_toolkit import AlgorithmChain
+        from algorithm_toolkit.utils.status_utils import (
+            get_chain_status,
+            set_run_state
+        )
+        print(
+            'Pipelined batches should return iterations in order, report '
+            'their stages and stop when cancelled'
+        )
+        chain = self.add_batch_algorithms()
+        self.app.config['CHAIN_LEDGER_HISTORY_PATH'] = '/tmp/test_history'
+        self.app.config['BATCH_EXECUTOR'] = 'pipeline'
+        self.app.config['BATCH_PIPELINE_DEPTH'] = 1
+        try:
+            results = self.run_test_batch(chain, 'gumby', '1,8')
+            self.assertEqual(
+                [(idx, value) for idx, value, response in results],
+                list(enumerate(range(1, 9)))
+            )
+            self.assertEqual(
+                [response['output_value'] for idx, value, response in results],
+                [x ** 2 + 1 for x in range(1, 9)]
+            )
+            stages = get_chain_status('gumby')['batch_stages']
+            self.assertEqual(
+                [stage['algorithm'] for stage in stages],
+                ['square', 'plus_one']
+            )
+            self.assertEqual(stages[0]['completed'], 8)
+
+            # slowed down so that the batch is cancelled part way through
+            chain['algorithms'][0]['parameters']['delay'] = 0.05
+            self.ac = AlgorithmChain(test_alg_path, chain)
+            iter_list, msg = self.ac.get_batch_list(
+                'square__x', 'range', '1,100')
+            self.cl = self.ac.create_ledger('gumby')
+            self.cl.make_working_folders()
+            results = self.ac.iter_batch_results(
+                'square__x', 'range', '1,100', iter_list)
+            self.assertEqual(next(results)[2]['output_value'], 2)
+            set_run_state('gumby', 0)
+            results = list(results)
+            self.assertIsNone(results[-1][2])
+            self.assertLess(len(results), 20)
+            self.assertEqual(
+                [idx for idx, value, response in results[:-1]],
+                list(range(1, len(results)))
+            )
+        finally:
+            set_run_state('gumby', 1)
+            self.cl.remove_working_folders()
+            self.app.config['BATCH_EXECUTOR'] = 'thread'
+            self.app.config['BATCH_PIPELINE_DEPTH'] = 4
+            del self.app.config['CHAIN_LEDGER_HISTORY_PATH']
+
+    def test_algorithm_module_cache(self):
+        from algorithm_toolkit.utils.module_utils import (
+            get_algorithm_module,
+            preload_algorithms
+        )
+        print('Algorithm modules should be cached and reloaded on change')
+        shutil.rmtree(test_alg_path)
+        sys.path.append(test_alg_path)
+        subprocess.call(['alg', 'cp', 'test_project', '-e', '-q'])
+        alg = 'output_image_to_client'
+        m = get_algorithm_module(test_alg_path, alg)
+        self.assertTrue(m is get_algorithm_module(test_alg_path, alg))
+        self.assertTrue(alg in preload_algorithms(test_alg_path))
+
+        self.app.config['ALGORITHM_RELOAD'] = True
+        try:
+            self.assertTrue(m is get_algorithm_module(test_alg_path, alg))
+            main_file = os.path.join(
+                test_alg_path, 'algorithms', alg, 'main.py')
+            with open(main_file, 'a') as f:
+                f.write('\n# Ni!\n')
+            reloaded = get_algorithm_module(test_alg_path, alg)
+            self.assertFalse(m is reloaded)
+            self.assertTrue(
+                reloaded is get_algorithm_module(test_alg_path, alg))
+        finally:
+            self.app.config['ALGORITHM_RELOAD'] = False
+
+    def test_chain_run_dag_scheduler(self):
+        print(
+            'Chains run with the DAG scheduler should produce the same '
+            'ledger history as sequential runs'
+        )
+        shutil.rmtree(test_alg_path)
+        sys.path.append(test_alg_path)
+        subprocess.call(['alg', 'cp', 'test_project', '-e', '-q'])
+        from algorithm_toolkit import AlgorithmChain
+        self.app.config['CHAIN_SCHEDULER'] = 'dag'
+        try:
+            self.ac = AlgorithmChain(test_alg_path, get_test_run_chain())
+            self.cl = self.ac.create_ledger('dinsdalepiranha')
+            self.cl.make_working_folders()
+            response = self.ac.call_chain_algorithms()
+            self.cl.remove_working_folders()
+        finally:
+            self.app.config['CHAIN_SCHEDULER'] = 'sequential'
+
+        self.assertEqual(response['output_type'], 'geo_raster')
+        self.assertEqual(
+            [h['algorithm_name'] for h in self.cl.history],
+            ['getmaptiles_roi', 'stitch_tiles', 'output_image_to_client']
+        )
+
     def test_get_request_dict(self):
         print(
             'Test returning a dictionary containing '
@@ -2285,6 +3655,57 @@ class ATKTestCaseFileUtils(TestCase):
         response = utils.file_utils.get_chain_def(test_alg_path)
         self.assertEqual(response, {})
 
+    def test_get_chain_def_cached(self):
+        from algorithm_toolkit import utils
+        print(
+            'Chain definitions should be served from the registry until '
+            'a chain file changes'
+        )
+        os.makedirs(os.path.join(test_alg_path, 'chains'))
+        chain_path = os.path.join(test_alg_path, 'chains', 'spam.json')
+        with open(chain_path, 'w') as json_file:
+            json_file.write(json.dumps({'spam': [{'algorithm': 'eggs'}]}))
+
+        first = utils.file_utils.get_chain_def(test_alg_path, shared=True)
+        second = utils.file_utils.get_chain_def(test_alg_path, shared=True)
+        self.assertTrue(first is second)
+
+        # unshared copies can be changed without touching the registry
+        copied = utils.file_utils.get_chain_def(test_alg_path, 'spam')
+        copied.append({'algorithm': 'bacon'})
+        self.assertEqual(
+            utils.file_utils.get_chain_def(test_alg_path, 'spam'),
+            [{'algorithm': 'eggs'}]
+        )
+
+        with open(chain_path, 'w') as json_file:
+            json_file.write(json.dumps(
+                {'spam': [{'algorithm': 'eggs'}, {'algorithm': 'ham'}]}))
+        response = utils.file_utils.get_chain_def(test_alg_path, 'spam')
+        self.assertEqual(len(response), 2)
+        shutil.rmtree(test_alg_path)
+
+    def test_get_algorithm_cached(self):
+        from algorithm_toolkit import utils
+        print(
+            'Algorithm definitions should be re-read only when '
+            'the file changes'
+        )
+        with open('testalgorithm.json', 'w') as json_file:
+            json_file.write(json.dumps({'name': 'splunge'}))
+
+        first = utils.file_utils.get_algorithm(
+            'testalgorithm.json', shared=True)
+        second = utils.file_utils.get_algorithm(
+            'testalgorithm.json', shared=True)
+        self.assertTrue(first is second)
+
+        with open('testalgorithm.json', 'w') as json_file:
+            json_file.write(json.dumps({'name': 'splunge_two'}))
+        response = utils.file_utils.get_algorithm('testalgorithm.json')
+        self.assertEqual(response, {'name': 'splunge_two'})
+        os.remove('testalgorithm.json')
+
 
 class ATKTestCaseDataUtils(TestCase):
 
@@ -2321,6 +3742,313 @@ class ATKTestCaseDataUtils(TestCase):
             self.assertFalse(any(s for s in symbols if s in response))
 
 
+class ATKTestCaseBatchUtils(TestCase):
+
+    def create_app(self):
+        from algorithm_toolkit import app
+        return app
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_batch_ledger(self):
+        from algorithm_toolkit import utils
+        print('Batch ledgers should be written and read a page at a time')
+        self.app.config['CHAIN_LEDGER_HISTORY_PATH'] = '/tmp/test_history'
+        try:
+            writer = utils.batch_utils.BatchLedgerWriter(
+                '/tmp', 'spam', {'iterations': 4})
+            for x in range(4):
+                response = {'output_type': 'integer', 'output_value': x}
+                if x == 3:
+                    response = {'output_type': 'error', 'output_value': ''}
+                writer.write(x, x * 10, response, {'atk_chain_metadata': []})
+
+            # readable while the job is still running
+            ledger = utils.batch_utils.read_batch_ledger('/tmp', 'spam')
+            self.assertEqual(ledger['manifest']['state'], 'running')
+            self.assertEqual(len(ledger['records']), 4)
+
+            writer.close('complete')
+            ledger = utils.batch_utils.read_batch_ledger(
+                '/tmp', 'spam', offset=1, limit=2)
+            self.assertEqual(ledger['manifest']['completed'], 4)
+            self.assertEqual(ledger['manifest']['errors'], 1)
+            self.assertEqual(ledger['manifest']['state'], 'complete')
+            self.assertEqual(
+                [r['iteration_value'] for r in ledger['records']], [10, 20])
+
+            # a partly written last line is skipped
+            with open(writer.ledger_path, 'a') as ledger_file:
+                ledger_file.write('{"iteration": 4, "iter')
+            ledger = utils.batch_utils.read_batch_ledger(
+                '/tmp', 'spam', offset=3)
+            self.assertEqual(len(ledger['records']), 1)
+
+            self.assertIsNone(
+                utils.batch_utils.read_batch_ledger('/tmp', 'eggs'))
+        finally:
+            del self.app.config['CHAIN_LEDGER_HISTORY_PATH']
+            shutil.rmtree('/tmp/test_history', ignore_errors=True)
+
+    def test_get_batch_ledger(self):
+        from algorithm_toolkit import utils
+        print('Batch ledgers should be served a page at a time')
+        self.app.config['CHAIN_LEDGER_HISTORY_PATH'] = '/tmp/test_history'
+        try:
+            writer = utils.batch_utils.BatchLedgerWriter(
+                test_alg_path, 'spam', {'iterations': 4})
+            for x in range(4):
+                response = {'output_type': 'integer', 'output_value': x}
+                writer.write(x, x * 10, response, {'atk_chain_metadata': []})
+            writer.close('complete')
+
+            data = {
+                'management_api_key': 'testmanagementkey',
+                'run_mode': 'batch',
+                'offset': 1,
+                'limit': 2
+            }
+            response = self.client.get('/get_ledger/spam/', query_string=data)
+            self.assert200(response)
+            ledger = json.loads(response.data)
+            self.assertEqual(ledger['offset'], 1)
+            self.assertEqual(ledger['limit'], 2)
+            self.assertEqual(ledger['manifest']['completed'], 4)
+            self.assertEqual(
+                [r['iteration_value'] for r in ledger['records']], [10, 20])
+
+            data['offset'] = 3
+            response = self.client.get('/get_ledger/spam/', query_string=data)
+            ledger = json.loads(response.data)
+            self.assertEqual(
+                [r['iteration_value'] for r in ledger['records']], [30])
+
+            response = self.client.get('/get_ledger/eggs/', query_string=data)
+            self.assertEqual(json.loads(response.data), 'Ledger not found')
+
+            for offset, limit in [(-1, 2), (1, -2), ('spam', 2), (1, 'eggs')]:
+                data['offset'] = offset
+                data['limit'] = limit
+                response = self.client.get(
+                    '/get_ledger/spam/', query_string=data)
+                self.assert400(response)
+                self.assertEqual(response.data, b'Invalid offset or limit')
+        finally:
+            del self.app.config['CHAIN_LEDGER_HISTORY_PATH']
+            shutil.rmtree('/tmp/test_history', ignore_errors=True)
+
+    def test_checkpoint(self):
+        import numpy as np
+        from algorithm_toolkit import utils
+        print('Chain checkpoints should be saved, loaded and resumed')
+        checkpoint_utils = utils.checkpoint_utils
+        self.app.config['CHAIN_LEDGER_HISTORY_PATH'] = '/tmp/test_history'
+        try:
+            history = [{'algorithm_name': 'spam', 'eggs': np.arange(3)}]
+            checkpoint_utils.save_checkpoint(
+                '/tmp', 'spam', {'chain': {}, 'history': history})
+            checkpoint = checkpoint_utils.load_checkpoint('/tmp', 'spam')
+            self.assertEqual(
+                checkpoint['history'][0]['eggs'].tolist(), [0, 1, 2])
+
+            # later entries are appended; one cut short is skipped
+            checkpoint_utils.append_checkpoint(
+                '/tmp', 'spam', [{'algorithm_name': 'eggs'}])
+            checkpoint_path = checkpoint_utils.get_checkpoint_path(
+                '/tmp', 'spam')
+            with open(checkpoint_path, 'ab') as f:
+                f.write(b'\x80\x05\x95')
+            checkpoint = checkpoint_utils.load_checkpoint('/tmp', 'spam')
+            self.assertEqual(checkpoint['chain'], {})
+            self.assertEqual(
+                [h['algorithm_name'] for h in checkpoint['history']],
+                ['spam', 'eggs']
+            )
+
+            checkpoint_utils.remove_checkpoint('/tmp', 'spam')
+            self.assertIsNone(checkpoint_utils.load_checkpoint('/tmp', 'spam'))
+
+            # API clients post without a CSRF token
+            self.app.config['WTF_CSRF_ENABLED'] = True
+            try:
+                response = self.client.post(
+                    '/chain_resume/spam/', data={'api_key': 'testkey'})
+            finally:
+                self.app.config['WTF_CSRF_ENABLED'] = False
+            self.assert404(response)
+            self.assertEqual(response.data, b'Checkpoint not found')
+
+            # status keys name pickle files: only plain ids are accepted
+            self.assertFalse(checkpoint_utils.is_valid_status_key('../spam'))
+            self.assertFalse(checkpoint_utils.is_valid_status_key('..'))
+            self.assertTrue(checkpoint_utils.is_valid_status_key('spam-1.2'))
+            with self.assertRaises(ValueError):
+                checkpoint_utils.save_checkpoint(
+                    '/tmp', '../spam', {'chain': {}, 'history': history})
+            self.assertIsNone(
+                checkpoint_utils.load_checkpoint('/tmp', 'eggs/../spam'))
+
+            # a missing checkpoint leaves no working folder behind
+            from algorithm_toolkit import AlgorithmChain
+            from algorithm_toolkit.utils.home_utils import (
+                execute_chain_request)
+            response = execute_chain_request({
+                'chain': get_test_run_chain(),
+                'status_key': 'spam',
+                'run_mode': 'single',
+                'iter_param': None,
+                'iter_type': None,
+                'iter_value': None,
+                'resume': True
+            }, os.path.join(this_path, 'cli', 'examples', 'project'))
+            self.assertEqual(response, ('Checkpoint not found', 404))
+            self.assertFalse(os.path.exists(
+                AlgorithmChain.ChainLedger('spam').get_working_folder()))
+        finally:
+            del self.app.config['CHAIN_LEDGER_HISTORY_PATH']
+            shutil.rmtree('/tmp/test_history', ignore_errors=True)
+
+    def test_sweep_values(self):
+        from algorithm_toolkit import utils
+        print('Sweep values should combine every iterated parameter')
+        BatchValues = utils.batch_utils.BatchValues
+        dims = [
+            ('spam__a', BatchValues(lambda: iter([1, 2]), total=2)),
+            ('eggs__b', BatchValues(lambda: iter('xyz')))
+        ]
+        values = utils.batch_utils.get_sweep_values(dims)
+        self.assertEqual(values.total, 6)
+        self.assertEqual(list(values)[:2], [
+            {'spam__a': 1, 'eggs__b': 'x'}, {'spam__a': 1, 'eggs__b': 'y'}])
+
+        values = utils.batch_utils.get_sweep_values(dims, 'zip')
+        self.assertEqual(list(values), [
+            {'spam__a': 1, 'eggs__b': 'x'}, {'spam__a': 2, 'eggs__b': 'y'}])
+
+    def test_batch_workers(self):
+        from flask import request
+        from algorithm_toolkit.utils.home_utils import (
+            check_chain_request_form)
+        print('Requested batch workers should be checked and capped')
+        path = os.path.join(this_path, 'cli', 'examples', 'project')
+        data = {
+            'chain': json.dumps(get_test_run_chain()),
+            'run_mode': 'batch',
+            'iter_param': 'getmaptiles_roi__zoom',
+            'iter_type': 'range',
+            'iter_value': '9,11'
+        }
+        for workers, expected in [('3', 3), ('1000', 16)]:
+            data['batch_workers'] = workers
+            with self.app.test_request_context(query_string=data):
+                checked_response = check_chain_request_form(
+                    request, 'map_tiles', path)
+            self.assertEqual(checked_response['batch_workers'], expected)
+
+        for workers in ['0', '-2', 'many']:
+            data['batch_workers'] = workers
+            with self.app.test_request_context(query_string=data):
+                response = check_chain_request_form(
+                    request, 'map_tiles', path)
+            self.assert400(response)
+            self.assertEqual(response.data, b'Batch mode misconfigured')
+
+    def test_batch_stage(self):
+        import threading
+        from algorithm_toolkit import utils
+        print('Pipeline stages should queue items and report their stats')
+        stage = utils.batch_utils.BatchStage('spam', 1)
+        stop = threading.Event()
+        self.assertTrue(stage.put('eggs', stop))
+        stats = stage.get_stats()
+        self.assertEqual(stats['algorithm'], 'spam')
+        self.assertEqual(stats['queue_depth'], 1)
+        self.assertEqual(stats['completed'], 0)
+
+        self.assertEqual(stage.get(stop), 'eggs')
+        stop.set()
+        self.assertFalse(stage.put('ham', stop))
+        self.assertIsNone(stage.get(stop))
+
+    def test_batch_values(self):
+        from algorithm_toolkit import utils
+        print('Batch iterators should produce their values lazily')
+        get_batch_values = utils.batch_utils.get_batch_values
+        test_dir = '/tmp/test_batch_values'
+        self.app.config['CHAIN_LEDGER_HISTORY_PATH'] = test_dir
+        try:
+            os.makedirs(test_dir)
+            for name in ['spam.txt', 'eggs.txt', 'ham.csv']:
+                open(os.path.join(test_dir, name), 'w').close()
+            with open(os.path.join(test_dir, 'lines.txt'), 'w') as f:
+                f.write('spam\n\neggs\n')
+            with open(os.path.join(test_dir, 'rows.csv'), 'w') as f:
+                f.write('zoom,name\n9,spam\n10,eggs\n')
+            with open(os.path.join(test_dir, 'records.jsonl'), 'w') as f:
+                f.write('{"a": 1}\n[2]\n')
+            array, ref = utils.array_utils.create_array_file(
+                test_dir, 'tiles', (2, 2), 'int64')
+            array[:] = [[1, 2], [3, 4]]
+            array.flush()
+            with open(os.path.join(test_dir, 'gumby.json'), 'w') as f:
+                f.write(json.dumps({'atk_chain_metadata': [
+                    {'algorithm_name': 'spam', 'zooms': [9, 10, 11]},
+                    {'algorithm_name': 'eggs', 'tiles': ref}
+                ]}))
+
+            values, msg = get_batch_values(
+                '', 'spam__file', 'files', os.path.join(test_dir, '*.txt'))
+            self.assertIsNone(values.total)
+            self.assertEqual(len(list(values)), 3)
+            values.count()
+            self.assertEqual(values.total, 3)
+
+            tests = [
+                ('range', '1,9,4', [1, 5, 9]),
+                ('linspace', '0,1,3', [0.0, 0.5, 1.0]),
+                ('lines', 'lines.txt', ['spam', 'eggs']),
+                ('csv', 'rows.csv', ['9', '10']),
+                ('jsonl', 'records.jsonl', [{'a': 1}, [2]]),
+                ('ledger', 'gumby,zooms', [9, 10, 11]),
+                ('ledger', 'gumby,eggs,tiles', [[1, 2], [3, 4]])
+            ]
+            for iter_type, iter_value, expected in tests:
+                if iter_type in ['lines', 'csv', 'jsonl']:
+                    iter_value = os.path.join(test_dir, iter_value)
+                values, msg = get_batch_values(
+                    '', 'spam__zoom', iter_type, iter_value)
+                self.assertEqual(list(values), expected)
+
+            # whole rows when no column matches the parameter
+            values, msg = get_batch_values(
+                '', 'spam__roi', 'csv', os.path.join(test_dir, 'rows.csv'))
+            self.assertEqual(next(iter(values)), {'zoom': '9', 'name': 'spam'})
+
+            errors = [
+                ('files', os.path.join(test_dir, '*.tif'), 'Empty batch'),
+                ('range', '9', 'Invalid iterator'),
+                ('linspace', '0,1,0', 'Empty batch'),
+                ('lines', '/tmp/nudge_nudge.txt', 'Batch file not found'),
+                ('ledger', 'gumby,spam,zooms,x', 'Invalid iterator'),
+                ('ledger', 'gumby,spam,tiles', 'Batch ledger value not found'),
+                ('ledger', 'gumby,spam,algorithm_name',
+                    'Batch ledger value is not a list'),
+                ('spam', 'eggs', 'Invalid iterator')
+            ]
+            for iter_type, iter_value, expected in errors:
+                values, msg = get_batch_values(
+                    '', 'spam__zoom', iter_type, iter_value)
+                self.assertIsNone(values)
+                self.assertEqual(msg, expected)
+        finally:
+            del self.app.config['CHAIN_LEDGER_HISTORY_PATH']
+            shutil.rmtree(test_dir, ignore_errors=True)
+
+
 class ATKTestCaseDecorators(TestCase):
 
     def create_app(self):